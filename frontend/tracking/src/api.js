@@ -256,6 +256,20 @@ export const userProfileApi = {
 // Overview / Dashboard
 // -------------------------------
 export const fetchOverview = () => api.get("/status/overview/");
+export const fetchClusters = (bbox, zoom) =>
+  api.get("/status/clusters/", { params: { bbox, zoom } });
+
+// Live positions over WebSocket; onPositions receives arrays of
+// { d: device_id, la, lo, s: speed, t: epoch seconds, in: inside_geofence }
+export const connectLivePositions = (onPositions) => {
+  const wsBase = BACKEND_BASE.replace(/^http/, "ws");
+  const socket = new WebSocket(`${wsBase}/ws/positions/?token=${getAuthToken()}`);
+  socket.onmessage = (event) => {
+    const message = JSON.parse(event.data);
+    if (message.type === "positions") onPositions(message.positions);
+  };
+  return socket;
+};
 
 // -------------------------------
 // Alerts
@@ -2,6 +2,8 @@
 ASGI config for smartfarm project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
+HTTP goes to Django; WebSocket connections to /ws/positions/ get the live
+position feed from ``tracking.live``.
 
 For more information on this file, see
 https://docs.djangoproject.com/en/5.1/howto/deployment/asgi/
@@ -13,4 +15,20 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'smartfarm.settings')
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+from tracking.live import positions_socket  # noqa: E402  (needs apps loaded)
+from tracking.liveness import liveness_monitor  # noqa: E402
+
+# Only spawns the timer thread; it reads the liveness table in the background
+liveness_monitor.start()
+
+
+async def application(scope, receive, send):
+    if scope["type"] == "websocket":
+        if scope["path"].rstrip("/") == "/ws/positions":
+            return await positions_socket(scope, receive, send)
+        await receive()
+        await send({"type": "websocket.close", "code": 4404})
+        return
+    return await django_application(scope, receive, send)
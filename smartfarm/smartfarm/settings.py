@@ -50,6 +50,7 @@ MIDDLEWARE = [
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'tracking.sharding.ShardScopeMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
      'corsheaders.middleware.CorsMiddleware',
@@ -96,6 +97,22 @@ DATABASES = {
     }
 }
 
+# Optional per-owner sharding of telemetry and alerts (tracking/sharding.py).
+# SHARDS > 0 adds shard_0 .. shard_<SHARDS-1>; create them with
+# `python manage.py migrate --database=shard_<n>`, then move rows stored so far
+# with `python manage.py shard_telemetry`.
+TRACKING_SHARDING = {
+    "SHARDS": 0,
+}
+DATABASES.update({
+    f'shard_{i}': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': BASE_DIR / f'shard_{i}.sqlite3',
+    }
+    for i in range(TRACKING_SHARDING["SHARDS"])
+})
+DATABASE_ROUTERS = ["tracking.sharding.OwnerShardRouter"]
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.1/ref/settings/#auth-password-validators
@@ -137,7 +154,7 @@ STATIC_URL = 'static/'
 # https://docs.djangoproject.com/en/5.1/ref/settings/#default-auto-field
 REST_FRAMEWORK = {
     "DEFAULT_AUTHENTICATION_CLASSES": (
-        "rest_framework_simplejwt.authentication.JWTAuthentication",
+        "tracking.authentication.CachedJWTAuthentication",
     ),
     "DEFAULT_PERMISSION_CLASSES": (
         "rest_framework.permissions.IsAuthenticated",
@@ -155,4 +172,164 @@ SIMPLE_JWT = {
     'AUTH_HEADER_TYPES': ('Bearer',),
     'AUTH_TOKEN_CLASSES': ('rest_framework_simplejwt.tokens.AccessToken',),
 }
-APPEND_SLASH = True
\ No newline at end of file
+APPEND_SLASH = True
+
+# Clustered positions (tracking.clustering): per-process grids are rebuilt
+# from the DB after this many seconds, to pick up other workers' fixes.
+TRACKING_CLUSTER_REFRESH_SECONDS = 30
+
+# The live position socket (tracking.live, served by smartfarm.asgi) fans out
+# fixes in process memory. Serve it and the ingest endpoints from one ASGI
+# worker; fixes stored by other processes only show up in the connect snapshot.
+
+# Dashboard response cache (tracking.cache). "sqlite" shares entries and
+# owner versions between workers; "locmem" is only correct with one process.
+TRACKING_RESPONSE_CACHE = {
+    'BACKEND': 'sqlite',
+    'LOCATION': BASE_DIR / 'response_cache.sqlite3',
+    'MAX_ENTRIES': 2000,
+}
+
+# Alert policy defaults (tracking.alerting); owners override the speed limit,
+# cooldown and boundary warning distance on their OwnerProfile.
+TRACKING_ALERTS = {
+    'SPEED_LIMIT_KMH': 40,
+    'COOLDOWN_SECONDS': 300,
+    'BOUNDARY_WARNING_M': 20.0,
+    'FLUSH_BURST': 3,
+    'FLUSH_PER_MINUTE': 2,
+    # New alerts per device and type: burst, then this many an hour
+    'RAISE_BURST': 3,
+    'RAISE_PER_HOUR': 6,
+    # /api/alerts/ page size (?limit= up to MAX_PAGE_SIZE)
+    'PAGE_SIZE': 100,
+    'MAX_PAGE_SIZE': 500,
+    # Largest id list accepted by /api/alerts/bulk-resolve/ and bulk-delete/
+    'MAX_BULK_IDS': 5000,
+}
+
+# Resolved alerts older than AFTER_DAYS move to AlertArchive in batches
+# (python manage.py archive_alerts, run from cron).
+TRACKING_ALERT_ARCHIVE = {
+    'AFTER_DAYS': 30,
+    'BATCH_SIZE': 1000,
+}
+
+# Geofence simplification on save. A tolerance of 0 keeps fences as drawn
+# unless the request sends simplify_tolerance_m.
+TRACKING_GEOFENCE_SIMPLIFY = {
+    'DEFAULT_TOLERANCE_M': 0,
+    'MAX_INWARD_M': 1.0,
+}
+
+# Background re-evaluation after geofence edits (tracking.reevaluation).
+# HISTORY_HOURS > 0 also rewrites inside_geofence on older fixes.
+TRACKING_GEOFENCE_REEVALUATION = {
+    'WORKERS': 2,
+    'BATCH_SIZE': 200,
+    'HISTORY_HOURS': 0,
+}
+
+# Device liveness monitor (tracking.liveness)
+TRACKING_LIVENESS = {
+    'OFFLINE_AFTER_SECONDS': 900,
+    'PERSIST_SECONDS': 60,
+    # How often the monitor retries reading its table before `migrate` has run
+    'WARM_RETRY_SECONDS': 60,
+}
+
+# Admission control for gps_data/device_config (tracking.throttling).
+# Rates are tokens per second; bursts are bucket sizes.
+TRACKING_INGEST_THROTTLE = {
+    'IP_RATE': 20.0,
+    'IP_BURST': 200,
+    'DEVICE_RATE': 1.0,
+    'DEVICE_BURST': 30,
+    'REJECT_UNKNOWN_DEVICES': True,
+}
+
+# Resolved-user cache for tracking.authentication.CachedJWTAuthentication
+TRACKING_AUTH_CACHE = {
+    'TTL_SECONDS': 30,
+    'MAX_USERS': 1000,
+}
+
+# Activity heatmaps (tracking.heatmap, needs numpy). Grids larger than
+# MAX_CELLS get coarser cells.
+TRACKING_HEATMAP = {
+    'CELL_M': 50.0,
+    'MAX_CELLS': 250000,
+    'CHUNK_SIZE': 50000,
+}
+
+# Livestock behaviour classification (tracking.behaviour, needs numpy).
+# Rates are metres per second over a rolling WINDOW_MINUTES window.
+TRACKING_LIVESTOCK_BEHAVIOUR = {
+    'WINDOW_MINUTES': 5,
+    'RESTING_MAX_MPS': 0.05,
+    'WALKING_MIN_MPS': 0.4,
+    'BASELINE_DAYS': 7,
+    'LOW_ACTIVITY_RATIO': 0.5,
+    'MIN_DISTANCE_M': 150.0,
+}
+
+# Per-device GPS noise filter in the ingest path (tracking.smoothing).
+# Fixes implying more than MAX_SPEED_KMH from the filtered track are outliers.
+TRACKING_NOISE_FILTER = {
+    'ENABLED': True,
+    'MEASUREMENT_SIGMA_M': 8.0,
+    'ACCEL_SIGMA_MPS2': 0.5,
+    'MAX_SPEED_KMH': 120.0,
+    'MAX_REJECTS': 3,
+    'RESET_AFTER_SECONDS': 600,
+}
+
+# Device poll intervals by distance to the nearest fence edge (tracking.boundary).
+# Devices within twice the owner's boundary warning distance poll fastest.
+TRACKING_BOUNDARY = {
+    'POLL_SECONDS': 5,
+    'NEAR_POLL_SECONDS': 2,
+    'DEEP_POLL_SECONDS': 30,
+    'DEEP_INSIDE_M': 200.0,
+    # Adaptive report interval; per-owner bounds live on OwnerProfile
+    'MIN_REPORT_SECONDS': 2,
+    'MAX_REPORT_SECONDS': 300,
+    'SPACING_M': 25.0,
+}
+
+# Raw UDP/TCP telemetry listener (manage.py run_telemetry_listener)
+TRACKING_LISTENER = {
+    'HOST': '0.0.0.0',
+    'UDP_PORT': 5005,
+    'TCP_PORT': 5006,
+    'BATCH_SIZE': 1000,
+    'FLUSH_MS': 50,
+    'MAX_PENDING': 100000,
+}
+
+# Geofence dwell/attendance intervals (tracking.dwell). A reporting gap longer
+# than MAX_GAP_MINUTES ends an interval; reports schedule a background refresh
+# (set REFRESH_IN_BACKGROUND False to rely on build_geofence_intervals from cron).
+TRACKING_DWELL = {
+    'MAX_GAP_MINUTES': 30,
+    'CHUNK_SIZE': 20000,
+    'DEVICES_PER_BATCH': 200,
+    'REFRESH_IN_BACKGROUND': True,
+}
+
+# Cold archive of old telemetry (tracking.cold_archive, needs numpy). Days that
+# ended more than AFTER_DAYS ago are packed into column files under ROOT by
+# python manage.py pack_cold_telemetry (run daily from cron).
+TRACKING_COLD_ARCHIVE = {
+    'ROOT': BASE_DIR / 'cold_archive',
+    'AFTER_DAYS': 30,
+    'CHUNK_SIZE': 50000,
+}
+
+# Encoded track payloads (tracking.track_encoding): history with ?encoded=1
+# and /api/status/trails/. PRECISION is the polyline's decimal places.
+TRACKING_TRACK_ENCODING = {
+    'PRECISION': 5,
+    'SPEED_FACTOR': 10,
+    'TRAIL_MINUTES': 30,
+}
@@ -0,0 +1,17 @@
+"""
+Settings for running the test suite with two owner shards:
+
+    python manage.py test tracking --settings=smartfarm.settings_sharded_test
+"""
+from .settings import *  # noqa: F401,F403
+
+TRACKING_SHARDING = {
+    "SHARDS": 2,
+}
+DATABASES.update({
+    f'shard_{i}': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': BASE_DIR / f'shard_{i}.sqlite3',
+    }
+    for i in range(TRACKING_SHARDING["SHARDS"])
+})
@@ -14,3 +14,8 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'smartfarm.settings')
 
 application = get_wsgi_application()
+
+from tracking.liveness import liveness_monitor  # noqa: E402  (needs apps loaded)
+
+# Only spawns the timer thread; it reads the liveness table in the background
+liveness_monitor.start()
@@ -0,0 +1,82 @@
+"""
+Archiving of resolved alerts.
+
+Resolved alerts older than AFTER_DAYS are copied to AlertArchive and deleted
+from Alert a batch at a time, each batch in its own short transaction, so the
+hot table that the alert list and SSE poll read stays small and no lock is
+held for long. Old rows sit at the low end of the primary key, so each batch
+is found by a short scan in id order. With sharding, every database archives
+its own alerts.
+"""
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from . import counters
+from .models import Alert, AlertArchive
+from .sharding import databases
+
+DEFAULTS = {
+    "AFTER_DAYS": 30,
+    "BATCH_SIZE": 1000,
+}
+
+
+def archive_setting(name):
+    return getattr(settings, "TRACKING_ALERT_ARCHIVE", {}).get(name, DEFAULTS[name])
+
+
+def archive_resolved_alerts(after_days=None, batch_size=None, max_batches=None, dry_run=False, log=None):
+    """Move resolved alerts older than `after_days` to AlertArchive; returns how many moved"""
+    after_days = archive_setting("AFTER_DAYS") if after_days is None else after_days
+    batch_size = batch_size or archive_setting("BATCH_SIZE")
+    cutoff = timezone.now() - timedelta(days=after_days)
+
+    moved = batches = 0
+    # Each shard archives into its own AlertArchive, in its own transactions
+    for db in databases():
+        candidates = Alert.objects.using(db).filter(is_resolved=True, created_at__lt=cutoff)
+        if dry_run:
+            moved += candidates.count()
+            continue
+
+        last_id = 0
+        while max_batches is None or batches < max_batches:
+            with transaction.atomic(using=db):
+                batch = list(
+                    candidates.filter(id__gt=last_id).order_by("id").values(
+                        "id", "owner_id", "alert_type", "message", "created_at", "occurrence_count", "last_seen_at",
+                        "gps_data__device_id", "gps_data__timestamp", "gps_data__latitude", "gps_data__longitude",
+                    )[:batch_size]
+                )
+                if not batch:
+                    break
+                AlertArchive.objects.using(db).bulk_create(
+                    [
+                        AlertArchive(
+                            alert_id=row["id"],
+                            owner_id=row["owner_id"],
+                            alert_type=row["alert_type"],
+                            message=row["message"],
+                            created_at=row["created_at"],
+                            occurrence_count=row["occurrence_count"],
+                            last_seen_at=row["last_seen_at"],
+                            device_id=row["gps_data__device_id"],
+                            fix_timestamp=row["gps_data__timestamp"],
+                            latitude=row["gps_data__latitude"],
+                            longitude=row["gps_data__longitude"],
+                        )
+                        for row in batch
+                    ],
+                    ignore_conflicts=True,
+                )
+                last_id = batch[-1]["id"]
+                with counters.batched(using=db):
+                    candidates.filter(pk__in=[row["id"] for row in batch]).delete()
+            moved += len(batch)
+            batches += 1
+            if log:
+                log(f"{moved} alerts archived ({db} up to id {last_id})")
+    return moved
@@ -0,0 +1,260 @@
+"""
+In-memory alert policy for the ingest path.
+
+The open alert per (device, alert type) is held in memory, warmed once from the
+DB on first use, so deciding whether a fix raises a new alert costs no query.
+Repeated triggers within the cooldown are coalesced into the open alert: they
+bump an occurrence count and last-seen time, written back through a token
+bucket so a long burst costs a handful of UPDATEs rather than one per fix.
+
+New alerts are rate limited per (device, alert type) by a second token bucket
+(RAISE_BURST, RAISE_PER_HOUR). Over that rate a trigger past the cooldown is
+coalesced into the open alert instead of opening another, and a trigger with
+no open alert (say a device flapping across a fence) is dropped.
+
+State is per process; with several workers each one keeps its own view. The
+write-back only touches the alert while it is unresolved, so an alert resolved
+by another process is noticed at the next write-back and the fix that found it
+opens a new one. Alert
+ids are only unique within a database (tracking.sharding), so open alerts are
+tracked together with the database they live in.
+"""
+import threading
+from collections import namedtuple
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import router, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .boundary import boundary_setting
+from .cache import response_cache
+from .counters import resolve_alerts
+from .devices import owner_id_for_device
+from .models import Alert, OwnerProfile
+from .ratelimit import TokenBucket
+from .sharding import current_db, databases
+
+DEFAULTS = {
+    "SPEED_LIMIT_KMH": 40.0,
+    "COOLDOWN_SECONDS": 300,
+    "BOUNDARY_WARNING_M": 20.0,
+    "FLUSH_BURST": 3,
+    "FLUSH_PER_MINUTE": 2,
+    "RAISE_BURST": 3,
+    "RAISE_PER_HOUR": 6,
+    "PAGE_SIZE": 100,
+    "MAX_PAGE_SIZE": 500,
+    "MAX_BULK_IDS": 5000,
+}
+
+
+Thresholds = namedtuple(
+    "Thresholds", "speed_limit cooldown boundary_warning_m min_report_seconds max_report_seconds"
+)
+
+
+def alert_setting(name):
+    return getattr(settings, "TRACKING_ALERTS", {}).get(name, DEFAULTS[name])
+
+
+class _OpenAlert:
+    __slots__ = ("db", "alert_id", "opened_at", "pending", "last_seen", "bucket")
+
+    def __init__(self, db, alert_id, opened_at):
+        self.db = db
+        self.alert_id = alert_id
+        self.opened_at = opened_at
+        self.pending = 0
+        self.last_seen = opened_at
+        self.bucket = TokenBucket(alert_setting("FLUSH_BURST"), alert_setting("FLUSH_PER_MINUTE") / 60.0)
+
+
+class AlertPolicy:
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._open = {}
+        # (database, alert id) -> key in _open, so closing an alert needs only its id
+        self._keys = {}
+        self._thresholds = {}
+        # (device_id, alert_type) -> TokenBucket admitting new alerts
+        self._raise_buckets = {}
+        self._warm = False
+        self._key_locks = [threading.Lock() for _ in range(64)]
+
+    # ---------- thresholds ----------
+    def thresholds(self, owner_id):
+        """
+        Thresholds (speed limit km/h, cooldown, boundary warning m, report
+        interval bounds) for an owner, cached until the profile changes
+        """
+        with self._lock:
+            if owner_id in self._thresholds:
+                return self._thresholds[owner_id]
+
+        row = None
+        if owner_id is not None:
+            row = OwnerProfile.objects.filter(user_id=owner_id).values_list(
+                "speed_limit_kmh", "alert_cooldown_seconds", "boundary_warning_m",
+                "min_report_seconds", "max_report_seconds",
+            ).first()
+        speed_limit, cooldown, boundary_warning, min_report, max_report = row or (
+            alert_setting("SPEED_LIMIT_KMH"), alert_setting("COOLDOWN_SECONDS"), alert_setting("BOUNDARY_WARNING_M"),
+            boundary_setting("MIN_REPORT_SECONDS"), boundary_setting("MAX_REPORT_SECONDS"),
+        )
+        value = Thresholds(speed_limit, timedelta(seconds=cooldown), boundary_warning, min_report, max_report)
+
+        with self._lock:
+            self._thresholds[owner_id] = value
+        return value
+
+    def forget_thresholds(self, owner_id):
+        with self._lock:
+            self._thresholds.pop(owner_id, None)
+
+    # ---------- open alerts ----------
+    def _ensure_warm(self):
+        if self._warm:
+            return
+        for db in databases():
+            rows = Alert.objects.using(db).filter(is_resolved=False).order_by("created_at").values_list(
+                "id", "alert_type", "created_at", "gps_data__device_id"
+            )
+            for alert_id, alert_type, created_at, device_id in rows:
+                self._open[(device_id, alert_type)] = _OpenAlert(db, alert_id, created_at)
+        self._keys = {(state.db, state.alert_id): key for key, state in self._open.items()}
+        self._warm = True
+
+    def _key_lock(self, key):
+        return self._key_locks[hash(key) % len(self._key_locks)]
+
+    def _may_raise(self, key):
+        bucket = self._raise_buckets.get(key)
+        if bucket is None:
+            bucket = self._raise_buckets[key] = TokenBucket(
+                alert_setting("RAISE_BURST"), alert_setting("RAISE_PER_HOUR") / 3600.0
+            )
+        return bucket.consume()
+
+    def raise_alert(self, gps_instance, alert_type, message, cooldown=None):
+        """
+        Create an alert for a fix, or coalesce it into the open one for the same
+        device and type. `cooldown=None` keeps coalescing for as long as the
+        alert stays unresolved. Returns the new Alert, or None if coalesced or
+        over the per-device alert rate.
+        """
+        key = (gps_instance.device_id, alert_type)
+        now = timezone.now()
+
+        # The key lock keeps one device and type in order; the shared lock only guards the dicts
+        with self._key_lock(key):
+            with self._lock:
+                self._ensure_warm()
+                state = self._open.get(key)
+                coalesce = state is not None and (cooldown is None or now - state.opened_at < cooldown)
+                if not coalesce and not self._may_raise(key):
+                    if state is None:
+                        return None
+                    coalesce = True
+                if coalesce:
+                    state.pending += 1
+                    state.last_seen = now
+                    if not state.bucket.consume():
+                        return None
+                pending = self._take_pending(state)
+
+            if coalesce:
+                # The alert may have been resolved by another process; then this fix opens a new one
+                if self._flush(key, state, pending, now):
+                    return None
+                pending = 0
+            elif state is not None and pending:
+                self._flush(key, state, pending, state.last_seen)
+            with self._lock:
+                if state is not None and self._open.get(key) is state:
+                    del self._open[key]
+                    self._keys.pop((state.db, state.alert_id), None)
+
+            # Alongside its fix; the post_save signal moves the owner's counters in this transaction
+            db = router.db_for_write(Alert, instance=gps_instance)
+            with transaction.atomic(using=db):
+                alert = Alert.objects.using(db).create(
+                    gps_data=gps_instance,
+                    owner_id=owner_id_for_device(gps_instance.device_id),
+                    alert_type=alert_type,
+                    message=message,
+                    last_seen_at=now,
+                )
+            with self._lock:
+                self._open[key] = _OpenAlert(db, alert.id, alert.created_at)
+                self._keys[(db, alert.id)] = key
+            return alert
+
+    @staticmethod
+    def _take_pending(state):
+        if state is None:
+            return 0
+        pending, state.pending = state.pending, 0
+        return pending
+
+    def _flush(self, key, state, pending, last_seen):
+        """Add `pending` occurrences to an open alert; False when it is no longer open"""
+        updated = Alert.objects.using(state.db).filter(pk=state.alert_id, is_resolved=False).update(
+            occurrence_count=F("occurrence_count") + pending,
+            last_seen_at=last_seen,
+        )
+        if updated:
+            response_cache.bump(owner_id_for_device(key[0]))
+        return bool(updated)
+
+    def resolve(self, device_id, alert_type):
+        """Resolve the open alert of a device and type, if any; no query when there is none"""
+        key = (device_id, alert_type)
+        with self._key_lock(key):
+            with self._lock:
+                self._ensure_warm()
+                state = self._open.pop(key, None)
+                if state is None:
+                    return False
+                self._keys.pop((state.db, state.alert_id), None)
+                pending = self._take_pending(state)
+            if pending:
+                self._flush(key, state, pending, state.last_seen)
+            resolve_alerts(Alert.objects.using(state.db).filter(pk=state.alert_id))
+        return True
+
+    def alert_closed(self, alert_id, using=None):
+        """Stop coalescing into an alert that was resolved or deleted"""
+        self.alerts_closed([alert_id], using)
+
+    def alerts_closed(self, alert_ids, using=None):
+        """`using` is the alerts' database, by default the current one"""
+        using = using or current_db()
+        with self._lock:
+            for alert_id in alert_ids:
+                key = self._keys.pop((using, alert_id), None)
+                if key is not None:
+                    del self._open[key]
+
+    def forget_devices(self, device_ids, alert_type=None):
+        """Drop open-alert state after a bulk resolve that sent no signals"""
+        device_ids = set(device_ids)
+        with self._lock:
+            # Warming later would bring the forgotten alerts back
+            self._ensure_warm()
+            for key in [k for k in self._open if k[0] in device_ids and alert_type in (None, k[1])]:
+                state = self._open.pop(key)
+                self._keys.pop((state.db, state.alert_id), None)
+
+    def clear(self):
+        """Forget thresholds and open alerts; they are warmed from the database again"""
+        with self._lock:
+            self._open.clear()
+            self._keys.clear()
+            self._thresholds.clear()
+            self._raise_buckets.clear()
+            self._warm = False
+
+
+alert_policy = AlertPolicy()
@@ -4,3 +4,11 @@ from django.apps import AppConfig
 class TrackingConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'tracking'
+
+    def ready(self):
+        from django.db.models.signals import post_migrate
+
+        from . import signals  # noqa: F401
+        from .sharding import seed_sequences
+
+        post_migrate.connect(seed_sequences, sender=self)
@@ -0,0 +1,100 @@
+"""
+JWT authentication that caches the resolved user.
+
+The access token's signature and expiry are still validated on every request,
+and so are the checks simplejwt makes against the user row (is_active and,
+when enabled, the password-change revoke claim). Only the row itself comes
+from a short-lived bounded cache, loaded together with the OwnerProfile.
+Saving or deleting a User or OwnerProfile evicts the entry in this process;
+other workers see the change once TTL_SECONDS expire.
+"""
+import copy
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.utils.translation import gettext_lazy as _
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import InvalidToken
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.utils import get_md5_hash_password
+
+DEFAULTS = {
+    "TTL_SECONDS": 30,
+    "MAX_USERS": 1000,
+}
+
+
+def auth_cache_setting(name):
+    return getattr(settings, "TRACKING_AUTH_CACHE", {}).get(name, DEFAULTS[name])
+
+
+class UserCache:
+    """Keys are str(user id): token claims may carry the id as a string"""
+
+    def __init__(self):
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, user_id):
+        user_id = str(user_id)
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is None:
+                return None
+            user, expires = entry
+            if expires < time.monotonic():
+                del self._entries[user_id]
+                return None
+            self._entries.move_to_end(user_id)
+            return user
+
+    def set(self, user_id, user):
+        user_id = str(user_id)
+        with self._lock:
+            self._entries[user_id] = (user, time.monotonic() + auth_cache_setting("TTL_SECONDS"))
+            self._entries.move_to_end(user_id)
+            while len(self._entries) > auth_cache_setting("MAX_USERS"):
+                self._entries.popitem(last=False)
+
+    def evict(self, user_id):
+        with self._lock:
+            self._entries.pop(str(user_id), None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+user_cache = UserCache()
+
+
+class CachedJWTAuthentication(JWTAuthentication):
+    def get_user(self, validated_token):
+        try:
+            user_id = validated_token[api_settings.USER_ID_CLAIM]
+        except KeyError as e:
+            raise InvalidToken(_("Token contained no recognizable user identification")) from e
+
+        user = user_cache.get(user_id)
+        if user is None:
+            user = (
+                self.user_model.objects.select_related("profile")
+                .filter(**{api_settings.USER_ID_FIELD: user_id})
+                .first()
+            )
+            if user is None:
+                raise AuthenticationFailed(_("User not found"), code="user_not_found")
+            user_cache.set(user_id, user)
+
+        if api_settings.CHECK_USER_IS_ACTIVE and not user.is_active:
+            raise AuthenticationFailed(_("User is inactive"), code="user_inactive")
+
+        if api_settings.CHECK_REVOKE_TOKEN:
+            if validated_token.get(api_settings.REVOKE_TOKEN_CLAIM) != get_md5_hash_password(user.password):
+                raise AuthenticationFailed(_("The user's password has been changed."), code="password_changed")
+
+        # Each request gets its own instance so views can modify it safely
+        return copy.copy(user)
@@ -0,0 +1,209 @@
+"""
+Livestock behaviour classification from collar telemetry.
+
+For every fix of an animal we look back over a short window and compute two
+rates from vectorized rolling sums: path speed (metres travelled / seconds)
+and displacement speed (straight-line distance / seconds). Slow paths are
+resting, fast straight displacement is walking, and everything in between is
+grazing. Each fix accounts for the time until the next one, capped so that
+reporting gaps are not attributed to any state.
+
+Days packed into the cold archive (tracking.cold_archive) are read from its
+columns, so old days can be recomputed after their rows left GPSData.
+
+Results are stored once per animal and day in LivestockActivityDay; dashboards
+read those rows instead of recomputing. A day whose activity index falls well
+below the animal's recent baseline, or an animal that barely moved, is flagged
+as an anomaly.
+"""
+import math
+from collections import defaultdict
+from datetime import datetime, time, timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Avg
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from . import cold_archive
+from .cache import response_cache
+from .geometry import EARTH_RADIUS_M
+from .models import GPSData, Livestock, LivestockActivityDay
+from .sharding import db_for_owner
+
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover - the activity job refuses to run
+    np = None
+
+DEFAULTS = {
+    "WINDOW_MINUTES": 5,
+    "MAX_GAP_MINUTES": 30,
+    "RESTING_MAX_MPS": 0.05,
+    "WALKING_MIN_MPS": 0.4,
+    "BASELINE_DAYS": 7,
+    "LOW_ACTIVITY_RATIO": 0.5,
+    "MIN_DISTANCE_M": 150.0,
+    "MIN_OBSERVED_MINUTES": 360,
+}
+
+RESTING, GRAZING, WALKING = 0, 1, 2
+
+
+def behaviour_setting(name):
+    return getattr(settings, "TRACKING_LIVESTOCK_BEHAVIOUR", {}).get(name, DEFAULTS[name])
+
+
+def day_bounds(day):
+    start = timezone.make_aware(datetime.combine(day, time.min))
+    return start, start + timedelta(days=1)
+
+
+def classify_track(t, lat, lng):
+    """
+    Classify one animal's time-ordered fixes.
+    `t` is epoch seconds; returns (states, minutes per fix, step distances in metres).
+    """
+    ky = math.radians(1) * EARTH_RADIUS_M
+    kx = ky * np.cos(np.radians(lat))
+    x = lng * kx
+    y = lat * ky
+
+    step = np.zeros(len(t))
+    step[1:] = np.hypot(np.diff(x), np.diff(y))
+    travelled = np.cumsum(step)
+
+    # Index of the first fix inside each fix's look-back window
+    start = np.searchsorted(t, t - behaviour_setting("WINDOW_MINUTES") * 60, side="left")
+    start = np.minimum(start, np.arange(len(t)) - 1).clip(min=0)
+    elapsed = t - t[start]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        path_rate = np.where(elapsed > 0, (travelled - travelled[start]) / elapsed, 0.0)
+        displacement_rate = np.where(elapsed > 0, np.hypot(x - x[start], y - y[start]) / elapsed, 0.0)
+
+    states = np.full(len(t), GRAZING, dtype=np.int8)
+    states[path_rate < behaviour_setting("RESTING_MAX_MPS")] = RESTING
+    states[displacement_rate >= behaviour_setting("WALKING_MIN_MPS")] = WALKING
+
+    minutes = np.zeros(len(t))
+    minutes[:-1] = np.minimum(np.diff(t), behaviour_setting("MAX_GAP_MINUTES") * 60) / 60.0
+    return states, minutes, step
+
+
+def summarize_track(t, lat, lng):
+    """Minutes per state, distance and activity index for one animal-day"""
+    states, minutes, step = classify_track(t, lat, lng)
+    gaps = np.diff(t, prepend=t[0]) > behaviour_setting("MAX_GAP_MINUTES") * 60
+    totals = np.bincount(states, weights=minutes, minlength=3)
+    observed = float(minutes.sum())
+    return {
+        "fixes": len(t),
+        "observed_minutes": observed,
+        "resting_minutes": float(totals[RESTING]),
+        "grazing_minutes": float(totals[GRAZING]),
+        "walking_minutes": float(totals[WALKING]),
+        # Jumps across reporting gaps are not walked distance
+        "distance_m": float(step[~gaps].sum()),
+        "activity_index": (float(totals[GRAZING] + totals[WALKING]) / observed) if observed else None,
+    }
+
+
+def _anomaly(summary, baseline):
+    if summary["observed_minutes"] < behaviour_setting("MIN_OBSERVED_MINUTES"):
+        return ""
+    if summary["distance_m"] < behaviour_setting("MIN_DISTANCE_M"):
+        return "barely_moved"
+    if baseline and summary["activity_index"] < baseline * behaviour_setting("LOW_ACTIVITY_RATIO"):
+        return "low_activity"
+    return ""
+
+
+def compute_activity_day(day, owner_id=None):
+    """
+    Classify one day of telemetry for every animal (optionally of one owner)
+    and replace that day's LivestockActivityDay rows. Returns the new rows.
+    """
+    if np is None:
+        raise RuntimeError("numpy is required for livestock behaviour classification")
+
+    animals = Livestock.objects.all()
+    if owner_id is not None:
+        animals = animals.filter(owner_id=owner_id)
+    by_device = {a.device_id: a for a in animals}
+    if not by_device:
+        return []
+
+    start, end = day_bounds(day)
+    tracks = {}
+    by_db = defaultdict(list)
+    for device_id, animal in by_device.items():
+        track = cold_archive.ColdTrack.open(device_id)
+        if track is None or track.covered_until <= start:
+            by_db[db_for_owner(animal.owner_id)].append(device_id)
+            continue
+        cols = cold_archive.load_track(
+            device_id, start, end, include_end=False, using=db_for_owner(animal.owner_id), track=track,
+            columns=("t", "lat", "lng", "filtered_lat", "filtered_lng", "outlier"),
+        )
+        keep = cols["outlier"] == 0
+        if keep.any():
+            tracks[device_id] = (
+                cols["t"][keep] / 1e6,
+                np.where(np.isnan(cols["filtered_lat"]), cols["lat"], cols["filtered_lat"])[keep],
+                np.where(np.isnan(cols["filtered_lng"]), cols["lng"], cols["filtered_lng"])[keep],
+            )
+    fixes = []
+    for db, device_ids in by_db.items():
+        fixes += (
+            GPSData.objects.using(db)
+            .filter(device_id__in=device_ids, timestamp__gte=start, timestamp__lt=end, is_outlier=False)
+            .order_by("device_id", "timestamp")
+            # Noise-filtered positions where available, so GPS jitter does not count as movement
+            .values_list(
+                "device_id", "timestamp",
+                Coalesce("filtered_latitude", "latitude"), Coalesce("filtered_longitude", "longitude"),
+            )
+        )
+
+    baselines = dict(
+        LivestockActivityDay.objects.filter(
+            livestock__in=by_device.values(),
+            date__gte=day - timedelta(days=behaviour_setting("BASELINE_DAYS")),
+            date__lt=day,
+            activity_index__isnull=False,
+        ).values("livestock").annotate(avg=Avg("activity_index")).values_list("livestock", "avg")
+    )
+
+    if fixes:
+        devices = np.array([f[0] for f in fixes], dtype=object)
+        t = np.fromiter((f[1].timestamp() for f in fixes), dtype=np.float64, count=len(fixes))
+        lat = np.fromiter((f[2] for f in fixes), dtype=np.float64, count=len(fixes))
+        lng = np.fromiter((f[3] for f in fixes), dtype=np.float64, count=len(fixes))
+        # Fixes are sorted by device, so each animal is one contiguous slice
+        edges = np.flatnonzero(devices[1:] != devices[:-1]) + 1
+        for lo, hi in zip(np.r_[0, edges], np.r_[edges, len(fixes)]):
+            tracks[devices[lo]] = (t[lo:hi], lat[lo:hi], lng[lo:hi])
+
+    rows = []
+    for device_id in sorted(tracks):
+        animal = by_device[device_id]
+        summary = summarize_track(*tracks[device_id])
+        baseline = baselines.get(animal.id)
+        reason = _anomaly(summary, baseline)
+        rows.append(LivestockActivityDay(
+            livestock=animal,
+            owner_id=animal.owner_id,
+            date=day,
+            baseline_index=baseline,
+            is_anomaly=bool(reason),
+            anomaly_reason=reason,
+            **summary,
+        ))
+
+    with transaction.atomic():
+        LivestockActivityDay.objects.filter(livestock__in=by_device.values(), date=day).delete()
+        LivestockActivityDay.objects.bulk_create(rows, batch_size=500)
+    for owner in {a.owner_id for a in by_device.values()}:
+        response_cache.bump(owner)
+    return rows
@@ -0,0 +1,159 @@
+"""
+Geofence proximity: where a position sits relative to an owner's fences and
+how often a device there should report.
+
+The signed distance to the nearest edge (positive inside) is the largest over
+all active fences, so a point inside any fence is inside, and a point outside
+all of them is as far out as the nearest fence says.
+
+The recommended report interval starts from the proximity tier of
+`poll_seconds` and follows the device's recent motion, taken from its last
+few fixes: a device standing still backs off (half the time it has been seen
+still, so the interval roughly doubles every few fixes), and a moving one
+reports about every SPACING_M metres and at least twice before it could reach
+a fence edge. Results stay within the owner's min/max report seconds. Recent
+fixes are kept per process, like the noise filter's state.
+"""
+import threading
+from collections import OrderedDict, deque, namedtuple
+
+from django.conf import settings
+
+from .geometry import haversine_m
+
+DEFAULTS = {
+    "POLL_SECONDS": 5,
+    "NEAR_POLL_SECONDS": 2,
+    "DEEP_POLL_SECONDS": 30,
+    "DEEP_INSIDE_M": 200.0,
+    "RESOLVE_FACTOR": 1.5,
+    # Owner bounds when the owner has no profile
+    "MIN_REPORT_SECONDS": 2,
+    "MAX_REPORT_SECONDS": 300,
+    "MOTION_FIXES": 5,
+    "STATIONARY_KMH": 1.0,
+    "STATIONARY_M": 15.0,
+    "SPACING_M": 25.0,
+}
+
+# One fix as the motion tracker keeps it; speed is km/h
+RecentFix = namedtuple("RecentFix", "timestamp latitude longitude speed boundary_distance_m")
+Motion = namedtuple("Motion", "speed_kmh displacement_m span_seconds stationary")
+
+
+def boundary_setting(name):
+    return getattr(settings, "TRACKING_BOUNDARY", {}).get(name, DEFAULTS[name])
+
+
+def evaluate_position(geofences, lat, lng):
+    """(inside any fence, signed distance to the nearest relevant edge or None)"""
+    best = None
+    for fence in geofences:
+        distance = fence.boundary_distance_m(lat, lng)
+        if distance is not None and (best is None or distance > best):
+            best = distance
+    return (best is not None and best > 0), best
+
+
+def poll_seconds(distance_m, warning_m):
+    """Report fast near or outside a fence edge, slowly deep inside"""
+    if distance_m is None:
+        return boundary_setting("POLL_SECONDS")
+    if distance_m <= 2 * max(warning_m or 0.0, 0.0):
+        return boundary_setting("NEAR_POLL_SECONDS")
+    if distance_m >= boundary_setting("DEEP_INSIDE_M"):
+        return boundary_setting("DEEP_POLL_SECONDS")
+    return boundary_setting("POLL_SECONDS")
+
+
+def estimate_motion(fixes):
+    """Motion over recent fixes (oldest first), or None with fewer than two"""
+    if len(fixes) < 2:
+        return None
+    first, last = fixes[0], fixes[-1]
+    span = (last.timestamp - first.timestamp).total_seconds()
+    if span <= 0:
+        return None
+    displacement = haversine_m(first.latitude, first.longitude, last.latitude, last.longitude)
+    speed = max(displacement / span * 3.6, last.speed or 0.0)
+    stationary = speed < boundary_setting("STATIONARY_KMH") and displacement < boundary_setting("STATIONARY_M")
+    return Motion(speed, displacement, span, stationary)
+
+
+def report_seconds(fixes, warning_m, bounds=None):
+    """Recommended seconds until the next fix, from recent fixes (oldest first)"""
+    distance = fixes[-1].boundary_distance_m if fixes else None
+    seconds = poll_seconds(distance, warning_m)
+    near = distance is not None and distance <= 2 * max(warning_m or 0.0, 0.0)
+    motion = estimate_motion(fixes)
+    if motion is not None and motion.stationary:
+        seconds = max(seconds, motion.span_seconds / 2)
+        if near:
+            # Still close enough to cross soon after it starts moving
+            seconds = min(seconds, boundary_setting("DEEP_POLL_SECONDS"))
+    elif motion is not None and motion.speed_kmh > 0:
+        mps = motion.speed_kmh / 3.6
+        seconds = min(seconds, boundary_setting("SPACING_M") / mps)
+        if distance is not None and distance > 0:
+            seconds = min(seconds, distance / mps / 2)
+
+    low, high = bounds or (boundary_setting("MIN_REPORT_SECONDS"), boundary_setting("MAX_REPORT_SECONDS"))
+    low = max(1, int(low))
+    high = max(low, int(high))
+    return int(round(min(max(seconds, low), high)))
+
+
+class MotionTracker:
+    """Last few fixes per device, newest last, bounded in devices"""
+
+    def __init__(self, max_devices=100000):
+        self.max_devices = max_devices
+        self._devices = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _entry(self, device_id):
+        entry = self._devices.get(device_id)
+        if entry is None:
+            entry = self._devices[device_id] = deque(maxlen=boundary_setting("MOTION_FIXES"))
+            if len(self._devices) > self.max_devices:
+                self._devices.popitem(last=False)
+        else:
+            self._devices.move_to_end(device_id)
+        return entry
+
+    def observe(self, device_id, fix):
+        with self._lock:
+            entry = self._entry(device_id)
+            # Late uploads say nothing about the current motion
+            if not entry or fix.timestamp > entry[-1].timestamp:
+                entry.append(fix)
+
+    def seed(self, device_id, fixes):
+        """
+        Take stored fixes (oldest first) when they end after the device's
+        newest fix here: other workers and the listener ingest fixes this
+        process never observes. Returns the device's recent fixes.
+        """
+        with self._lock:
+            entry = self._entry(device_id)
+            if fixes and (not entry or fixes[-1].timestamp > entry[-1].timestamp):
+                entry.clear()
+                entry.extend(fixes)
+            return list(entry)
+
+    def recent(self, device_id):
+        """Recent fixes oldest first, or None when the device has not been seen"""
+        with self._lock:
+            entry = self._devices.get(device_id)
+            return list(entry) if entry else None
+
+    def forget(self, device_id):
+        with self._lock:
+            self._devices.pop(device_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._devices.clear()
+
+
+motion_tracker = MotionTracker()
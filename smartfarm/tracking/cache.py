@@ -0,0 +1,195 @@
+"""
+Versioned per-owner response cache for dashboard read endpoints.
+
+Entries are keyed by (owner, endpoint, params, owner version). Model signals
+bump an owner's version whenever data it can see changes, so stale entries are
+simply never read again and no TTL is needed. Old versions fall out of the
+bounded store.
+
+The backend is chosen by settings.TRACKING_RESPONSE_CACHE["BACKEND"]:
+"sqlite" (the default; a file that every worker, the listener and management
+commands share, LOCATION, by default BASE_DIR / "response_cache.sqlite3") or
+"locmem". locmem keeps entries and versions per process, so a write handled
+by one worker never invalidates another worker's entries: use it only when
+a single process serves and writes everything.
+"""
+import hashlib
+import pickle
+import sqlite3
+import threading
+from collections import OrderedDict
+from functools import wraps
+from pathlib import Path
+
+from django.conf import settings
+from rest_framework.response import Response
+
+
+class LocMemBackend:
+    def __init__(self, max_entries=2000, **kwargs):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._versions = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            if key not in self._entries:
+                return None
+            self._entries.move_to_end(key)
+            return self._entries[key]
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def get_version(self, owner_id):
+        with self._lock:
+            return self._versions.get(owner_id, 0)
+
+    def bump_version(self, owner_id):
+        with self._lock:
+            self._versions[owner_id] = self._versions.get(owner_id, 0) + 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._versions.clear()
+
+
+class SQLiteBackend:
+    def __init__(self, location, max_entries=2000, **kwargs):
+        self.location = str(location)
+        self.max_entries = max_entries
+        self._local = threading.local()
+        self._writes = 0
+        with self._connection() as conn:
+            conn.execute("CREATE TABLE IF NOT EXISTS entries (key TEXT PRIMARY KEY, value BLOB)")
+            conn.execute("CREATE TABLE IF NOT EXISTS versions (owner_id INTEGER PRIMARY KEY, version INTEGER)")
+
+    def _connection(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.location, timeout=5)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def get(self, key):
+        row = self._connection().execute("SELECT value FROM entries WHERE key = ?", (key,)).fetchone()
+        return pickle.loads(row[0]) if row else None
+
+    def set(self, key, value):
+        with self._connection() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO entries (key, value) VALUES (?, ?)",
+                (key, pickle.dumps(value, pickle.HIGHEST_PROTOCOL)),
+            )
+            self._writes += 1
+            if self._writes % 100 == 0:
+                conn.execute(
+                    "DELETE FROM entries WHERE rowid <= (SELECT MAX(rowid) FROM entries) - ?",
+                    (self.max_entries,),
+                )
+
+    def get_version(self, owner_id):
+        row = self._connection().execute(
+            "SELECT version FROM versions WHERE owner_id = ?", (owner_id,)
+        ).fetchone()
+        return row[0] if row else 0
+
+    def bump_version(self, owner_id):
+        with self._connection() as conn:
+            conn.execute(
+                "INSERT INTO versions (owner_id, version) VALUES (?, 1) "
+                "ON CONFLICT(owner_id) DO UPDATE SET version = version + 1",
+                (owner_id,),
+            )
+
+    def clear(self):
+        with self._connection() as conn:
+            conn.execute("DELETE FROM entries")
+            conn.execute("DELETE FROM versions")
+
+
+BACKENDS = {
+    "locmem": LocMemBackend,
+    "sqlite": SQLiteBackend,
+}
+
+
+class ResponseCache:
+    def __init__(self):
+        self._backend = None
+        self._lock = threading.Lock()
+
+    @property
+    def backend(self):
+        if self._backend is None:
+            with self._lock:
+                if self._backend is None:
+                    options = dict(getattr(settings, "TRACKING_RESPONSE_CACHE", {}))
+                    backend_class = BACKENDS[options.pop("BACKEND", "sqlite")]
+                    self._backend = backend_class(
+                        location=options.get("LOCATION") or Path(settings.BASE_DIR) / "response_cache.sqlite3",
+                        max_entries=options.get("MAX_ENTRIES", 2000),
+                    )
+        return self._backend
+
+    def make_key(self, owner_id, endpoint, params, versioned=True):
+        """Unversioned keys are for results that later edits cannot change"""
+        digest = hashlib.sha1(repr(sorted(params.items())).encode()).hexdigest()
+        version = self.backend.get_version(owner_id) if versioned else "fixed"
+        return f"{owner_id}:{endpoint}:{digest}:{version}"
+
+    def get(self, key):
+        return self.backend.get(key)
+
+    def set(self, key, value):
+        self.backend.set(key, value)
+
+    def version(self, owner_id):
+        return self.backend.get_version(owner_id)
+
+    def bump(self, owner_id):
+        if owner_id is not None:
+            self.backend.bump_version(owner_id)
+
+    def clear(self):
+        self.backend.clear()
+
+
+response_cache = ResponseCache()
+
+
+def cached_response(endpoint, headers=()):
+    """Cache successful GET responses of an owner-scoped view, with the named headers"""
+    def decorator(view):
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            if request.method != "GET" or not request.user.is_authenticated:
+                return view(request, *args, **kwargs)
+
+            params = {key: request.GET.getlist(key) for key in request.GET}
+            params.update(kwargs)
+            key = response_cache.make_key(request.user.id, endpoint, params)
+            entry = response_cache.get(key)
+            if entry is not None:
+                if not headers:
+                    return Response(entry)
+                data, saved = entry
+                return Response(data, headers=saved)
+
+            response = view(request, *args, **kwargs)
+            if response.status_code == 200:
+                if headers:
+                    response_cache.set(key, (response.data, {h: response[h] for h in headers if h in response}))
+                else:
+                    response_cache.set(key, response.data)
+            return response
+        return wrapper
+    return decorator
@@ -0,0 +1,242 @@
+"""
+Server-side clustering of the latest device positions.
+
+Each owner gets a multi-level grid of web-mercator tile cells. Every cell keeps
+a running count, coordinate sums and inside/outside geofence counts, so a new
+fix only moves one device between cells on each level instead of rebuilding
+anything. Map views then read pre-aggregated clusters for their bounding box.
+
+Grids are per process and only see the fixes this process ingests, so a grid
+is rebuilt from the DB once it is older than TRACKING_CLUSTER_REFRESH_SECONDS;
+fixes recorded while a grid is being built are replayed into it.
+"""
+import math
+import threading
+import time
+from collections import namedtuple
+
+from django.conf import settings
+from django.db.models import OuterRef, Subquery
+
+from .models import GPSData, Equipment, Employee, Livestock, Geofence2
+from .sharding import db_for_owner
+
+Position = namedtuple("Position", "device_id kind name lat lng inside timestamp")
+
+MAX_LATITUDE = 85.05112878
+# Deepest zoom a map view may ask for
+MAX_ZOOM = 24
+
+
+def tile_for(lat, lng, zoom):
+    """Web-mercator tile (x, y) containing a point at the given zoom level"""
+    lat = max(-MAX_LATITUDE, min(MAX_LATITUDE, lat))
+    n = 1 << zoom
+    x = int((lng + 180.0) / 360.0 * n)
+    lat_rad = math.radians(lat)
+    y = int((1.0 - math.log(math.tan(lat_rad) + 1.0 / math.cos(lat_rad)) / math.pi) / 2.0 * n)
+    return min(max(x, 0), n - 1), min(max(y, 0), n - 1)
+
+
+class _Cell:
+    __slots__ = ("count", "sum_lat", "sum_lng", "inside")
+
+    def __init__(self):
+        self.count = 0
+        self.sum_lat = 0.0
+        self.sum_lng = 0.0
+        self.inside = 0
+
+
+class _OwnerGrid:
+    """Latest positions and per-level cell aggregates for one owner"""
+
+    def __init__(self, levels):
+        self.positions = {}
+        self.levels = [dict() for _ in range(levels)]
+        self.built_at = time.monotonic()
+
+    def _apply(self, pos, sign):
+        for zoom, cells in enumerate(self.levels):
+            key = tile_for(pos.lat, pos.lng, zoom)
+            cell = cells.get(key)
+            if cell is None:
+                cell = cells[key] = _Cell()
+            cell.count += sign
+            cell.sum_lat += sign * pos.lat
+            cell.sum_lng += sign * pos.lng
+            cell.inside += sign * (1 if pos.inside else 0)
+            if cell.count <= 0:
+                del cells[key]
+
+    def put(self, pos):
+        old = self.positions.get(pos.device_id)
+        if old is not None:
+            if old.timestamp and pos.timestamp and pos.timestamp < old.timestamp:
+                return
+            self._apply(old, -1)
+        self.positions[pos.device_id] = pos
+        self._apply(pos, 1)
+
+
+class PositionIndex:
+    """
+    Per-process index of latest positions, warmed from the DB per owner on first
+    read, kept current by the ingest path and rebuilt when it gets stale.
+    """
+
+    def __init__(self, point_zoom=None, refresh_seconds=None):
+        self.point_zoom = point_zoom or getattr(settings, "TRACKING_CLUSTER_POINT_ZOOM", 16)
+        if refresh_seconds is None:
+            refresh_seconds = getattr(settings, "TRACKING_CLUSTER_REFRESH_SECONDS", 30)
+        self.refresh_seconds = refresh_seconds
+        self._lock = threading.Lock()
+        self._owners = {}
+        # owner id -> one list per grid being built, of the fixes recorded meanwhile
+        self._building = {}
+        self._generations = {}
+
+    def record_fix(self, owner_id, device_id, lat, lng, inside, timestamp, kind=None, name=None):
+        """Move a device to its new position if its owner is indexed or being indexed"""
+        with self._lock:
+            for pending in self._building.get(owner_id, ()):
+                pending.append((device_id, lat, lng, inside, timestamp, kind, name))
+            grid = self._owners.get(owner_id)
+            if grid is not None:
+                _record(grid, device_id, lat, lng, inside, timestamp, kind, name)
+
+    def forget_owner(self, owner_id):
+        """Drop an owner's grid so it is rebuilt on the next read"""
+        with self._lock:
+            self._owners.pop(owner_id, None)
+            self._generations[owner_id] = self._generations.get(owner_id, 0) + 1
+
+    def clear(self):
+        """Drop every grid; builds in progress are not installed"""
+        with self._lock:
+            for owner_id in set(self._owners) | set(self._building):
+                self._generations[owner_id] = self._generations.get(owner_id, 0) + 1
+            self._owners.clear()
+
+    def query(self, owner_id, bbox, zoom):
+        """
+        Return clusters (or individual points at high zoom) inside
+        bbox = (west, south, east, north).
+        """
+        grid = self._grid(owner_id)
+        west, south, east, north = bbox
+        zoom = max(0, int(zoom))
+
+        with self._lock:
+            if zoom >= self.point_zoom:
+                points = [
+                    {
+                        "device_id": p.device_id,
+                        "kind": p.kind,
+                        "name": p.name,
+                        "latitude": p.lat,
+                        "longitude": p.lng,
+                        "inside_geofence": p.inside,
+                        "timestamp": p.timestamp,
+                    }
+                    for p in grid.positions.values()
+                    if south <= p.lat <= north and west <= p.lng <= east
+                ]
+                return {"zoom": zoom, "clusters": [], "points": points}
+
+            level = min(zoom + 2, len(grid.levels) - 1)
+            x0, y0 = tile_for(north, west, level)
+            x1, y1 = tile_for(south, east, level)
+            clusters = []
+            for (x, y), cell in grid.levels[level].items():
+                if not (x0 <= x <= x1 and y0 <= y <= y1):
+                    continue
+                clusters.append({
+                    "count": cell.count,
+                    "latitude": cell.sum_lat / cell.count,
+                    "longitude": cell.sum_lng / cell.count,
+                    "inside": cell.inside,
+                    "outside": cell.count - cell.inside,
+                })
+            return {"zoom": zoom, "clusters": clusters, "points": []}
+
+    def _grid(self, owner_id):
+        with self._lock:
+            grid = self._owners.get(owner_id)
+            if grid is not None and (
+                time.monotonic() - grid.built_at < self.refresh_seconds or owner_id in self._building
+            ):
+                # Fresh, or another request is already rebuilding it
+                return grid
+            pending = []
+            self._building.setdefault(owner_id, []).append(pending)
+            generation = self._generations.get(owner_id, 0)
+
+        try:
+            positions = _load_latest_positions(owner_id)
+        except Exception:
+            with self._lock:
+                self._stop_building(owner_id, pending)
+            raise
+
+        grid = _OwnerGrid(self.point_zoom)
+        with self._lock:
+            self._stop_building(owner_id, pending)
+            for pos in positions:
+                grid.put(pos)
+            # put() keeps the newer of the loaded and the recorded position
+            for fix in pending:
+                _record(grid, *fix)
+            # An asset or fence edit during the load makes this grid outdated already
+            if self._generations.get(owner_id, 0) == generation:
+                self._owners[owner_id] = grid
+        return grid
+
+    def _stop_building(self, owner_id, pending):
+        builders = self._building[owner_id]
+        builders.remove(pending)
+        if not builders:
+            del self._building[owner_id]
+
+
+def _record(grid, device_id, lat, lng, inside, timestamp, kind, name):
+    old = grid.positions.get(device_id)
+    grid.put(Position(
+        device_id,
+        kind or (old.kind if old else None),
+        name or (old.name if old else ""),
+        lat, lng, bool(inside), timestamp,
+    ))
+
+
+def _load_latest_positions(owner_id):
+    """Latest fix of every device an owner has, with its geofence state"""
+    assets = {}
+    for device_id, name in Equipment.objects.filter(owner_id=owner_id).values_list("device_id", "name"):
+        assets[device_id] = ("equipment", name)
+    for device_id, name in Employee.objects.filter(owner_id=owner_id).values_list("tracker_device_id", "full_name"):
+        if device_id:
+            assets[device_id] = ("employee", name)
+    for device_id, name in Livestock.objects.filter(owner_id=owner_id).values_list("device_id", "name"):
+        assets[device_id] = ("livestock", name)
+    if not assets:
+        return []
+
+    latest_pk = GPSData.objects.filter(
+        device_id=OuterRef("device_id")
+    ).order_by("-timestamp").values("pk")[:1]
+    latest = GPSData.objects.using(db_for_owner(owner_id)).filter(
+        device_id__in=list(assets),
+        pk=Subquery(latest_pk),
+    ).values_list("device_id", "latitude", "longitude", "timestamp")
+
+    geofences = list(Geofence2.objects.filter(owner_id=owner_id, is_active=True))
+    positions = []
+    for device_id, lat, lng, timestamp in latest:
+        kind, name = assets[device_id]
+        inside = any(g.contains_point(lat, lng) for g in geofences)
+        positions.append(Position(device_id, kind, name, lat, lng, inside, timestamp))
+    return positions
+
+
+position_index = PositionIndex()
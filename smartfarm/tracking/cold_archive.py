@@ -0,0 +1,416 @@
+"""
+Columnar cold archive of old telemetry.
+
+`pack_cold_telemetry` packs the closed days of each device (days that ended
+more than AFTER_DAYS ago) into one raw file per column under
+ROOT/device-<device id>/<generation>/, with a fixed dtype each (COLUMNS) and rows in
+time order. Readers map the columns with `np.memmap` and slice a time range
+by binary search on the timestamp column, so nothing is copied or turned into
+model instances until an array is actually used.
+
+ROOT/device-<device id>/index.json is the only thing readers trust: the current
+generation, its row count, the end of the packed range (`covered_until`) and
+when it was packed (`packed_at`). Packing appends to the column files first
+and replaces the index last, so readers never see a half-written tail.
+
+Database rows of a device before `covered_until` are answered by the archive,
+except rows created after `packed_at` (late uploads), which readers take from
+the database unless the archive already holds their timestamp; the next pack
+folds them into a new generation. `packed_at` trails the start of the pack by
+SETTLE_SECONDS, so a row committed while packing is never missed. With
+--delete, packed fixes that no alert points to are removed from GPSData,
+except each device's latest fix, which live views and device_config read.
+Geofence intervals (tracking.dwell), history smoothing and replay merge the
+archive in as well, so a fence edit after packing still covers packed days.
+
+An archive belongs to one registration of a tracker: it is removed when the
+Device row goes or moves to another tracker id or owner (tracking.signals).
+"""
+import heapq
+import json
+import os
+import shutil
+from datetime import datetime, timedelta, timezone as dt_timezone
+from pathlib import Path
+from urllib.parse import quote
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS
+from django.db.models import Q
+from django.utils import timezone
+
+from .models import GPSData
+
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover - everything reads the database then
+    np = None
+
+DEFAULTS = {
+    "ROOT": None,  # BASE_DIR / "cold_archive"
+    "AFTER_DAYS": 30,
+    "CHUNK_SIZE": 50000,
+    # Longest time between a fix's created_at and its commit
+    "SETTLE_SECONDS": 60,
+}
+
+# Column name -> dtype. Times are UTC epoch microseconds; inside is 1/0, -1 when unknown;
+# filtered positions are NaN where the noise filter left none.
+COLUMNS = {
+    "t": "<i8",
+    "lat": "<f8",
+    "lng": "<f8",
+    "speed": "<f8",
+    "altitude": "<f8",
+    "inside": "i1",
+    "filtered_lat": "<f8",
+    "filtered_lng": "<f8",
+    "outlier": "u1",
+}
+
+# GPSData fields read for each column, in COLUMNS order
+FIELDS = (
+    "timestamp", "latitude", "longitude", "speed", "altitude", "inside_geofence",
+    "filtered_latitude", "filtered_longitude", "is_outlier",
+)
+
+EPOCH = datetime(1970, 1, 1, tzinfo=dt_timezone.utc)
+MICROSECOND = timedelta(microseconds=1)
+
+
+def cold_setting(name):
+    value = getattr(settings, "TRACKING_COLD_ARCHIVE", {}).get(name, DEFAULTS[name])
+    if name == "ROOT" and value is None:
+        value = Path(settings.BASE_DIR) / "cold_archive"
+    return value
+
+
+def to_micros(dt):
+    return (dt - EPOCH) // MICROSECOND
+
+
+def from_micros(value):
+    return EPOCH + timedelta(microseconds=int(value))
+
+
+def device_dir(device_id):
+    """
+    The archive directory of a device id, always a direct child of ROOT: the
+    id is percent-quoted and prefixed, so ids such as ".." or "/" stay inside.
+    """
+    root = Path(cold_setting("ROOT")).resolve()
+    directory = (root / f"device-{quote(device_id, safe='')}").resolve()
+    if directory.parent != root:
+        raise ValueError(f"Device id {device_id!r} does not map to a directory in {root}")
+    return directory
+
+
+# ---------- reading ----------
+class ColdTrack:
+    """The packed history of one device, as of the index read on open"""
+
+    def __init__(self, device_id, directory, index):
+        self.device_id = device_id
+        self.directory = directory
+        self.generation = index["generation"]
+        self.rows = index["rows"]
+        self.covered_until = datetime.fromisoformat(index["covered_until"])
+        self.packed_at = datetime.fromisoformat(index["packed_at"])
+        self._columns = {}
+
+    @classmethod
+    def open(cls, device_id):
+        """The device's archive, or None when nothing has been packed"""
+        if np is None:
+            return None
+        directory = device_dir(device_id)
+        try:
+            index = json.loads((directory / "index.json").read_text())
+        except FileNotFoundError:
+            return None
+        return cls(device_id, directory, index)
+
+    def column(self, name):
+        if name not in self._columns:
+            if self.rows:
+                path = self.directory / str(self.generation) / f"{name}.bin"
+                # The file may run past `rows` while a pack is appending
+                self._columns[name] = np.memmap(path, dtype=COLUMNS[name], mode="r", shape=(self.rows,))
+            else:
+                self._columns[name] = np.empty(0, dtype=COLUMNS[name])
+        return self._columns[name]
+
+    def bounds(self, start=None, end=None, include_end=True):
+        """Row range [lo, hi) of the fixes between start and end"""
+        t = self.column("t")
+        lo = int(np.searchsorted(t, to_micros(start), side="left")) if start else 0
+        hi = int(np.searchsorted(t, to_micros(end), side="right" if include_end else "left")) if end else self.rows
+        return lo, max(lo, hi)
+
+    def holds(self, times):
+        """Which of the epoch-microsecond `times` the archive holds"""
+        t = self.column("t")
+        times = np.asarray(times, dtype=COLUMNS["t"])
+        if not self.rows:
+            return np.zeros(len(times), dtype=bool)
+        at = np.minimum(np.searchsorted(t, times), self.rows - 1)
+        return t[at] == times
+
+    def window(self, start=None, end=None, include_end=True, columns=None):
+        """{column: read-only slice} of the fixes between start and end, without copying"""
+        lo, hi = self.bounds(start, end, include_end)
+        return {name: self.column(name)[lo:hi] for name in (columns or COLUMNS)}
+
+    def hot_filter(self):
+        """GPSData rows of the device that the archive does not answer"""
+        return Q(device_id=self.device_id) & (
+            Q(timestamp__gte=self.covered_until) | Q(created_at__gt=self.packed_at)
+        )
+
+
+def open_tracks(device_ids):
+    """{device_id: ColdTrack} for the devices that have an archive"""
+    tracks = {}
+    for device_id in device_ids:
+        track = ColdTrack.open(device_id)
+        if track is not None:
+            tracks[device_id] = track
+    return tracks
+
+
+def _rows_to_columns(rows):
+    """Column arrays from GPSData.values_list(*FIELDS) rows"""
+    n = len(rows)
+    return {
+        "t": np.fromiter((to_micros(r[0]) for r in rows), dtype=COLUMNS["t"], count=n),
+        "lat": np.fromiter((r[1] for r in rows), dtype=COLUMNS["lat"], count=n),
+        "lng": np.fromiter((r[2] for r in rows), dtype=COLUMNS["lng"], count=n),
+        "speed": np.fromiter((r[3] for r in rows), dtype=COLUMNS["speed"], count=n),
+        "altitude": np.fromiter((r[4] for r in rows), dtype=COLUMNS["altitude"], count=n),
+        "inside": np.fromiter((-1 if r[5] is None else int(r[5]) for r in rows), dtype=COLUMNS["inside"], count=n),
+        "filtered_lat": np.fromiter((np.nan if r[6] is None else r[6] for r in rows), dtype=COLUMNS["filtered_lat"], count=n),
+        "filtered_lng": np.fromiter((np.nan if r[7] is None else r[7] for r in rows), dtype=COLUMNS["filtered_lng"], count=n),
+        "outlier": np.fromiter((bool(r[8]) for r in rows), dtype=COLUMNS["outlier"], count=n),
+    }
+
+
+def hot_rows(track, qs, fields=None):
+    """
+    GPSData rows in `qs` (already range-filtered) that the archive does not
+    hold, in time order: instances, or values_list(*fields) tuples whose
+    first field is "timestamp"
+    """
+    qs = qs.filter(track.hot_filter()).order_by("timestamp")
+    rows = list(qs.values_list(*fields) if fields else qs)
+    if not rows:
+        return rows
+    times = [r[0] if fields else r.timestamp for r in rows]
+    held = track.holds([to_micros(t) for t in times])
+    return [r for r, h in zip(rows, held) if not h]
+
+
+def load_track(device_id, start=None, end=None, include_end=True, using=None, track=None, columns=None):
+    """
+    Columns (COLUMNS names, default all) of one device's fixes between start
+    and end in time order, from its archive and the database.
+    """
+    track = track or ColdTrack.open(device_id)
+    qs = GPSData.objects.using(using) if using else GPSData.objects
+    qs = qs.filter(device_id=device_id)
+    if start:
+        qs = qs.filter(timestamp__gte=start)
+    if end:
+        qs = qs.filter(**{"timestamp__lte" if include_end else "timestamp__lt": end})
+    names = list(columns or COLUMNS)
+    if track is None:
+        hot = _rows_to_columns(list(qs.order_by("timestamp").values_list(*FIELDS)))
+        return {name: hot[name] for name in names}
+
+    hot = _rows_to_columns(hot_rows(track, qs, FIELDS))
+    cold = track.window(start, end, include_end, columns=set(names) | {"t"})
+    if not len(hot["t"]):
+        # Zero-copy: the archive answers the whole range
+        return {name: cold[name] for name in names}
+    merged = {name: np.concatenate([cold[name], hot[name]]) for name in set(names) | {"t"}}
+    # Late uploads fall inside the packed range
+    order = np.argsort(merged["t"], kind="stable")
+    return {name: merged[name][order] for name in names}
+
+
+def history_rows(track, hot, start=None, end=None):
+    """
+    GPSDataSerializer output of the archived fixes between start and end
+    merged in time order with the `hot` instances (from `hot_rows`).
+    Archived fixes carry no id, assets or created_at, and "archived": true.
+    """
+    from rest_framework.fields import DateTimeField
+
+    from .serializers import GPSDataSerializer
+
+    as_time = DateTimeField().to_representation
+    cols = track.window(start, end)
+    cold = []
+    for i in range(len(cols["t"])):
+        inside = int(cols["inside"][i])
+        flat, flng = float(cols["filtered_lat"][i]), float(cols["filtered_lng"][i])
+        cold.append((int(cols["t"][i]), {
+            "id": None,
+            "equipment": None,
+            "employee": None,
+            "device_id": track.device_id,
+            "timestamp": as_time(from_micros(cols["t"][i])),
+            "latitude": float(cols["lat"][i]),
+            "longitude": float(cols["lng"][i]),
+            "speed": float(cols["speed"][i]),
+            "altitude": float(cols["altitude"][i]),
+            "created_at": None,
+            "inside_geofence": None if inside < 0 else bool(inside),
+            "filtered_latitude": None if np.isnan(flat) else flat,
+            "filtered_longitude": None if np.isnan(flng) else flng,
+            "is_outlier": bool(cols["outlier"][i]),
+            "boundary_distance_m": None,
+            "archived": True,
+        }))
+    recent = [(to_micros(fix.timestamp), row) for fix, row in zip(hot, GPSDataSerializer(hot, many=True).data)]
+    return [row for _, row in heapq.merge(cold, recent, key=lambda pair: pair[0])]
+
+
+# ---------- packing ----------
+def _write_index(directory, index):
+    tmp = directory / "index.json.tmp"
+    tmp.write_text(json.dumps(index))
+    os.replace(tmp, directory / "index.json")
+
+
+def _append(directory, rows_before, columns):
+    """Write column arrays after the first `rows_before` rows of each file"""
+    directory.mkdir(parents=True, exist_ok=True)
+    for name, dtype in COLUMNS.items():
+        path = directory / f"{name}.bin"
+        offset = rows_before * np.dtype(dtype).itemsize
+        with open(path, "r+b" if path.exists() else "wb") as fh:
+            # Drops the tail of an interrupted pack; readers never map past the index
+            fh.truncate(offset)
+            fh.seek(offset)
+            fh.write(np.ascontiguousarray(columns[name], dtype=dtype).tobytes())
+            fh.flush()
+            os.fsync(fh.fileno())
+
+
+def pack_device(device_id, through_day, using=DEFAULT_DB_ALIAS, delete=False, chunk_size=None):
+    """
+    Pack the device's fixes up to the end of `through_day` that the archive
+    does not hold yet, and fold in late uploads to packed days. Returns
+    {"packed": new rows, "late": folded late rows, "deleted": GPSData rows removed}.
+    """
+    from .behaviour import day_bounds
+
+    if np is None:
+        raise RuntimeError("numpy is required for the cold archive")
+    chunk_size = chunk_size or cold_setting("CHUNK_SIZE")
+    summary = {"packed": 0, "late": 0, "deleted": 0}
+    directory = device_dir(device_id)
+    track = ColdTrack.open(device_id)
+    until = day_bounds(through_day)[1]
+    packed_at = timezone.now() - timedelta(seconds=cold_setting("SETTLE_SECONDS"))
+
+    fixes = GPSData.objects.using(using).filter(device_id=device_id)
+    generation = track.generation if track else 1
+    rows = track.rows if track else 0
+    covered_until = track.covered_until if track else None
+    packed_ids = []
+
+    if track:
+        late = list(
+            fixes.filter(timestamp__lt=track.covered_until, created_at__gt=track.packed_at)
+            .order_by("timestamp").values_list("pk", *FIELDS)
+        )
+        if late:
+            held = track.holds([to_micros(r[1]) for r in late])
+            late = [r for r, h in zip(late, held) if not h]
+        if late:
+            # Late rows belong in the middle, so write the merged columns as a new generation
+            added = _rows_to_columns([r[1:] for r in late])
+            merged = {name: np.concatenate([track.column(name), added[name]]) for name in COLUMNS}
+            order = np.argsort(merged["t"], kind="stable")
+            generation += 1
+            shutil.rmtree(directory / str(generation), ignore_errors=True)
+            _append(directory / str(generation), 0, {name: values[order] for name, values in merged.items()})
+            rows += len(late)
+            packed_ids += [r[0] for r in late]
+            summary["late"] = len(late)
+
+    if covered_until is None or covered_until < until:
+        new = fixes.filter(timestamp__lt=until)
+        if covered_until is not None:
+            new = new.filter(timestamp__gte=covered_until)
+        chunk = []
+        for row in new.order_by("timestamp").values_list("pk", *FIELDS).iterator(chunk_size=chunk_size):
+            chunk.append(row)
+            if len(chunk) >= chunk_size:
+                rows = _append_chunk(directory / str(generation), rows, chunk, packed_ids, summary)
+                chunk = []
+        if chunk:
+            rows = _append_chunk(directory / str(generation), rows, chunk, packed_ids, summary)
+        covered_until = until
+
+    if track is None and not rows:
+        return summary
+    if track is not None and not packed_ids and covered_until == track.covered_until:
+        return summary
+    (directory / str(generation)).mkdir(parents=True, exist_ok=True)
+    _write_index(directory, {
+        "version": 1,
+        "device_id": device_id,
+        "generation": generation,
+        "rows": rows,
+        "covered_until": covered_until.isoformat(),
+        "packed_at": packed_at.isoformat(),
+    })
+    # Readers that opened the old generation keep their mappings (on POSIX)
+    for old in directory.iterdir():
+        if old.is_dir() and old.name != str(generation):
+            shutil.rmtree(old, ignore_errors=True)
+
+    if delete:
+        latest = fixes.order_by("-timestamp").values_list("pk", flat=True).first()
+        for start in range(0, len(packed_ids), 500):
+            summary["deleted"] += fixes.filter(
+                pk__in=packed_ids[start:start + 500], alerts__isnull=True
+            ).exclude(pk=latest).delete()[0]
+    return summary
+
+
+def remove_device(device_id):
+    """Drop a device's archive; readers that mapped it keep their mappings (on POSIX)"""
+    directory = device_dir(device_id)
+    if directory.is_dir() and not directory.is_symlink():
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+def _append_chunk(directory, rows, chunk, packed_ids, summary):
+    _append(directory, rows, _rows_to_columns([r[1:] for r in chunk]))
+    packed_ids += [r[0] for r in chunk]
+    summary["packed"] += len(chunk)
+    return rows + len(chunk)
+
+
+def pack_closed_days(device_ids=None, after_days=None, delete=False, log=None):
+    """Pack every device's days that ended more than `after_days` ago; returns totals"""
+    from .models import Device
+    from .sharding import devices_by_database
+
+    after_days = cold_setting("AFTER_DAYS") if after_days is None else after_days
+    through_day = timezone.localdate() - timedelta(days=after_days + 1)
+    if device_ids is None:
+        device_ids = sorted(Device.objects.values_list("device_id", flat=True))
+    totals = {"devices": 0, "packed": 0, "late": 0, "deleted": 0}
+    for db, ids in devices_by_database(device_ids).items():
+        for device_id in ids:
+            summary = pack_device(device_id, through_day, using=db, delete=delete)
+            totals["devices"] += 1
+            for key, value in summary.items():
+                totals[key] += value
+            if log and any(summary.values()):
+                log(f"{device_id}: {summary['packed']} packed, {summary['late']} late, {summary['deleted']} deleted")
+    return totals
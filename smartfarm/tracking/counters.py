@@ -0,0 +1,121 @@
+"""
+Per-owner open-alert counters.
+
+AlertCounters holds the number of unresolved alerts of each type for an owner,
+so a badge is one primary-key read instead of a count over Alert. Counters are
+moved in the same transaction as the alert change: creation and deletion via
+model signals, bulk resolves via `resolve_alerts`. An edit whose effect on
+the counts is unknown (an admin save) recounts that owner from Alert.
+
+Deleting many alerts inside `batched()` collects the decrements of the
+per-row delete signals and writes them once per owner at the end of the block.
+With sharding, an owner's counters live in the shard that holds their alerts.
+"""
+import threading
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+
+from django.db import transaction
+from django.db.models import Count, F
+
+from .cache import response_cache
+from .models import Alert, AlertCounters
+from .sharding import current_db, db_for_owner
+
+_local = threading.local()
+
+
+def _field(alert_type):
+    return f"open_{alert_type}"
+
+
+def adjust(owner_id, changes):
+    """Apply {alert_type: delta} to an owner's counters, in the caller's transaction"""
+    changes = {t: d for t, d in changes.items() if d}
+    if owner_id is None or not changes:
+        return
+    pending = getattr(_local, "pending", None)
+    if pending is not None:
+        pending[owner_id].update(changes)
+        return
+    updated = AlertCounters.objects.using(db_for_owner(owner_id)).filter(owner_id=owner_id).update(
+        **{_field(t): F(_field(t)) + d for t, d in changes.items()}
+    )
+    if not updated:
+        # No row yet: the recount already sees this change
+        recount([owner_id])
+
+
+def recount(owner_ids):
+    """Rebuild counters of the given owners from Alert"""
+    by_db = defaultdict(list)
+    for owner_id in set(owner_ids) - {None}:
+        by_db[db_for_owner(owner_id)].append(owner_id)
+    for db, ids in by_db.items():
+        counts = defaultdict(Counter)
+        for owner_id, alert_type, n in (
+            Alert.objects.using(db).filter(owner_id__in=ids, is_resolved=False)
+            .values_list("owner_id", "alert_type").annotate(n=Count("id")).order_by()
+        ):
+            counts[owner_id][alert_type] = n
+        for owner_id in ids:
+            AlertCounters.objects.using(db).update_or_create(
+                owner_id=owner_id,
+                defaults={_field(t): counts[owner_id][t] for t, _ in Alert.ALERT_TYPES},
+            )
+
+
+def open_counts(owner_id):
+    """Open alerts per type plus "total" for an owner"""
+    db = db_for_owner(owner_id)
+    counters = AlertCounters.objects.using(db).filter(owner_id=owner_id).first()
+    if counters is None:
+        recount([owner_id])
+        counters = AlertCounters.objects.using(db).get(owner_id=owner_id)
+    return counters.as_dict()
+
+
+@contextmanager
+def batched(using=None):
+    """
+    Write counter changes made in this block once per owner when it ends.
+    The block is one transaction on `using`, by default the current database.
+    """
+    if getattr(_local, "pending", None) is not None:
+        yield
+        return
+    _local.pending = pending = defaultdict(Counter)
+    try:
+        with transaction.atomic(using=using or current_db()):
+            yield
+            _local.pending = None
+            for owner_id, changes in pending.items():
+                adjust(owner_id, changes)
+    finally:
+        _local.pending = None
+
+
+def resolve_alerts(alerts):
+    """
+    Resolve the open alerts of a queryset with one UPDATE and move the
+    counters with it. Returns the number of alerts resolved.
+    """
+    alerts = alerts.filter(is_resolved=False)
+    with transaction.atomic(using=alerts.db):
+        changes = defaultdict(Counter)
+        for owner_id, alert_type, n in (
+            alerts.values_list("owner_id", "alert_type").annotate(n=Count("id")).order_by()
+        ):
+            changes[owner_id][alert_type] -= n
+        if not changes:
+            return 0
+        resolved = alerts.update(is_resolved=True)
+        if resolved == -sum(sum(c.values()) for c in changes.values()):
+            for owner_id, counts in changes.items():
+                adjust(owner_id, counts)
+        else:
+            # Another writer changed some of them in between
+            recount(changes)
+    for owner_id in changes:
+        response_cache.bump(owner_id)
+    return resolved
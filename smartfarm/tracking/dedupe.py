@@ -0,0 +1,51 @@
+"""
+Chunked removal of duplicate (device_id, timestamp) telemetry rows.
+
+Used by `manage.py dedupe_gps_data`; it takes the model classes as
+arguments and works on the current database (tracking.sharding). Migration
+0010 carries its own frozen copy.
+"""
+from django.db import transaction
+from django.db.models import Count, Min, Q
+
+
+def dedupe_gps_history(GPSData, Alert, chunk_size=200, dry_run=False, log=None):
+    """
+    Keep the lowest id of each duplicate group, re-point its alerts to the
+    kept row and delete the rest. Returns the number of rows removed.
+    """
+    groups = (
+        GPSData.objects.values("device_id", "timestamp")
+        .annotate(n=Count("id"), keep=Min("id"))
+        .filter(n__gt=1)
+        .order_by()
+    )
+    groups = list(groups.values_list("device_id", "timestamp", "keep"))
+    removed = 0
+
+    for start in range(0, len(groups), chunk_size):
+        chunk = groups[start:start + chunk_size]
+        keep = {(device_id, timestamp): pk for device_id, timestamp, pk in chunk}
+        match = Q()
+        for device_id, timestamp, _ in chunk:
+            match |= Q(device_id=device_id, timestamp=timestamp)
+
+        with transaction.atomic(using=GPSData.objects.db):
+            rows = GPSData.objects.filter(match).values_list("id", "device_id", "timestamp")
+            duplicates = {}
+            for pk, device_id, timestamp in rows:
+                kept = keep[(device_id, timestamp)]
+                if pk != kept:
+                    duplicates.setdefault(kept, []).append(pk)
+
+            count = sum(len(ids) for ids in duplicates.values())
+            if not dry_run:
+                for kept, ids in duplicates.items():
+                    Alert.objects.filter(gps_data_id__in=ids).update(gps_data_id=kept)
+                GPSData.objects.filter(id__in=[pk for ids in duplicates.values() for pk in ids]).delete()
+            removed += count
+
+        if log:
+            log(f"{min(start + chunk_size, len(groups))}/{len(groups)} duplicate groups, {removed} rows")
+
+    return removed
@@ -0,0 +1,195 @@
+"""
+Resolution of a device id to the asset and owner it belongs to.
+
+Every tracker is registered once in the Device table under a normalized key,
+so resolving an id is one indexed lookup whatever kind of asset carries it.
+Asset signals keep the table in sync through `sync_device`.
+
+Owner ids are cached per process. Every committed Device change bumps a
+registry version in the shared response cache (tracking.cache); each process
+compares it at most every REGISTRY_CHECK_SECONDS and drops its cache when it
+moved, so workers, the listener and the liveness thread stop routing a moved
+or deleted tracker to its old owner. Entries also expire after
+OWNER_ID_TTL_SECONDS, for the per-process locmem backend.
+"""
+import logging
+import threading
+import time
+
+from .cache import response_cache
+from .models import Device
+
+logger = logging.getLogger(__name__)
+
+# Field holding the tracker id on each kind of asset
+DEVICE_FIELDS = {
+    "equipment": "device_id",
+    "employee": "tracker_device_id",
+    "livestock": "device_id",
+}
+
+# key -> (owner id, expiry)
+_owner_ids = {}
+# Unknown ids, cached briefly: other processes register devices without telling this one
+_unknown_ids = {}
+_owner_ids_lock = threading.Lock()
+MAX_CACHED_DEVICES = 50000
+UNKNOWN_DEVICE_TTL_SECONDS = 5
+OWNER_ID_TTL_SECONDS = 300
+REGISTRY_CHECK_SECONDS = 1
+# Response cache version key of the registry; no user has id 0
+REGISTRY_VERSION_KEY = 0
+_registry_version = None
+_registry_checked_at = float("-inf")
+
+
+def normalize_device_id(device_id):
+    """Canonical form of a device id (MAC addresses arrive in either case)"""
+    return (device_id or "").strip().upper()
+
+
+def lookup_device(device_id):
+    """
+    The Device registered under an id, with its owner and asset loaded, or
+    None. The cached owner id is refreshed from the row, so routing and alerts
+    that follow in the same request agree with it.
+    """
+    key = normalize_device_id(device_id)
+    if not key:
+        return None
+    device = (
+        Device.objects.select_related("owner", "equipment", "employee", "livestock")
+        .filter(key=key)
+        .first()
+    )
+    _remember(key, device.owner_id if device else None, time.monotonic())
+    return device
+
+
+def lookup_devices(device_ids):
+    """Map each given id to its Device (or None) with one query; refreshes cached owner ids"""
+    keys = {device_id: normalize_device_id(device_id) for device_id in device_ids}
+    found = {
+        device.key: device
+        for device in Device.objects.select_related("owner", "equipment", "employee", "livestock")
+        .filter(key__in={k for k in keys.values() if k})
+    }
+    now = time.monotonic()
+    for key in set(keys.values()) - {""}:
+        _remember(key, found[key].owner_id if key in found else None, now)
+    return {device_id: found.get(key) for device_id, key in keys.items()}
+
+
+def resolve_device(device_id):
+    """Return (owner, asset, kind) for a device id, or (None, None, None)"""
+    device = lookup_device(device_id)
+    if device is None:
+        return None, None, None
+    return device.owner, device.asset, device.kind
+
+
+def owner_id_for_device(device_id):
+    """
+    Cached owner id lookup; dropped when the registry version moves and after
+    OWNER_ID_TTL_SECONDS. An unknown id is remembered for
+    UNKNOWN_DEVICE_TTL_SECONDS only.
+    """
+    key = normalize_device_id(device_id)
+    now = time.monotonic()
+    _check_registry(now)
+    with _owner_ids_lock:
+        cached = _owner_ids.get(key)
+        if cached is not None and cached[1] > now:
+            return cached[0]
+        if _unknown_ids.get(key, 0) > now:
+            return None
+
+    owner_id = Device.objects.filter(key=key).values_list("owner_id", flat=True).first() if key else None
+    _remember(key, owner_id, now)
+    return owner_id
+
+
+def _remember(key, owner_id, now):
+    with _owner_ids_lock:
+        if owner_id is None:
+            _owner_ids.pop(key, None)
+            if len(_unknown_ids) >= MAX_CACHED_DEVICES:
+                _unknown_ids.clear()
+            _unknown_ids[key] = now + UNKNOWN_DEVICE_TTL_SECONDS
+        else:
+            _unknown_ids.pop(key, None)
+            if len(_owner_ids) >= MAX_CACHED_DEVICES:
+                _owner_ids.clear()
+            _owner_ids[key] = (owner_id, now + OWNER_ID_TTL_SECONDS)
+
+
+def _check_registry(now):
+    """Drop the cache when another process changed the registry since the last check"""
+    global _registry_checked_at, _registry_version
+    with _owner_ids_lock:
+        if now - _registry_checked_at < REGISTRY_CHECK_SECONDS:
+            return
+        _registry_checked_at = now
+    version = response_cache.version(REGISTRY_VERSION_KEY)
+    with _owner_ids_lock:
+        if version != _registry_version:
+            _registry_version = version
+            _owner_ids.clear()
+            _unknown_ids.clear()
+
+
+def forget_devices():
+    global _registry_checked_at
+    with _owner_ids_lock:
+        _owner_ids.clear()
+        _unknown_ids.clear()
+        _registry_checked_at = float("-inf")
+
+
+def registry_changed():
+    """After a Device change commits: this process forgets now, the others on their next check"""
+    forget_devices()
+    response_cache.bump(REGISTRY_VERSION_KEY)
+
+
+def owner_device_ids(owner_id):
+    return sorted(Device.objects.filter(owner_id=owner_id).values_list("device_id", flat=True))
+
+
+def device_conflict(device_id, asset=None):
+    """The Device already registered under an id to some other asset, if any"""
+    key = normalize_device_id(device_id)
+    if not key:
+        return None
+    devices = Device.objects.filter(key=key)
+    if asset is not None and asset.pk:
+        devices = devices.exclude(**{type(asset).__name__.lower(): asset})
+    return devices.first()
+
+
+def sync_device(asset, kind):
+    """Create, update or drop the Device row of an asset after it is saved"""
+    device_id = getattr(asset, DEVICE_FIELDS[kind])
+    key = normalize_device_id(device_id)
+    current = Device.objects.filter(**{kind: asset}).first()
+
+    if not key:
+        if current:
+            current.delete()
+        return
+
+    if current and (current.key, current.device_id, current.owner_id) == (key, device_id, asset.owner_id):
+        return
+
+    taken = device_conflict(device_id, asset)
+    if taken:
+        # Serializers reject this; it can only come from the admin or a shell
+        logger.warning("Device id %s of %s %s is already registered to a %s", device_id, kind, asset.pk, taken.kind)
+        if current:
+            current.delete()
+        return
+
+    Device.objects.update_or_create(
+        **{kind: asset},
+        defaults={"key": key, "device_id": device_id, "kind": kind, "owner_id": asset.owner_id},
+    )
@@ -0,0 +1,361 @@
+"""
+Geofence dwell time and attendance from stored telemetry.
+
+For every device of an owner, fixes are swept once in time order and each
+chunk is tested against every active fence with `Geofence2.contains_many`.
+Runs of fixes on the same side of a fence become GeofenceInterval rows. A run
+ends where the device crosses the boundary (the interval ends at the first
+fix on the other side) or where reporting stops for longer than
+MAX_GAP_MINUTES (it ends at the last fix, and the gap counts for neither side).
+
+The last interval per (device, fence) stays open, so a later sweep only reads
+fixes newer than it and extends it. Editing a fence's geometry discards that
+fence's intervals, and the next sweep rebuilds them. Fixes that arrive older
+than the open interval are not folded in; use --rebuild for backfilled data.
+Positions are the noise-filtered ones, as in ingest; outliers are skipped.
+Devices with a cold archive are read through `cold_archive.load_track`, so
+days packed (and deleted from GPSData) still count after a fence edit.
+
+Dwell totals and entry/exit logs are then read from the interval table.
+The report views only read it: a read schedules a refresh on a background
+thread, one per owner at a time, and build_geofence_intervals does the same
+from cron.
+"""
+import hashlib
+import json
+import logging
+import threading
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.db.models import Q
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from . import cold_archive
+from .cache import response_cache
+from .models import Device, GeofenceInterval, Geofence2, GPSData
+from .sharding import db_for_owner
+
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover - the reports answer 501
+    np = None
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    "MAX_GAP_MINUTES": 30,
+    "CHUNK_SIZE": 20000,
+    "DEVICES_PER_BATCH": 200,
+    "REFRESH_IN_BACKGROUND": True,
+    "DEFAULT_DAYS": 7,
+}
+
+
+def dwell_setting(name):
+    return getattr(settings, "TRACKING_DWELL", {}).get(name, DEFAULTS[name])
+
+
+def fence_signature(fence):
+    return hashlib.sha1(json.dumps(fence.coordinates).encode()).hexdigest()[:16]
+
+
+# ---------- building intervals ----------
+def refresh_intervals(owner_id, device_ids=None, rebuild=False, log=None):
+    """
+    Extend the owner's intervals with fixes newer than the open ones (all
+    history for a new or edited fence). Returns a Counter summary.
+    """
+    if np is None:
+        raise RuntimeError("numpy is required for dwell reports")
+
+    summary = Counter()
+    fences = list(Geofence2.objects.filter(owner_id=owner_id, is_active=True))
+    devices = Device.objects.filter(owner_id=owner_id)
+    if device_ids is not None:
+        devices = devices.filter(device_id__in=device_ids)
+    devices = sorted(devices.values_list("device_id", flat=True))
+    if not fences or not devices:
+        return summary
+
+    signatures = {f.id: fence_signature(f) for f in fences}
+    stale = Q()
+    for fence in fences:
+        stale |= Q(geofence=fence) & ~Q(signature=signatures[fence.id])
+    with transaction.atomic():
+        intervals = GeofenceInterval.objects.filter(owner_id=owner_id)
+        summary["stale_removed"] = intervals.filter(stale).delete()[0]
+        if rebuild:
+            summary["removed"] = intervals.filter(device_id__in=devices).delete()[0]
+
+    step = dwell_setting("DEVICES_PER_BATCH")
+    for start in range(0, len(devices), step):
+        _Sweep(owner_id, fences, signatures, devices[start:start + step], summary).run()
+        if log:
+            log(f"{min(start + step, len(devices))}/{len(devices)} devices, {summary['fixes']} fixes")
+    return summary
+
+
+_executor = None
+_queued = set()
+_lock = threading.Lock()
+
+
+def schedule_refresh(owner_id):
+    """
+    Refresh an owner's intervals on the background thread. A refresh already
+    queued for the owner absorbs this one; returns whether one was queued.
+    """
+    global _executor
+    with _lock:
+        if owner_id in _queued:
+            return False
+        _queued.add(owner_id)
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="dwell-refresh")
+    _executor.submit(_run_refresh, owner_id)
+    return True
+
+
+def _run_refresh(owner_id):
+    with _lock:
+        _queued.discard(owner_id)
+    close_old_connections()
+    try:
+        summary = refresh_intervals(owner_id)
+        if summary["fixes"] or summary["stale_removed"]:
+            response_cache.bump(owner_id)
+    except Exception:
+        logger.exception("Dwell interval refresh failed for owner %s", owner_id)
+    finally:
+        close_old_connections()
+
+
+class _Sweep:
+    """One pass over the new fixes of a group of devices"""
+
+    def __init__(self, owner_id, fences, signatures, device_ids, summary):
+        self.owner_id = owner_id
+        self.fences = fences
+        self.signatures = signatures
+        self.device_ids = device_ids
+        self.summary = summary
+        self.max_gap = dwell_setting("MAX_GAP_MINUTES") * 60
+        self.closed = []
+        self.open = {
+            (i.device_id, i.geofence_id): i
+            for i in GeofenceInterval.objects.filter(
+                owner_id=owner_id, device_id__in=device_ids, geofence__in=fences, end_reason=""
+            )
+        }
+        self.replaced = [i.pk for i in self.open.values()]
+
+    def resume_after(self, device_id):
+        """Each device is read from the oldest open interval among its fences"""
+        ends = [self.open.get((device_id, f.id)) for f in self.fences]
+        if any(e is None for e in ends):
+            return None
+        return min(e.ended_at for e in ends)
+
+    def run(self):
+        db = db_for_owner(self.owner_id)
+        tracks = cold_archive.open_tracks(self.device_ids)
+        newer = Q()
+        for device_id in self.device_ids:
+            if device_id in tracks:
+                continue
+            after = self.resume_after(device_id)
+            newer |= Q(device_id=device_id, timestamp__gt=after) if after else Q(device_id=device_id)
+
+        chunk_size = dwell_setting("CHUNK_SIZE")
+        if newer:
+            rows = (
+                GPSData.objects.using(db).filter(newer, is_outlier=False)
+                .order_by("device_id", "timestamp")
+                .values_list(
+                    "device_id", "timestamp",
+                    Coalesce("filtered_latitude", "latitude"), Coalesce("filtered_longitude", "longitude"),
+                )
+            )
+            chunk = []
+            for row in rows.iterator(chunk_size=chunk_size):
+                if chunk and (row[0] != chunk[0][0] or len(chunk) >= chunk_size):
+                    self.add_fixes(chunk)
+                    chunk = []
+                chunk.append(row)
+            if chunk:
+                self.add_fixes(chunk)
+
+        for device_id, track in sorted(tracks.items()):
+            after = self.resume_after(device_id)
+            cols = cold_archive.load_track(
+                device_id, start=after, using=db, track=track,
+                columns=("t", "lat", "lng", "filtered_lat", "filtered_lng", "outlier"),
+            )
+            keep = cols["outlier"] == 0
+            if after is not None:
+                keep &= cols["t"] > cold_archive.to_micros(after)
+            t = cols["t"][keep]
+            lat = np.where(np.isnan(cols["filtered_lat"]), cols["lat"], cols["filtered_lat"])[keep]
+            lng = np.where(np.isnan(cols["filtered_lng"]), cols["lng"], cols["filtered_lng"])[keep]
+            for start in range(0, len(t), chunk_size):
+                self.add_fixes([
+                    (device_id, cold_archive.from_micros(t[i]), float(lat[i]), float(lng[i]))
+                    for i in range(start, min(start + chunk_size, len(t)))
+                ])
+        self.save()
+
+    def add_fixes(self, rows):
+        """Fold a time-ordered chunk of one device's fixes into its intervals"""
+        device_id = rows[0][0]
+        times = [r[1] for r in rows]
+        t = np.fromiter((ts.timestamp() for ts in times), dtype=np.float64, count=len(rows))
+        lat = np.fromiter((r[2] for r in rows), dtype=np.float64, count=len(rows))
+        lng = np.fromiter((r[3] for r in rows), dtype=np.float64, count=len(rows))
+        self.summary["fixes"] += len(rows)
+
+        for fence in self.fences:
+            key = (device_id, fence.id)
+            current = self.open.get(key)
+            first = int(np.searchsorted(t, current.ended_at.timestamp(), side="right")) if current else 0
+            if first >= len(t):
+                continue
+            seg_t = t[first:]
+            seg_in = fence.contains_many(lat[first:], lng[first:])
+            gap = np.diff(seg_t) > self.max_gap
+            cuts = np.flatnonzero(gap | (seg_in[1:] != seg_in[:-1])) + 1
+
+            for s, e in zip(np.r_[0, cuts], np.r_[cuts, len(seg_t)]):
+                inside = bool(seg_in[s])
+                if current is not None and s == 0:
+                    # Continue the carried interval unless the device crossed or went silent
+                    if seg_t[0] - current.ended_at.timestamp() > self.max_gap:
+                        self.close(current, "gap")
+                        current = None
+                    elif current.inside != inside:
+                        current.ended_at = times[first]
+                        self.close(current, "change")
+                        current = None
+                if current is None:
+                    current = GeofenceInterval(
+                        owner_id=self.owner_id, geofence=fence, device_id=device_id, inside=inside,
+                        started_at=times[first + s], ended_at=times[first + s], fixes=0,
+                        signature=self.signatures[fence.id],
+                    )
+                current.fixes += int(e - s)
+                current.ended_at = times[first + e - 1]
+                if e < len(seg_t):
+                    if gap[e - 1]:
+                        self.close(current, "gap")
+                    else:
+                        current.ended_at = times[first + e]
+                        self.close(current, "change")
+                    current = None
+            self.open[key] = current
+
+    def close(self, interval, reason):
+        interval.end_reason = reason
+        self.closed.append(interval)
+
+    def save(self):
+        for interval in self.open.values():
+            interval.pk = None
+        with transaction.atomic():
+            for start in range(0, len(self.replaced), 500):
+                GeofenceInterval.objects.filter(pk__in=self.replaced[start:start + 500]).delete()
+            # Intervals are deterministic, so a concurrent sweep's duplicates are simply skipped
+            GeofenceInterval.objects.bulk_create(
+                self.closed + list(self.open.values()), batch_size=500, ignore_conflicts=True
+            )
+        self.summary["intervals_closed"] += len(self.closed)
+
+
+# ---------- reports ----------
+def report_window(start=None, end=None):
+    end = end or timezone.now()
+    return start or end - timedelta(days=dwell_setting("DEFAULT_DAYS")), end
+
+
+def _intervals(owner_id, start, end, geofence_id=None, device_ids=None):
+    qs = GeofenceInterval.objects.filter(
+        owner_id=owner_id, geofence__is_active=True, started_at__lt=end, ended_at__gt=start
+    ).select_related("geofence")
+    if geofence_id is not None:
+        qs = qs.filter(geofence_id=geofence_id)
+    if device_ids is not None:
+        qs = qs.filter(device_id__in=device_ids)
+    return qs
+
+
+def _overlap(interval, start, end):
+    return max(0.0, (min(end, interval.ended_at) - max(start, interval.started_at)).total_seconds())
+
+
+def _device_names(owner_id):
+    names = {}
+    for device in Device.objects.filter(owner_id=owner_id).select_related("equipment", "employee", "livestock"):
+        asset = device.asset
+        names[device.device_id] = (device.kind, getattr(asset, "name", None) or getattr(asset, "full_name", ""))
+    return names
+
+
+def dwell_report(owner_id, start, end, geofence_id=None, device_ids=None):
+    """Seconds inside and outside each fence per device within [start, end)"""
+    totals = defaultdict(Counter)
+    fences = {}
+    for interval in _intervals(owner_id, start, end, geofence_id, device_ids):
+        key = (interval.device_id, interval.geofence_id)
+        fences[interval.geofence_id] = interval.geofence.name
+        side = "inside_seconds" if interval.inside else "outside_seconds"
+        totals[key][side] += _overlap(interval, start, end)
+        if interval.inside and interval.started_at >= start:
+            totals[key]["visits"] += 1
+        if interval.inside and interval.end_reason == "change" and interval.ended_at < end:
+            totals[key]["exits"] += 1
+
+    names = _device_names(owner_id)
+    window = (end - start).total_seconds()
+    rows = []
+    for (device_id, fence_id), counts in sorted(totals.items()):
+        kind, name = names.get(device_id, (None, ""))
+        tracked = counts["inside_seconds"] + counts["outside_seconds"]
+        rows.append({
+            "device_id": device_id,
+            "kind": kind,
+            "name": name,
+            "geofence_id": fence_id,
+            "geofence_name": fences[fence_id],
+            "inside_seconds": round(counts["inside_seconds"], 1),
+            "outside_seconds": round(counts["outside_seconds"], 1),
+            "untracked_seconds": round(max(0.0, window - tracked), 1),
+            "visits": counts["visits"],
+            "exits": counts["exits"],
+        })
+    return rows
+
+
+def attendance_log(owner_id, start, end, geofence_id=None, device_ids=None):
+    """Visits (inside intervals) overlapping [start, end), oldest first"""
+    names = _device_names(owner_id)
+    rows = []
+    intervals = _intervals(owner_id, start, end, geofence_id, device_ids).filter(inside=True)
+    for interval in intervals.order_by("started_at", "device_id"):
+        kind, name = names.get(interval.device_id, (None, ""))
+        rows.append({
+            "device_id": interval.device_id,
+            "kind": kind,
+            "name": name,
+            "geofence_id": interval.geofence_id,
+            "geofence_name": interval.geofence.name,
+            "entered_at": interval.started_at,
+            "exited_at": interval.ended_at if interval.end_reason == "change" else None,
+            "last_seen_at": interval.ended_at,
+            "ended_by": {"change": "exit", "gap": "signal_lost"}.get(interval.end_reason),
+            "duration_seconds": round((interval.ended_at - interval.started_at).total_seconds(), 1),
+            "fixes": interval.fixes,
+        })
+    return rows
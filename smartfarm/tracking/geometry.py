@@ -0,0 +1,387 @@
+"""
+Polygon helpers for geofences.
+
+Coordinates follow Geofence2: a list of [lat, lng] pairs. Metric work is done
+in a local equirectangular frame (x east, y north, metres) around the polygon,
+which is accurate to well under a metre at farm scale.
+"""
+import math
+import threading
+from collections import OrderedDict
+
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover - pure Python fallbacks below
+    np = None
+
+EARTH_RADIUS_M = 6371000.0
+
+
+def open_ring(coords):
+    """Polygon vertices without the repeated closing point"""
+    coords = [tuple(p) for p in coords]
+    if len(coords) > 1 and coords[0] == coords[-1]:
+        coords = coords[:-1]
+    return coords
+
+
+def local_frame(coords):
+    """Origin (lat0, lng0) and metres-per-degree (kx, ky) for a set of points"""
+    lat0 = sum(p[0] for p in coords) / len(coords)
+    lng0 = sum(p[1] for p in coords) / len(coords)
+    ky = math.radians(1) * EARTH_RADIUS_M
+    kx = ky * math.cos(math.radians(lat0))
+    return lat0, lng0, kx, ky
+
+
+def project(coords, frame=None):
+    lat0, lng0, kx, ky = frame or local_frame(coords)
+    return [((lng - lng0) * kx, (lat - lat0) * ky) for lat, lng in coords]
+
+
+def signed_area(points):
+    """Shoelace area of projected points; positive when counter-clockwise"""
+    area = 0.0
+    n = len(points)
+    for i in range(n):
+        x1, y1 = points[i]
+        x2, y2 = points[(i + 1) % n]
+        area += x1 * y2 - x2 * y1
+    return area / 2.0
+
+
+def polygon_area_m2(coords):
+    ring = open_ring(coords)
+    if len(ring) < 3:
+        return 0.0
+    return abs(signed_area(project(ring)))
+
+
+def haversine_m(lat1, lon1, lat2, lon2):
+    """Great-circle distance in metres"""
+    p1, p2 = math.radians(lat1), math.radians(lat2)
+    dphi = math.radians(lat2 - lat1)
+    dl = math.radians(lon2 - lon1)
+    a = math.sin(dphi / 2) ** 2 + math.cos(p1) * math.cos(p2) * math.sin(dl / 2) ** 2
+    return EARTH_RADIUS_M * 2 * math.atan2(math.sqrt(a), math.sqrt(1 - a))
+
+
+def bounding_box(coords):
+    """[min_lat, min_lng, max_lat, max_lng]"""
+    lats = [p[0] for p in coords]
+    lngs = [p[1] for p in coords]
+    return [min(lats), min(lngs), max(lats), max(lngs)]
+
+
+class EdgeSet:
+    """Projected polygon edges for repeated point-to-boundary distance queries"""
+
+    def __init__(self, coords):
+        self.coords = coords
+        ring = open_ring(coords)
+        self.frame = local_frame(ring)
+        points = project(ring, self.frame)
+        self.edges = [(points[i], points[(i + 1) % len(points)]) for i in range(len(points))]
+        if np is not None:
+            self.a = np.asarray([e[0] for e in self.edges], dtype=np.float64)
+            d = np.asarray([e[1] for e in self.edges], dtype=np.float64) - self.a
+            self.d = d
+            self.dd = np.maximum((d * d).sum(axis=1), 1e-12)
+
+    def distances_m(self, lats, lngs):
+        """Distance in metres from each point to the nearest edge (numpy arrays in, array out)"""
+        lat0, lng0, kx, ky = self.frame
+        p = np.stack(((np.asarray(lngs) - lng0) * kx, (np.asarray(lats) - lat0) * ky), axis=-1)
+        rel = p[:, None, :] - self.a[None, :, :]
+        t = np.clip((rel * self.d[None, :, :]).sum(axis=2) / self.dd[None, :], 0.0, 1.0)
+        nearest = rel - t[:, :, None] * self.d[None, :, :]
+        return np.sqrt((nearest * nearest).sum(axis=2)).min(axis=1)
+
+    def distance_m(self, lat, lng):
+        if np is not None:
+            return float(self.distances_m([lat], [lng])[0])
+        (px, py), = project([(lat, lng)], self.frame)
+        best = math.inf
+        for (ax, ay), (bx, by) in self.edges:
+            dx, dy = bx - ax, by - ay
+            dd = dx * dx + dy * dy
+            t = 0.0 if dd == 0 else min(1.0, max(0.0, ((px - ax) * dx + (py - ay) * dy) / dd))
+            best = min(best, math.hypot(px - ax - t * dx, py - ay - t * dy))
+        return best
+
+
+def contains_many(coords, lats, lngs):
+    """
+    Ray-casting containment for many points at once (numpy arrays in, bool
+    array out). Same crossing test and float operations as
+    Geofence2.contains_point, one vectorized pass per edge.
+    """
+    lats = np.asarray(lats, dtype=np.float64)
+    lngs = np.asarray(lngs, dtype=np.float64)
+    inside = np.zeros(lats.shape, dtype=bool)
+    ring = open_ring(coords or [])
+    if len(ring) < 3:
+        return inside
+    with np.errstate(divide="ignore", invalid="ignore"):
+        for (xi, yi), (xj, yj) in zip(ring, ring[-1:] + ring[:-1]):
+            crosses = (yi > lngs) != (yj > lngs)
+            inside ^= crosses & (lats < (xj - xi) * (lngs - yi) / (yj - yi) + xi)
+    return inside
+
+
+# ---------- strip index for large polygons ----------
+STRIP_INDEX_MIN_VERTICES = 32
+STRIP_INDEX_CACHE_SIZE = 256
+STRIP_INDEX_FILL = 4
+
+
+class StripIndex:
+    """
+    Ray-casting containment that only tests the edges near the point.
+
+    The crossing test of Geofence2.contains_point runs along the second
+    coordinate (lng): an edge can only toggle the result for points whose lng
+    lies within the edge's lng range. The polygon's lng extent is cut into
+    equal strips and each edge is listed in every strip its range touches, so
+    a query tests the edges of one strip instead of all of them. There is one
+    strip per edge unless edges are long, in which case strips are widened so
+    the lists hold about STRIP_INDEX_FILL entries per edge in total. The
+    strip of a value is a monotonic function of it, so every edge that could
+    cross a point is in that point's strip, and each is tested with the same
+    expression and operands as contains_point; results agree exactly.
+    """
+
+    def __init__(self, coords):
+        ring = open_ring(coords)
+        self.coords = [list(p) for p in coords]
+        # (i, i - 1) pairs, in the orientation contains_point uses
+        edges = [
+            (xi, yi, xj, yj)
+            for (xi, yi), (xj, yj) in zip(ring, ring[-1:] + ring[:-1])
+            if yi != yj  # horizontal edges never cross
+        ]
+        ys = [p[1] for p in ring]
+        self.y0, self.y1 = min(ys), max(ys)
+        extent = self.y1 - self.y0
+        # Each edge lands in about span / strip width + 1 strips
+        spans = sum(abs(e[3] - e[1]) for e in edges)
+        self.count = max(1, len(edges))
+        if spans > 0:
+            self.count = max(1, min(self.count, int(STRIP_INDEX_FILL * len(edges) * extent / spans)))
+        self.scale = self.count / extent if extent > 0 else 0.0
+        strips = [[] for _ in range(self.count)]
+        for edge in edges:
+            lo, hi = sorted((edge[1], edge[3]))
+            for k in range(self._strip(lo), self._strip(hi) + 1):
+                strips[k].append(edge)
+        self.strips = strips
+
+        if np is not None:
+            self.offsets = np.cumsum([0] + [len(e) for e in strips])
+            flat = np.asarray([e for strip in strips for e in strip], dtype=np.float64).reshape(-1, 4)
+            self.xi, self.yi, self.xj, self.yj = flat.T
+
+    def _strip(self, y):
+        k = int((y - self.y0) * self.scale)
+        return 0 if k < 0 else min(k, self.count - 1)
+
+    def contains(self, lat, lng):
+        # No edge crosses outside the lng extent (this also answers NaN)
+        if not self.y0 <= lng <= self.y1:
+            return False
+        inside = False
+        for xi, yi, xj, yj in self.strips[self._strip(lng)]:
+            if ((yi > lng) != (yj > lng)) and (lat < (xj - xi) * (lng - yi) / (yj - yi) + xi):
+                inside = not inside
+        return inside
+
+    def contains_many(self, lats, lngs):
+        """Vectorized `contains`; agrees exactly with contains_many(coords, ...)"""
+        lats = np.asarray(lats, dtype=np.float64)
+        lngs = np.asarray(lngs, dtype=np.float64)
+        inside = np.zeros(lats.shape, dtype=bool)
+        points = np.flatnonzero((lngs >= self.y0) & (lngs <= self.y1))
+        if not len(points):
+            return inside
+        strip = np.minimum(((lngs[points] - self.y0) * self.scale).astype(np.int64), self.count - 1)
+        starts = self.offsets[strip]
+        counts = self.offsets[strip + 1] - starts
+        # One row per (point, candidate edge) pair
+        owner = np.repeat(np.arange(len(points)), counts)
+        edge = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts) + np.repeat(starts, counts)
+        lat, lng = lats[points][owner], lngs[points][owner]
+        xi, yi, xj, yj = self.xi[edge], self.yi[edge], self.xj[edge], self.yj[edge]
+        with np.errstate(divide="ignore", invalid="ignore"):
+            hits = ((yi > lng) != (yj > lng)) & (lat < (xj - xi) * (lng - yi) / (yj - yi) + xi)
+        inside[points] = np.bincount(owner, weights=hits, minlength=len(points)).astype(np.int64) % 2 == 1
+        return inside
+
+
+_strip_indexes = OrderedDict()
+_edge_sets = OrderedDict()
+_shared_lock = threading.Lock()
+
+
+def _shared(cache, build, coords, key):
+    """
+    `build(coords)`, kept in `cache` under `key` (a fence version) per
+    process, LRU. An entry is only reused for the same coordinates.
+    """
+    if key is not None:
+        with _shared_lock:
+            value = cache.get(key)
+            if value is not None:
+                cache.move_to_end(key)
+        if value is not None and value.coords == coords:
+            return value
+    try:
+        value = build(coords)
+    except (ValueError, TypeError, IndexError):
+        return None
+    if key is not None:
+        with _shared_lock:
+            cache[key] = value
+            while len(cache) > STRIP_INDEX_CACHE_SIZE:
+                cache.popitem(last=False)
+    return value
+
+
+def clear_shared():
+    with _shared_lock:
+        _strip_indexes.clear()
+        _edge_sets.clear()
+
+
+def strip_index(coords, key=None):
+    """
+    StripIndex for a polygon, or None when it is too small to need one.
+    With a `key` (a fence version) indexes are kept per process, LRU.
+    """
+    try:
+        if len(open_ring(coords or [])) < STRIP_INDEX_MIN_VERTICES:
+            return None
+    except TypeError:
+        return None
+    return _shared(_strip_indexes, StripIndex, coords, key)
+
+
+def edge_set(coords, key=None):
+    """EdgeSet for a polygon, or None under three vertices; kept like strip_index"""
+    try:
+        if len(open_ring(coords or [])) < 3:
+            return None
+    except TypeError:
+        return None
+    return _shared(_edge_sets, EdgeSet, coords, key)
+
+
+def _offset(a, b, p):
+    """Signed perpendicular distance of p from segment a->b; negative to the right"""
+    dx, dy = b[0] - a[0], b[1] - a[1]
+    length = math.hypot(dx, dy)
+    if length == 0.0:
+        return math.hypot(p[0] - a[0], p[1] - a[1])
+    return (dx * (p[1] - a[1]) - dy * (p[0] - a[0])) / length
+
+
+def _simplify_chain(points, first, last, orientation, tolerance, max_inward, keep):
+    stack = [(first, last)]
+    while stack:
+        i, j = stack.pop()
+        worst, worst_ratio = None, 1.0
+        for k in range(i + 1, j):
+            d = _offset(points[i], points[j % len(points)], points[k]) * orientation
+            # Vertices outside the chord (d < 0) would be cut off, pulling the fence inward
+            limit = tolerance if d >= 0 else min(tolerance, max_inward)
+            dist = abs(d)
+            if dist == 0.0:
+                continue
+            ratio = dist / limit if limit > 0 else math.inf
+            if ratio > worst_ratio:
+                worst, worst_ratio = k, ratio
+        if worst is not None:
+            keep.add(worst)
+            stack.append((i, worst))
+            stack.append((worst, j))
+
+
+def simplify_polygon(coords, tolerance_m, max_inward_m=1.0):
+    """
+    Douglas-Peucker simplification of a closed polygon.
+
+    Vertices may move the boundary outward by up to `tolerance_m`, but never
+    inward by more than `max_inward_m`, so the simplified fence does not
+    exclude ground the original covered beyond that bound. Returns a closed
+    ring; the input is returned unchanged if it cannot be simplified.
+    """
+    ring = open_ring(coords)
+    if len(ring) <= 3 or tolerance_m <= 0:
+        return [list(p) for p in coords]
+
+    points = project(ring)
+    orientation = 1.0 if signed_area(points) > 0 else -1.0
+
+    # Split the ring at vertex 0 and the vertex farthest from it
+    far = max(range(len(points)), key=lambda k: math.hypot(points[k][0] - points[0][0], points[k][1] - points[0][1]))
+    keep = {0, far}
+    _simplify_chain(points, 0, far, orientation, tolerance_m, max_inward_m, keep)
+    _simplify_chain(points, far, len(points), orientation, tolerance_m, max_inward_m, keep)
+
+    if len(keep) < 3:
+        return [list(p) for p in coords]
+    simplified = [list(ring[k]) for k in sorted(keep)]
+    return simplified + [simplified[0]]
+
+
+# ---------- encoded polyline (Google polyline algorithm) ----------
+def _encode_value(value, out):
+    value = ~(value << 1) if value < 0 else value << 1
+    while value >= 0x20:
+        out.append(chr((0x20 | (value & 0x1f)) + 63))
+        value >>= 5
+    out.append(chr(value + 63))
+
+
+class PolylineEncoder:
+    """Incremental encoder so long tracks can be encoded in one pass"""
+
+    def __init__(self, precision=5):
+        self.factor = 10 ** precision
+        self._prev = (0, 0)
+        self._out = []
+
+    def add(self, lat, lng):
+        q = (int(round(lat * self.factor)), int(round(lng * self.factor)))
+        _encode_value(q[0] - self._prev[0], self._out)
+        _encode_value(q[1] - self._prev[1], self._out)
+        self._prev = q
+
+    def result(self):
+        return "".join(self._out)
+
+
+def encode_polyline(coords, precision=5):
+    encoder = PolylineEncoder(precision)
+    for lat, lng in coords:
+        encoder.add(lat, lng)
+    return encoder.result()
+
+
+def decode_polyline(encoded, precision=5):
+    factor = 10 ** precision
+    coords, values = [], []
+    lat = lng = 0
+    shift = result = 0
+    for char in encoded:
+        b = ord(char) - 63
+        result |= (b & 0x1f) << shift
+        shift += 5
+        if b < 0x20:
+            values.append(~(result >> 1) if result & 1 else result >> 1)
+            shift = result = 0
+            if len(values) == 2:
+                lat += values[0]
+                lng += values[1]
+                coords.append([lat / factor, lng / factor])
+                values = []
+    return coords
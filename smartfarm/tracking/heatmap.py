@@ -0,0 +1,153 @@
+"""
+Server-side activity heatmaps over stored telemetry.
+
+Fixes for the selected devices are read in chunks and binned with numpy into a
+grid of square cells in a local metre frame (x east, y north), so only the
+grid leaves the server. Devices with a cold archive (tracking.cold_archive)
+are read from its memory-mapped columns for the range it covers. The grid is returned sparse as [row, col, count]
+triples with row 0 at the north edge, or rendered to a PNG overlay.
+
+numpy is optional for the rest of the app; `np` is None when it is missing.
+"""
+import io
+import math
+
+from django.conf import settings
+from django.db.models import Max, Min
+
+from . import cold_archive
+from .geometry import EARTH_RADIUS_M
+from .models import GPSData
+
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover - analytics endpoints report 501
+    np = None
+
+DEFAULTS = {
+    "CELL_M": 50.0,
+    "MIN_CELL_M": 5.0,
+    "MAX_CELLS": 250000,
+    "CHUNK_SIZE": 50000,
+}
+
+# Colour stops for the PNG ramp, from sparse to dense
+RAMP = [(0, 0, 255), (0, 255, 255), (0, 255, 0), (255, 255, 0), (255, 0, 0)]
+
+
+def heatmap_setting(name):
+    return getattr(settings, "TRACKING_HEATMAP", {}).get(name, DEFAULTS[name])
+
+
+def _grid_shape(width_m, height_m, cell_m, max_cells):
+    """Grow the cell size until the grid fits in max_cells"""
+    while True:
+        cols = int(width_m // cell_m) + 1
+        rows = int(height_m // cell_m) + 1
+        if rows * cols <= max_cells:
+            return cell_m, rows, cols
+        cell_m *= math.sqrt(rows * cols / max_cells) * 1.01
+
+
+def build_heatmap(device_ids, start=None, end=None, cell_m=None):
+    """Density grid of the fixes of `device_ids` between `start` and `end`"""
+    tracks = cold_archive.open_tracks(device_ids)
+    qs = GPSData.objects.filter(device_id__in=[d for d in device_ids if d not in tracks])
+    if start:
+        qs = qs.filter(timestamp__gte=start)
+    if end:
+        qs = qs.filter(timestamp__lte=end)
+
+    extent = qs.aggregate(
+        min_lat=Min("latitude"), max_lat=Max("latitude"),
+        min_lng=Min("longitude"), max_lng=Max("longitude"),
+    )
+    archived = [
+        cold_archive.load_track(device_id, start, end, track=track, columns=("lat", "lng"))
+        for device_id, track in tracks.items()
+    ]
+    archived = [a for a in archived if len(a["lat"])]
+    for a in archived:
+        for key in ("lat", "lng"):
+            low, high = float(a[key].min()), float(a[key].max())
+            extent[f"min_{key}"] = low if extent[f"min_{key}"] is None else min(extent[f"min_{key}"], low)
+            extent[f"max_{key}"] = high if extent[f"max_{key}"] is None else max(extent[f"max_{key}"], high)
+    cell_m = float(cell_m or heatmap_setting("CELL_M"))
+    if not math.isfinite(cell_m):
+        raise ValueError(f"cell_m must be finite, not {cell_m}")
+    cell_m = max(cell_m, heatmap_setting("MIN_CELL_M"))
+    if extent["min_lat"] is None:
+        return {"bounds": None, "cell_m": cell_m, "rows": 0, "cols": 0, "points": 0, "max": 0, "cells": []}
+
+    lat0, lng0 = extent["min_lat"], extent["min_lng"]
+    ky = math.radians(1) * EARTH_RADIUS_M
+    kx = ky * math.cos(math.radians((extent["min_lat"] + extent["max_lat"]) / 2))
+    cell_m, rows, cols = _grid_shape(
+        (extent["max_lng"] - lng0) * kx,
+        (extent["max_lat"] - lat0) * ky,
+        cell_m,
+        heatmap_setting("MAX_CELLS"),
+    )
+    x_edges = np.arange(cols + 1) * cell_m
+    y_edges = np.arange(rows + 1) * cell_m
+    grid = np.zeros((rows, cols), dtype=np.int64)
+
+    def add(lat, lng):
+        y = (np.asarray(lat, dtype=np.float64) - lat0) * ky
+        x = (np.asarray(lng, dtype=np.float64) - lng0) * kx
+        counts, _, _ = np.histogram2d(y, x, bins=(y_edges, x_edges))
+        grid[:] += counts.astype(np.int64)
+
+    def add_rows(chunk):
+        points = np.asarray(chunk, dtype=np.float64)
+        add(points[:, 0], points[:, 1])
+
+    chunk_size = heatmap_setting("CHUNK_SIZE")
+    chunk = []
+    for point in qs.values_list("latitude", "longitude").iterator(chunk_size=chunk_size):
+        chunk.append(point)
+        if len(chunk) >= chunk_size:
+            add_rows(chunk)
+            chunk = []
+    if chunk:
+        add_rows(chunk)
+    for a in archived:
+        for lo in range(0, len(a["lat"]), chunk_size):
+            add(a["lat"][lo:lo + chunk_size], a["lng"][lo:lo + chunk_size])
+
+    # Row 0 is the southern edge so far; flip so rows run north to south like an image
+    grid = grid[::-1]
+    nonzero = np.nonzero(grid)
+    return {
+        "bounds": [
+            lat0,
+            lng0,
+            lat0 + rows * cell_m / ky,
+            lng0 + cols * cell_m / kx,
+        ],
+        "cell_m": round(cell_m, 3),
+        "rows": rows,
+        "cols": cols,
+        "points": int(grid.sum()),
+        "max": int(grid.max()),
+        "cells": np.column_stack((nonzero[0], nonzero[1], grid[nonzero])).tolist(),
+    }
+
+
+def render_png(heatmap):
+    """RGBA PNG of a heatmap, one pixel per cell, log-scaled, transparent where empty"""
+    from PIL import Image
+
+    rows, cols = max(heatmap["rows"], 1), max(heatmap["cols"], 1)
+    rgba = np.zeros((rows, cols, 4), dtype=np.uint8)
+    if heatmap["cells"]:
+        cells = np.asarray(heatmap["cells"], dtype=np.int64)
+        level = np.log1p(cells[:, 2]) / np.log1p(max(heatmap["max"], 1))
+        stops = np.linspace(0.0, 1.0, len(RAMP))
+        for channel in range(3):
+            rgba[cells[:, 0], cells[:, 1], channel] = np.interp(level, stops, [c[channel] for c in RAMP])
+        rgba[cells[:, 0], cells[:, 1], 3] = (120 + 135 * level).astype(np.uint8)
+
+    buffer = io.BytesIO()
+    Image.fromarray(rgba).save(buffer, format="PNG", optimize=True)
+    return buffer.getvalue()
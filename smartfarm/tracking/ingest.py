@@ -0,0 +1,283 @@
+"""
+Telemetry ingest shared by every transport that accepts device fixes.
+
+Ingest is idempotent on (device_id, timestamp): retried uploads are dropped by
+an in-memory recent-key filter before touching the DB, and anything that gets
+past it is caught by the unique constraint. Only newly stored fixes go on to
+geofence evaluation, live fan-out and alerting. Geofence and speed checks use
+the noise-filtered position (tracking.smoothing); the raw fix is stored as sent.
+With sharding on, a batch is split by owner and each part stored in its shard.
+"""
+import threading
+from collections import OrderedDict, defaultdict, deque, namedtuple
+
+from django.db import IntegrityError, transaction
+
+from .alerting import alert_policy
+from .boundary import RecentFix, boundary_setting, evaluate_position, motion_tracker, report_seconds
+from .cache import response_cache
+from .clustering import position_index
+from .devices import lookup_devices
+from .live import live_hub, position_delta
+from .liveness import liveness_monitor
+from .models import GPSData, Geofence2
+from .sharding import current_db, database_scope, db_for_owner
+from .smoothing import noise_filter, smoothing_setting
+
+# poll_seconds: recommended report interval for the fix's device (None if unregistered);
+# a duplicate single fix carries the inside_geofence stored with the original
+FixResult = namedtuple("FixResult", "gps inside_geofence duplicate poll_seconds")
+
+
+class RecentKeyFilter:
+    """Bounded LRU of the last few timestamps seen per device"""
+
+    def __init__(self, per_device=64, max_devices=100000):
+        self.per_device = per_device
+        self.max_devices = max_devices
+        self._devices = OrderedDict()
+        self._lock = threading.Lock()
+
+    def seen(self, device_id, timestamp):
+        with self._lock:
+            entry = self._devices.get(device_id)
+            return entry is not None and timestamp in entry[1]
+
+    def add(self, device_id, timestamp):
+        with self._lock:
+            entry = self._devices.get(device_id)
+            if entry is None:
+                entry = self._devices[device_id] = (deque(), set())
+                if len(self._devices) > self.max_devices:
+                    self._devices.popitem(last=False)
+            else:
+                self._devices.move_to_end(device_id)
+            order, keys = entry
+            if timestamp in keys:
+                return
+            order.append(timestamp)
+            keys.add(timestamp)
+            if len(order) > self.per_device:
+                keys.discard(order.popleft())
+
+    def forget(self, device_id):
+        with self._lock:
+            self._devices.pop(device_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._devices.clear()
+
+
+recent_fixes = RecentKeyFilter()
+
+
+def _store_one(obj):
+    try:
+        with transaction.atomic(using=current_db()):
+            obj.save()
+    except IntegrityError:
+        return []
+    return [obj]
+
+
+def _store_many(objs, owners):
+    """Conflict-ignoring bulk insert; returns the objects that now have a row"""
+    device_ids = {o.device_id for o in objs}
+    timestamps = {o.timestamp for o in objs}
+    existing = set(
+        GPSData.objects.filter(device_id__in=device_ids, timestamp__in=timestamps)
+        .values_list("device_id", "timestamp")
+    )
+    new = [o for o in objs if (o.device_id, o.timestamp) not in existing]
+    if not new:
+        return []
+
+    GPSData.objects.bulk_create(new, batch_size=500, ignore_conflicts=True)
+    ids = {
+        (device_id, timestamp): pk
+        for pk, device_id, timestamp in GPSData.objects.filter(
+            device_id__in={o.device_id for o in new},
+            timestamp__in={o.timestamp for o in new},
+        ).values_list("pk", "device_id", "timestamp")
+    }
+    db = GPSData.objects.db
+    for o in new:
+        o.pk = ids.get((o.device_id, o.timestamp))
+        # ignore_conflicts returns no rows, so bulk_create leaves these unset
+        o._state.adding = False
+        o._state.db = db
+
+    # bulk_create sends no post_save, so bump the dashboard caches here
+    for owner in owners:
+        response_cache.bump(owner.id)
+    return [o for o in new if o.pk]
+
+
+def _after_store(gps, owner, asset, kind):
+    # A reported speed only counts if the filtered track moves that fast too
+    speed = gps.speed
+    if getattr(gps, "filtered_speed", None) is not None:
+        speed = min(speed or 0.0, gps.filtered_speed)
+
+    if owner:
+        position_index.record_fix(
+            owner.id, gps.device_id, gps.latitude, gps.longitude,
+            gps.inside_geofence, gps.timestamp,
+            kind=kind,
+            name=getattr(asset, "name", None) or getattr(asset, "full_name", ""),
+        )
+        live_hub.publish(owner.id, position_delta(
+            gps.device_id, gps.latitude, gps.longitude,
+            gps.speed, gps.timestamp, gps.inside_geofence,
+        ))
+        liveness_monitor.touch(gps, owner.id)
+        if not gps.is_outlier:
+            motion_tracker.observe(gps.device_id, RecentFix(
+                gps.timestamp,
+                gps.filtered_latitude if gps.filtered_latitude is not None else gps.latitude,
+                gps.filtered_longitude if gps.filtered_longitude is not None else gps.longitude,
+                speed, gps.boundary_distance_m,
+            ))
+
+    # Alerts are deduplicated and coalesced in memory by the alert policy
+    speed_limit, cooldown, boundary_warning = alert_policy.thresholds(owner.id if owner else None)[:3]
+
+    if owner and not gps.inside_geofence:
+        alert_policy.raise_alert(
+            gps, "geofence",
+            f"{getattr(asset, 'name', None) or asset.full_name} has left the geofence!",
+        )
+
+    distance = gps.boundary_distance_m
+    if owner and boundary_warning and distance is not None:
+        if gps.inside_geofence and distance <= boundary_warning:
+            alert_policy.raise_alert(
+                gps, "boundary",
+                f"{getattr(asset, 'name', None) or asset.full_name} is {round(distance)} m from the geofence edge",
+            )
+        elif not gps.inside_geofence or distance > boundary_warning * boundary_setting("RESOLVE_FACTOR"):
+            # Back well inside, or already out (the geofence alert takes over)
+            alert_policy.resolve(gps.device_id, "boundary")
+
+    if speed and speed > speed_limit:
+        alert_policy.raise_alert(
+            gps, "speed",
+            f"Overspeed detected: {round(speed, 1)} km/h",
+            cooldown=cooldown,
+        )
+
+
+def ingest_fixes(rows):
+    """
+    Store validated fixes (dicts of GPSData fields) and run geofence and alert
+    logic on the new ones. Returns a FixResult per input row, in order.
+
+    Fixes from registered trackers are stored under the device id spelled as
+    on the asset, whatever case or padding the device sent.
+    """
+    registered = lookup_devices({row["device_id"] for row in rows})
+    devices = [registered[row["device_id"]] for row in rows]
+    rows = [dict(row, device_id=device.device_id) if device else row for row, device in zip(rows, devices)]
+
+    groups = defaultdict(list)
+    for i, device in enumerate(devices):
+        groups[db_for_owner(device.owner_id if device else None)].append(i)
+    if len(groups) == 1:
+        with database_scope(next(iter(groups))):
+            return _ingest(rows, devices)
+
+    results = [None] * len(rows)
+    for db, indexes in groups.items():
+        with database_scope(db):
+            for i, result in zip(indexes, _ingest([rows[i] for i in indexes], [devices[i] for i in indexes])):
+                results[i] = result
+    return results
+
+
+def _ingest(rows, registered):
+    """Ingest fixes whose devices all keep their rows in the current database"""
+    results = [FixResult(None, None, True, None)] * len(rows)
+    fresh, batch_keys = [], set()
+    for i, row in enumerate(rows):
+        key = (row["device_id"], row["timestamp"])
+        if key in batch_keys or recent_fixes.seen(*key):
+            continue
+        batch_keys.add(key)
+        fresh.append((i, row))
+    if not fresh:
+        return _with_poll_seconds(rows, registered, _with_stored_state(rows, results))
+
+    devices, fences = {}, {}
+    for device in registered:
+        if device is None or device.device_id in devices:
+            continue
+        if device.owner_id not in fences:
+            fences[device.owner_id] = list(Geofence2.objects.filter(owner_id=device.owner_id, is_active=True))
+        devices[device.device_id] = (device.owner, device.asset, device.kind, fences[device.owner_id])
+
+    filtered = {}
+    if smoothing_setting("ENABLED"):
+        for i, row in sorted(fresh, key=lambda item: item[1]["timestamp"]):
+            filtered[i] = noise_filter.update(row["device_id"], row["latitude"], row["longitude"], row["timestamp"])
+
+    objs = []
+    for i, row in fresh:
+        owner, _, _, geofences = devices.get(row["device_id"], (None, None, None, []))
+        position = filtered.get(i)
+        lat, lng = (position.latitude, position.longitude) if position else (row["latitude"], row["longitude"])
+        inside = distance = None
+        if owner:
+            inside, distance = evaluate_position(geofences, lat, lng)
+        obj = GPSData(
+            **row,
+            inside_geofence=inside,
+            boundary_distance_m=distance,
+            filtered_latitude=position.latitude if position else None,
+            filtered_longitude=position.longitude if position else None,
+            is_outlier=position.outlier if position else False,
+        )
+        obj.filtered_speed = position.speed_kmh if position else None
+        obj.row_index = i
+        objs.append(obj)
+
+    if len(objs) == 1:
+        stored = _store_one(objs[0])
+    else:
+        owners = {d[0] for d in devices.values()}
+        stored = _store_many(objs, owners)
+
+    for obj in objs:
+        recent_fixes.add(obj.device_id, obj.timestamp)
+    for obj in sorted(stored, key=lambda o: o.timestamp):
+        owner, asset, kind, _ = devices.get(obj.device_id, (None, None, None, []))
+        _after_store(obj, owner, asset, kind)
+        results[obj.row_index] = FixResult(obj, obj.inside_geofence, False, None)
+    return _with_poll_seconds(rows, registered, _with_stored_state(rows, results))
+
+
+def _with_stored_state(rows, results):
+    """A retried single fix gets the geofence state stored with the original"""
+    if len(rows) == 1 and results[0].duplicate:
+        inside = GPSData.objects.filter(
+            device_id=rows[0]["device_id"], timestamp=rows[0]["timestamp"]
+        ).values_list("inside_geofence", flat=True).first()
+        results[0] = results[0]._replace(inside_geofence=inside)
+    return results
+
+
+def _with_poll_seconds(rows, registered, results):
+    """Fill in each registered device's recommended report interval after this batch"""
+    polls = {}
+    for i, (row, device) in enumerate(zip(rows, registered)):
+        if device is None:
+            continue
+        if device.device_id not in polls:
+            thresholds = alert_policy.thresholds(device.owner_id)
+            polls[device.device_id] = report_seconds(
+                motion_tracker.recent(device.device_id) or [],
+                thresholds.boundary_warning_m,
+                (thresholds.min_report_seconds, thresholds.max_report_seconds),
+            )
+        results[i] = results[i]._replace(poll_seconds=polls[device.device_id])
+    return results
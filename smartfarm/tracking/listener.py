@@ -0,0 +1,243 @@
+"""
+Raw-socket telemetry listener.
+
+Devices that do not need an HTTP response can send fixes over UDP (one or
+more lines per datagram) or a long-lived TCP connection (one line per fix):
+
+    device_id,timestamp,latitude,longitude[,speed[,altitude]]
+
+`timestamp` is epoch seconds or ISO 8601. A line starting with "{" is read
+as a JSON object with the GPSData field names instead.
+
+The event loop only parses and queues. A single writer thread drains the
+queue in micro-batches through `ingest_fixes`, so fixes get exactly the
+geofence, alert and live-update handling of `gps_data`, at one bulk insert
+per batch. Fixes from unregistered devices, or from devices over their
+ingest rate, are dropped by the writer before they reach the database.
+"""
+import asyncio
+import json
+import logging
+import math
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone as dt_timezone
+
+from django.conf import settings
+from django.db import close_old_connections
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from .devices import normalize_device_id, owner_id_for_device
+from .ingest import ingest_fixes
+from .throttling import ingest_stats
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    "HOST": "0.0.0.0",
+    "UDP_PORT": 5005,
+    "TCP_PORT": 5006,
+    "BATCH_SIZE": 1000,
+    "FLUSH_MS": 50,
+    "MAX_PENDING": 100000,
+    "MAX_LINE_BYTES": 1024,
+}
+
+
+def listener_setting(name):
+    return getattr(settings, "TRACKING_LISTENER", {}).get(name, DEFAULTS[name])
+
+
+def _timestamp(value):
+    try:
+        seconds = float(value)
+    except ValueError:
+        parsed = parse_datetime(value)
+        if parsed is None:
+            raise ValueError(f"bad timestamp {value!r}")
+        return timezone.make_aware(parsed) if timezone.is_naive(parsed) else parsed
+    try:
+        return datetime.fromtimestamp(seconds, tz=dt_timezone.utc)
+    except (OverflowError, OSError, ValueError):
+        raise ValueError(f"timestamp out of range {value!r}")
+
+
+def _number(value, default=None):
+    """A finite float; the HTTP serializer rejects inf and nan too"""
+    if value in (None, "") and default is not None:
+        return default
+    number = float(value)
+    if not math.isfinite(number):
+        raise ValueError(f"not a finite number {value!r}")
+    return number
+
+
+def parse_fix(line):
+    """Parse one line into a dict of GPSData fields; raises ValueError"""
+    line = line.strip()
+    if line.startswith("{"):
+        data = json.loads(line)
+        fields = [data.get(k) for k in ("device_id", "timestamp", "latitude", "longitude", "speed", "altitude")]
+    else:
+        fields = line.split(",")
+        if not 4 <= len(fields) <= 6:
+            raise ValueError("expected 4 to 6 comma-separated fields")
+        fields += [None] * (6 - len(fields))
+
+    device_id, ts, lat, lng, speed, altitude = fields
+    device_id = str(device_id or "").strip()
+    if not device_id or len(device_id) > 100:
+        raise ValueError("bad device id")
+    lat, lng = _number(lat), _number(lng)
+    if not (-90 <= lat <= 90 and -180 <= lng <= 180):
+        raise ValueError("coordinates out of range")
+    return {
+        "device_id": device_id,
+        "timestamp": _timestamp(str(ts).strip()),
+        "latitude": lat,
+        "longitude": lng,
+        "speed": _number(speed, 0.0),
+        "altitude": _number(altitude, 0.0),
+    }
+
+
+class TelemetryListener:
+    def __init__(self, batch_size=None, flush_ms=None, max_pending=None):
+        self.batch_size = batch_size or listener_setting("BATCH_SIZE")
+        self.flush_interval = (flush_ms or listener_setting("FLUSH_MS")) / 1000.0
+        self.max_pending = max_pending or listener_setting("MAX_PENDING")
+        self.stats = Counter()
+        self._pending = []
+        self._wakeup = None
+        # One writer keeps batches (and so each device's fixes) in arrival order
+        self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="telemetry-writer")
+
+    # ---------- event loop side ----------
+    def feed(self, data):
+        """Parse a chunk of complete lines and queue the fixes"""
+        for raw in data.split(b"\n"):
+            if not raw.strip():
+                continue
+            try:
+                fix = parse_fix(raw.decode("utf-8", "replace"))
+            except (ValueError, TypeError, json.JSONDecodeError):
+                self.stats["malformed"] += 1
+                continue
+            if len(self._pending) >= self.max_pending:
+                self.stats["dropped_backlog"] += 1
+                continue
+            self._pending.append(fix)
+        if len(self._pending) >= self.batch_size:
+            self._wakeup.set()
+
+    async def flush_forever(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            while self._pending:
+                batch = self._pending[:self.batch_size]
+                del self._pending[:self.batch_size]
+                await loop.run_in_executor(self._writer, self.write_batch, batch)
+
+    # ---------- writer thread ----------
+    def write_batch(self, batch):
+        close_old_connections()
+        try:
+            # Owner lookups can query the registry, so resolve them before taking the stats lock
+            owners = {device_id: owner_id_for_device(device_id) for device_id in {fix["device_id"] for fix in batch}}
+            accepted = []
+            with ingest_stats.lock:
+                for fix in batch:
+                    if owners[fix["device_id"]] is None:
+                        ingest_stats.counters["unknown_device"] += 1
+                        self.stats["unknown_device"] += 1
+                    elif not ingest_stats.device_buckets.allow(normalize_device_id(fix["device_id"])):
+                        ingest_stats.counters["throttled_device"] += 1
+                        self.stats["throttled_device"] += 1
+                    else:
+                        accepted.append(fix)
+            if not accepted:
+                return
+            results = ingest_fixes(accepted)
+            duplicates = sum(1 for r in results if r.duplicate)
+            self.stats["stored"] += len(results) - duplicates
+            self.stats["duplicates"] += duplicates
+        except Exception:
+            self.stats["failed"] += len(batch)
+            logger.exception("Telemetry batch of %s fixes failed", len(batch))
+
+    # ---------- servers ----------
+    async def serve(self, host, udp_port=None, tcp_port=None):
+        loop = asyncio.get_running_loop()
+        self._wakeup = asyncio.Event()
+        listener = self
+
+        class Datagrams(asyncio.DatagramProtocol):
+            def datagram_received(self, data, addr):
+                listener.stats["datagrams"] += 1
+                listener.feed(data)
+
+        async def handle_stream(reader, writer):
+            listener.stats["connections"] += 1
+            buffer = b""
+            try:
+                while True:
+                    chunk = await reader.read(65536)
+                    if not chunk:
+                        break
+                    buffer += chunk
+                    complete, _, buffer = buffer.rpartition(b"\n")
+                    if complete:
+                        listener.feed(complete)
+                    if len(buffer) > listener_setting("MAX_LINE_BYTES"):
+                        listener.stats["malformed"] += 1
+                        buffer = b""
+                if buffer:
+                    listener.feed(buffer)
+            finally:
+                writer.close()
+
+        servers = []
+        if udp_port is not None:
+            transport, _ = await loop.create_datagram_endpoint(Datagrams, local_addr=(host, udp_port))
+            servers.append(transport)
+        if tcp_port is not None:
+            servers.append(await asyncio.start_server(handle_stream, host, tcp_port))
+        try:
+            await self.flush_forever()
+        finally:
+            for server in servers:
+                server.close()
+            if self._pending:
+                batch, self._pending = self._pending, []
+                await loop.run_in_executor(self._writer, self.write_batch, batch)
+
+
+def run_listener(host, udp_port, tcp_port, report_seconds=30, **options):
+    """Run the listener until interrupted, logging counters periodically"""
+    listener = TelemetryListener(**options)
+
+    async def report():
+        while True:
+            await asyncio.sleep(report_seconds)
+            logger.info("Telemetry listener: %s (pending %s)", dict(listener.stats), len(listener._pending))
+
+    async def main():
+        reporter = asyncio.create_task(report())
+        try:
+            await listener.serve(host, udp_port, tcp_port)
+        finally:
+            reporter.cancel()
+
+    started = time.monotonic()
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        pass
+    return listener.stats, time.monotonic() - started
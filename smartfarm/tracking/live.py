@@ -0,0 +1,155 @@
+"""
+Live position fan-out over a plain ASGI WebSocket.
+
+An owner connects once to /ws/positions/?token=<access token>. The ingest path
+publishes a compact delta per fix; each connection keeps only the newest delta
+per device until it is flushed, so a slow client never builds up a backlog.
+
+Deltas look like {"d": device_id, "la": lat, "lo": lng, "s": speed,
+"t": epoch seconds, "in": inside_geofence}.
+
+The hub lives in process memory, so a socket only hears fixes stored by the
+same process. Run the ASGI server as a single worker that also takes
+/api/gps-data/ (and the import endpoints); fixes stored by WSGI workers or by
+the raw-socket listener (`run_telemetry_listener`) reach the feed only through the
+snapshot sent when a client connects.
+"""
+import asyncio
+import json
+import threading
+from urllib.parse import parse_qs
+
+from asgiref.sync import sync_to_async
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.exceptions import InvalidToken, TokenError
+from rest_framework_simplejwt.tokens import AccessToken
+
+from .authentication import CachedJWTAuthentication
+
+
+def position_delta(device_id, lat, lng, speed, timestamp, inside):
+    return {
+        "d": device_id,
+        "la": round(lat, 6),
+        "lo": round(lng, 6),
+        "s": round(speed or 0.0, 1),
+        "t": int(timestamp.timestamp()),
+        "in": bool(inside),
+    }
+
+
+class _Subscription:
+    """Pending deltas for one connection, keyed by device so newer fixes overwrite older ones"""
+
+    def __init__(self, owner_id, loop):
+        self.owner_id = owner_id
+        self.loop = loop
+        self.event = asyncio.Event()
+        self._pending = {}
+        self._lock = threading.Lock()
+
+    def push(self, delta):
+        with self._lock:
+            self._pending[delta["d"]] = delta
+        self.loop.call_soon_threadsafe(self.event.set)
+
+    def drain(self):
+        with self._lock:
+            batch = list(self._pending.values())
+            self._pending.clear()
+        return batch
+
+
+class LiveHub:
+    """Per-process registry of owner subscriptions; see the module docstring"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscribers = {}
+
+    def subscribe(self, owner_id):
+        sub = _Subscription(owner_id, asyncio.get_running_loop())
+        with self._lock:
+            self._subscribers.setdefault(owner_id, set()).add(sub)
+        return sub
+
+    def unsubscribe(self, sub):
+        with self._lock:
+            subs = self._subscribers.get(sub.owner_id)
+            if subs:
+                subs.discard(sub)
+                if not subs:
+                    del self._subscribers[sub.owner_id]
+
+    def publish(self, owner_id, delta):
+        with self._lock:
+            subs = list(self._subscribers.get(owner_id, ()))
+        for sub in subs:
+            try:
+                sub.push(delta)
+            except RuntimeError:
+                # Event loop already closed; the connection is going away
+                self.unsubscribe(sub)
+
+
+live_hub = LiveHub()
+
+
+@sync_to_async
+def _authenticate(scope):
+    params = parse_qs(scope.get("query_string", b"").decode())
+    raw = (params.get("token") or [None])[0]
+    if not raw:
+        return None
+    try:
+        return CachedJWTAuthentication().get_user(AccessToken(raw))
+    except (TokenError, InvalidToken, AuthenticationFailed):
+        return None
+
+
+@sync_to_async
+def _snapshot(owner_id):
+    from .clustering import position_index
+
+    world = (-180.0, -90.0, 180.0, 90.0)
+    points = position_index.query(owner_id, world, position_index.point_zoom)["points"]
+    return [
+        position_delta(p["device_id"], p["latitude"], p["longitude"], None, p["timestamp"], p["inside_geofence"])
+        for p in points
+        if p["timestamp"]
+    ]
+
+
+async def _pump(sub, send):
+    while True:
+        await sub.event.wait()
+        sub.event.clear()
+        batch = sub.drain()
+        if batch:
+            await send({"type": "websocket.send", "text": json.dumps({"type": "positions", "positions": batch})})
+
+
+async def positions_socket(scope, receive, send):
+    """ASGI handler for /ws/positions/"""
+    message = await receive()
+    if message["type"] != "websocket.connect":
+        return
+
+    user = await _authenticate(scope)
+    if user is None:
+        await send({"type": "websocket.close", "code": 4401})
+        return
+
+    await send({"type": "websocket.accept"})
+    sub = live_hub.subscribe(user.id)
+    for delta in await _snapshot(user.id):
+        sub.push(delta)
+    pump = asyncio.create_task(_pump(sub, send))
+    try:
+        while True:
+            message = await receive()
+            if message["type"] == "websocket.disconnect":
+                break
+    finally:
+        live_hub.unsubscribe(sub)
+        pump.cancel()
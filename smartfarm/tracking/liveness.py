@@ -0,0 +1,258 @@
+"""
+Device liveness: notice when a tracker goes silent.
+
+Ingest records each device's last-seen time and next deadline in memory. The
+timer heap holds one entry per online device: a fix only moves the deadline,
+and an entry that comes up early is pushed again with the current one, so the
+heap never grows past the number of devices. A daemon thread pops expired
+deadlines and marks those devices offline. Nothing scans GPSData. The DeviceLiveness table keeps
+the state across restarts and is written only on transitions and at most every
+PERSIST_SECONDS per device. Transitions use conditional UPDATEs on that table,
+so when several workers run a monitor only one of them raises the alert.
+
+The monitor starts with the server process (wsgi.py, asgi.py), the telemetry
+listener or the first fix. Starting only spawns the thread; it reads the state
+table in the background, retrying while the table does not exist yet (an app
+imported before `migrate`), and resumes the deadlines of devices that were
+online, so a device that stays silent across a restart still goes offline. `check_offline` does
+the same from the state table alone, for cron (manage.py check_device_liveness).
+"""
+import heapq
+import itertools
+import logging
+import threading
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import DatabaseError, close_old_connections
+from django.utils import timezone
+
+from .alerting import alert_policy
+from .cache import response_cache
+from .counters import resolve_alerts
+from .devices import resolve_device
+from .models import Alert, DeviceLiveness, GPSData
+from .sharding import db_for_owner
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    "OFFLINE_AFTER_SECONDS": 900,
+    "PERSIST_SECONDS": 60,
+    "WARM_RETRY_SECONDS": 60,
+}
+
+
+def liveness_setting(name):
+    return getattr(settings, "TRACKING_LIVENESS", {}).get(name, DEFAULTS[name])
+
+
+class _DeviceState:
+    __slots__ = ("owner_id", "last_seen", "last_fix_id", "online", "seq", "deadline", "queued", "persisted_at")
+
+    def __init__(self, owner_id, last_seen, last_fix_id, online, persisted_at):
+        self.owner_id = owner_id
+        self.last_seen = last_seen
+        self.last_fix_id = last_fix_id
+        self.online = online
+        self.seq = 0
+        self.deadline = None
+        # Whether the device has its entry on the heap
+        self.queued = False
+        self.persisted_at = persisted_at
+
+
+class LivenessMonitor:
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._heap = []
+        self._devices = {}
+        self._seq = itertools.count(1)
+        self._thread = None
+
+    def start(self):
+        """Start the timer thread, once per process; it warms from the state table itself"""
+        with self._cond:
+            self._start()
+
+    def _start(self):
+        """Start the timer thread (caller holds the lock); no queries, so importing the app stays safe"""
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._run, name="device-liveness", daemon=True)
+        self._thread.start()
+
+    def _warm(self, device_ids=None):
+        """Resume the devices of the state table that this process has not seen yet"""
+        timeout = liveness_setting("OFFLINE_AFTER_SECONDS")
+        rows = DeviceLiveness.objects
+        if device_ids is not None:
+            rows = rows.filter(device_id__in=device_ids)
+        rows = list(rows.values_list("device_id", "owner_id", "last_seen", "last_fix_id", "is_online"))
+        with self._cond:
+            for device_id, owner_id, last_seen, last_fix_id, online in rows:
+                if device_id in self._devices:
+                    continue
+                state = self._devices[device_id] = _DeviceState(owner_id, last_seen, last_fix_id, online, last_seen)
+                if online:
+                    self._schedule(device_id, state, last_seen.timestamp() + timeout)
+            self._cond.notify()
+
+    def _warm_when_ready(self):
+        while True:
+            try:
+                self._warm()
+                return
+            except DatabaseError:
+                logger.warning("Device liveness table is not readable yet (migrations pending?); retrying")
+                time.sleep(liveness_setting("WARM_RETRY_SECONDS"))
+
+    def _schedule(self, device_id, state, deadline):
+        """Move a device's deadline; it gets a heap entry only when it has none"""
+        state.deadline = deadline
+        if not state.queued:
+            state.queued = True
+            state.seq = next(self._seq)
+            heapq.heappush(self._heap, (deadline, state.seq, device_id))
+
+    def touch(self, gps, owner_id):
+        """Record a fix from a device; brings it back online if it was offline"""
+        now = timezone.now()
+        timeout = liveness_setting("OFFLINE_AFTER_SECONDS")
+        with self._cond:
+            self._start()
+            state = self._devices.get(gps.device_id)
+            is_new = state is None
+            was_offline = state is not None and not state.online
+            if is_new:
+                state = self._devices[gps.device_id] = _DeviceState(owner_id, now, gps.pk, True, now)
+            state.owner_id = owner_id
+            state.last_seen = now
+            state.last_fix_id = gps.pk
+            state.online = True
+            self._schedule(gps.device_id, state, now.timestamp() + timeout)
+            persist = is_new or now - state.persisted_at >= timedelta(seconds=liveness_setting("PERSIST_SECONDS"))
+            if persist:
+                state.persisted_at = now
+            self._cond.notify()
+
+        if is_new:
+            DeviceLiveness.objects.update_or_create(
+                device_id=gps.device_id,
+                defaults={"owner_id": owner_id, "last_seen": now, "last_fix_id": gps.pk, "is_online": True, "changed_at": now},
+            )
+        elif was_offline:
+            self._went_online(gps.device_id, owner_id, now, gps.pk)
+        elif persist:
+            DeviceLiveness.objects.filter(device_id=gps.device_id).update(
+                owner_id=owner_id, last_seen=now, last_fix_id=gps.pk, is_online=True
+            )
+
+    def reload(self, device_ids):
+        """Replace this process's state of some devices with what the state table says"""
+        with self._cond:
+            for device_id in device_ids:
+                # Their heap entries are skipped once the state is gone
+                self._devices.pop(device_id, None)
+        self._warm(device_ids)
+
+    def clear(self):
+        """Forget every device; the timer thread keeps running"""
+        with self._cond:
+            self._devices.clear()
+            self._heap.clear()
+
+    def _went_online(self, device_id, owner_id, now, fix_id):
+        flipped = DeviceLiveness.objects.filter(device_id=device_id, is_online=False).update(
+            owner_id=owner_id, last_seen=now, last_fix_id=fix_id, is_online=True, changed_at=now
+        )
+        if not flipped:
+            DeviceLiveness.objects.filter(device_id=device_id).update(last_seen=now, last_fix_id=fix_id)
+            return
+        resolve_alerts(
+            Alert.objects.using(db_for_owner(owner_id)).filter(gps_data__device_id=device_id, alert_type="offline")
+        )
+        alert_policy.forget_devices([device_id], alert_type="offline")
+        response_cache.bump(owner_id)
+
+    def _went_offline(self, device_id, state):
+        timeout = timedelta(seconds=liveness_setting("OFFLINE_AFTER_SECONDS"))
+        now = timezone.now()
+        # Another worker may have seen a newer fix; only flip rows that are really stale
+        flipped = DeviceLiveness.objects.filter(
+            device_id=device_id, is_online=True, last_seen__lte=now - timeout
+        ).update(is_online=False, changed_at=now)
+        if not flipped or state.last_fix_id is None:
+            return bool(flipped)
+        gps = GPSData.objects.using(db_for_owner(state.owner_id)).filter(pk=state.last_fix_id).first()
+        if gps is None:
+            return True
+        _, asset, _ = resolve_device(device_id)
+        name = getattr(asset, "name", None) or getattr(asset, "full_name", None) or device_id
+        minutes = int(timeout.total_seconds() // 60)
+        alert_policy.raise_alert(gps, "offline", f"{name} has not reported for {minutes} minutes")
+        return True
+
+    def check_offline(self):
+        """Mark every device offline whose stored last-seen time is past the timeout; returns how many"""
+        cutoff = timezone.now() - timedelta(seconds=liveness_setting("OFFLINE_AFTER_SECONDS"))
+        rows = DeviceLiveness.objects.filter(is_online=True, last_seen__lte=cutoff).values_list(
+            "device_id", "owner_id", "last_seen", "last_fix_id"
+        )
+        count = 0
+        for device_id, owner_id, last_seen, last_fix_id in rows:
+            with self._cond:
+                state = self._devices.get(device_id)
+                if state is not None and state.online and state.last_seen > cutoff:
+                    # Seen by this process since the row was last persisted
+                    continue
+                if state is not None:
+                    state.online = False
+            try:
+                count += self._went_offline(
+                    device_id, _DeviceState(owner_id, last_seen, last_fix_id, True, last_seen)
+                )
+            except Exception:
+                logger.exception("Liveness transition failed for %s", device_id)
+        return count
+
+    def _expired(self, now):
+        """Pop the entries due by `now` (caller holds the lock); returns the devices that went silent"""
+        expired = []
+        while self._heap and self._heap[0][0] <= now:
+            _, seq, device_id = heapq.heappop(self._heap)
+            state = self._devices.get(device_id)
+            if state is None or state.seq != seq:
+                continue
+            state.queued = False
+            if not state.online:
+                continue
+            if state.deadline > now:
+                # Fixes came in since the entry was pushed
+                self._schedule(device_id, state, state.deadline)
+                continue
+            state.online = False
+            expired.append((device_id, state))
+        return expired
+
+    def _run(self):
+        self._warm_when_ready()
+        close_old_connections()
+        while True:
+            with self._cond:
+                now = time.time()
+                expired = self._expired(now)
+                if not expired:
+                    wait = self._heap[0][0] - now if self._heap else 60
+                    self._cond.wait(timeout=min(max(wait, 0.05), 60))
+                    continue
+            for device_id, state in expired:
+                try:
+                    self._went_offline(device_id, state)
+                except Exception:
+                    logger.exception("Liveness transition failed for %s", device_id)
+            close_old_connections()
+
+
+liveness_monitor = LivenessMonitor()
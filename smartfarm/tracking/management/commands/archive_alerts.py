@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+
+from tracking.alert_archive import archive_resolved_alerts, archive_setting
+
+
+class Command(BaseCommand):
+    help = "Move resolved alerts older than N days from Alert to AlertArchive in batches"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--days", type=int, default=archive_setting("AFTER_DAYS"), help="Archive alerts older than this")
+        parser.add_argument("--batch-size", type=int, default=archive_setting("BATCH_SIZE"))
+        parser.add_argument("--max-batches", type=int, help="Stop after this many batches (default: until done)")
+        parser.add_argument("--dry-run", action="store_true", help="Only count the alerts that would move")
+
+    def handle(self, *args, **options):
+        moved = archive_resolved_alerts(
+            after_days=options["days"],
+            batch_size=options["batch_size"],
+            max_batches=options["max_batches"],
+            dry_run=options["dry_run"],
+            log=self.stdout.write,
+        )
+        verb = "Would archive" if options["dry_run"] else "Archived"
+        self.stdout.write(self.style.SUCCESS(f"{verb} {moved} resolved alerts"))
@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from tracking import dwell
+from tracking.models import Device
+
+
+class Command(BaseCommand):
+    help = "Extend (or rebuild) the geofence inside/outside intervals behind the dwell and attendance reports"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--owner", type=int, action="append", help="Owner id (repeatable; default: all owners)")
+        parser.add_argument("--rebuild", action="store_true", help="Discard stored intervals and sweep all history")
+
+    def handle(self, *args, **options):
+        if dwell.np is None:
+            raise CommandError("numpy is required to build geofence intervals")
+
+        owners = options["owner"] or sorted(set(Device.objects.values_list("owner_id", flat=True)))
+        for owner_id in owners:
+            summary = dwell.refresh_intervals(owner_id, rebuild=options["rebuild"], log=self.stdout.write)
+            self.stdout.write(f"Owner {owner_id}: {summary['fixes']} fixes, {summary['intervals_closed']} intervals closed")
+        self.stdout.write(self.style.SUCCESS("Geofence intervals up to date"))
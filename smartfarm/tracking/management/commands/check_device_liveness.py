@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from tracking.liveness import liveness_monitor
+
+
+class Command(BaseCommand):
+    help = "Mark devices offline that have not reported within OFFLINE_AFTER_SECONDS and raise their alerts"
+
+    def handle(self, *args, **options):
+        count = liveness_monitor.check_offline()
+        self.stdout.write(self.style.SUCCESS(f"Marked {count} devices offline"))
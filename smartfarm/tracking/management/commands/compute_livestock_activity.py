@@ -0,0 +1,36 @@
+import time
+from datetime import date, timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from tracking.behaviour import compute_activity_day
+
+
+class Command(BaseCommand):
+    help = "Classify livestock telemetry into daily resting/grazing/walking summaries"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--date", help="Last day to compute, YYYY-MM-DD (default: yesterday)")
+        parser.add_argument("--days", type=int, default=1, help="Number of days ending at --date")
+        parser.add_argument("--owner", type=int, help="Only this owner's animals")
+
+    def handle(self, *args, **options):
+        try:
+            last = date.fromisoformat(options["date"]) if options["date"] else timezone.localdate() - timedelta(days=1)
+        except ValueError:
+            raise CommandError("--date must be YYYY-MM-DD")
+
+        # Oldest first, so each day's baseline includes the days computed before it
+        for offset in range(options["days"] - 1, -1, -1):
+            day = last - timedelta(days=offset)
+            started = time.monotonic()
+            try:
+                rows = compute_activity_day(day, owner_id=options["owner"])
+            except RuntimeError as exc:
+                raise CommandError(str(exc))
+            anomalies = sum(1 for r in rows if r.is_anomaly)
+            self.stdout.write(
+                f"{day}: {len(rows)} animals, {anomalies} anomalies in {time.monotonic() - started:.2f}s"
+            )
+        self.stdout.write(self.style.SUCCESS("Livestock activity up to date"))
@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand
+
+from tracking.dedupe import dedupe_gps_history
+from tracking.models import Alert, GPSData
+from tracking.sharding import database_scope, databases
+
+
+class Command(BaseCommand):
+    help = "Remove duplicate (device_id, timestamp) GPSData rows in chunks, keeping the oldest row"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--chunk-size", type=int, default=200, help="Duplicate groups per transaction")
+        parser.add_argument("--dry-run", action="store_true", help="Only count what would be removed")
+
+    def handle(self, *args, **options):
+        removed = 0
+        for db in databases():
+            with database_scope(db):
+                removed += dedupe_gps_history(
+                    GPSData, Alert,
+                    chunk_size=options["chunk_size"],
+                    dry_run=options["dry_run"],
+                    log=self.stdout.write,
+                )
+        verb = "Would remove" if options["dry_run"] else "Removed"
+        self.stdout.write(self.style.SUCCESS(f"{verb} {removed} duplicate rows"))
@@ -0,0 +1,33 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from tracking import cold_archive
+
+
+class Command(BaseCommand):
+    help = "Pack closed days of telemetry per device into memory-mapped column files (the cold archive)"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--days", type=int, default=cold_archive.cold_setting("AFTER_DAYS"),
+            help="Pack days that ended more than this many days ago",
+        )
+        parser.add_argument("--device", action="append", help="Device id (repeatable; default: all devices)")
+        parser.add_argument(
+            "--delete", action="store_true",
+            help="Delete packed fixes from GPSData (fixes that alerts point to are kept)",
+        )
+
+    def handle(self, *args, **options):
+        if cold_archive.np is None:
+            raise CommandError("numpy is required for the cold archive")
+
+        totals = cold_archive.pack_closed_days(
+            device_ids=options["device"],
+            after_days=options["days"],
+            delete=options["delete"],
+            log=self.stdout.write,
+        )
+        self.stdout.write(self.style.SUCCESS(
+            f"{totals['devices']} devices: {totals['packed']} fixes packed, "
+            f"{totals['late']} late fixes folded in, {totals['deleted']} rows deleted"
+        ))
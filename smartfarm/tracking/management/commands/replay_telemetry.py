@@ -0,0 +1,100 @@
+from datetime import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from tracking import replay
+from tracking.models import Device
+
+
+def _day(value, option):
+    try:
+        return timezone.make_aware(datetime.strptime(value, "%Y-%m-%d"))
+    except ValueError:
+        raise CommandError(f"{option} must be YYYY-MM-DD")
+
+
+class Command(BaseCommand):
+    help = "Replay recorded telemetry through the ingest path and compare the outcome with the recording"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--file", help="Replay this JSON-lines/CSV file instead of the database")
+        parser.add_argument("--export", help="Write the selected fixes to this file and stop")
+        parser.add_argument("--device", action="append", help="Device id to replay (repeatable; default: all)")
+        parser.add_argument("--owner", type=int, help="Only this owner's devices")
+        parser.add_argument("--since", help="Only fixes from this date (YYYY-MM-DD) on")
+        parser.add_argument("--until", help="Only fixes before this date (YYYY-MM-DD)")
+        parser.add_argument("--limit", type=int, help="At most this many fixes, oldest first")
+        parser.add_argument("--speed", type=float, default=1.0, help="Time multiplier; 0 sends at full speed")
+        parser.add_argument("--workers", type=int, default=4, help="Sending threads; devices are split across them")
+        parser.add_argument("--batch-size", type=int, default=1, help="Fixes per ingest call (1 behaves like HTTP posts)")
+        parser.add_argument("--keep", action="store_true", help="Keep the replayed fixes and alerts")
+        parser.add_argument("--fail-on-diff", action="store_true", help="Exit with an error if flags or alerts differ")
+
+    def handle(self, *args, **options):
+        if options["speed"] < 0:
+            raise CommandError("--speed must be 0 or more")
+
+        if options["file"]:
+            try:
+                recorded = replay.load_file(options["file"])
+            except (OSError, ValueError) as exc:
+                raise CommandError(str(exc))
+            if options["device"]:
+                recorded = [r for r in recorded if r.row["device_id"] in options["device"]]
+        else:
+            device_ids = options["device"]
+            if options["owner"]:
+                device_ids = list(Device.objects.filter(owner_id=options["owner"]).values_list("device_id", flat=True))
+            recorded = replay.load_recorded(
+                device_ids=device_ids,
+                since=_day(options["since"], "--since") if options["since"] else None,
+                until=_day(options["until"], "--until") if options["until"] else None,
+                limit=options["limit"],
+            )
+        if not recorded:
+            raise CommandError("No recorded fixes selected")
+
+        if options["export"]:
+            replay.export(recorded, options["export"])
+            self.stdout.write(self.style.SUCCESS(f"Exported {len(recorded)} fixes to {options['export']}"))
+            return
+
+        run = replay.Replay(
+            recorded,
+            speed=options["speed"],
+            workers=options["workers"],
+            batch_size=options["batch_size"],
+        )
+        span = recorded[-1].row["timestamp"] - recorded[0].row["timestamp"]
+        pace = f"{options['speed']:g}x" if options["speed"] else "full speed"
+        self.stdout.write(f"Replaying {len(recorded)} fixes spanning {span} at {pace}")
+        try:
+            report = run.run()
+            diff = run.diff()
+        finally:
+            if not options["keep"]:
+                removed = run.cleanup()
+                self.stdout.write(f"Removed {removed} replayed fixes")
+
+        self.stdout.write(
+            f"Sent {report['fixes']} fixes in {report['elapsed_s']}s ({report['fixes_per_s']} fixes/s): "
+            f"{report['stored']} stored, {report['duplicates']} duplicates, {report['failed']} failed"
+        )
+        self.stdout.write(f"Ingest latency ms: {report['latency_ms']}; schedule lag ms: {report['lag_ms']}")
+        for error, count in report["errors"].items():
+            self.stdout.write(self.style.WARNING(f"  {count} batches failed: {error}"))
+        self.stdout.write(
+            f"Compared {diff['compared']} fixes: {diff['inside_mismatches']} inside_geofence mismatches; "
+            f"alerts recorded {dict(diff['recorded_alerts'])}, replayed {dict(diff['replayed_alerts'])}, "
+            f"missing {dict(diff['missing_alerts'])}, extra {dict(diff['extra_alerts'])}"
+        )
+        for example in diff["examples"]:
+            self.stdout.write(f"  {example}")
+
+        differs = diff["inside_mismatches"] or diff["missing_alerts"] or diff["extra_alerts"]
+        if differs and options["speed"] != 1:
+            self.stdout.write("Alert cooldowns run on wall-clock time, so alert counts can differ away from 1x")
+        if differs and options["fail_on_diff"]:
+            raise CommandError("Replay differs from the recording")
+        self.stdout.write(self.style.SUCCESS("Replay finished"))
@@ -0,0 +1,35 @@
+import logging
+
+from django.core.management.base import BaseCommand
+
+from tracking.listener import listener_setting, run_listener
+from tracking.liveness import liveness_monitor
+
+
+class Command(BaseCommand):
+    help = "Accept device telemetry over UDP/TCP line protocol, bypassing the HTTP stack"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--host", default=listener_setting("HOST"))
+        parser.add_argument("--udp-port", type=int, default=listener_setting("UDP_PORT"))
+        parser.add_argument("--tcp-port", type=int, default=listener_setting("TCP_PORT"))
+        parser.add_argument("--no-udp", action="store_true")
+        parser.add_argument("--no-tcp", action="store_true")
+        parser.add_argument("--batch-size", type=int, default=listener_setting("BATCH_SIZE"))
+        parser.add_argument("--flush-ms", type=int, default=listener_setting("FLUSH_MS"))
+        parser.add_argument("--report-seconds", type=int, default=30, help="Interval for logging counters")
+
+    def handle(self, *args, **options):
+        logging.basicConfig(level=logging.INFO, format="%(asctime)s %(message)s")
+        udp_port = None if options["no_udp"] else options["udp_port"]
+        tcp_port = None if options["no_tcp"] else options["tcp_port"]
+        self.stdout.write(f"Listening on {options['host']} udp={udp_port} tcp={tcp_port}")
+        liveness_monitor.start()
+
+        stats, elapsed = run_listener(
+            options["host"], udp_port, tcp_port,
+            report_seconds=options["report_seconds"],
+            batch_size=options["batch_size"],
+            flush_ms=options["flush_ms"],
+        )
+        self.stdout.write(self.style.SUCCESS(f"Stopped after {elapsed:.0f}s: {dict(stats)}"))
@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from tracking import sharding
+from tracking.models import Device
+
+
+class Command(BaseCommand):
+    help = "Move telemetry and alerts stored in the default database to their owners' shards"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--owner", type=int, action="append", help="Owner id (repeatable; default: all owners)")
+        parser.add_argument("--batch-size", type=int, default=1000, help="Fixes per batch")
+
+    def handle(self, *args, **options):
+        if not sharding.enabled():
+            raise CommandError("Sharding is off; set TRACKING_SHARDING['SHARDS'] first")
+
+        owners = options["owner"] or sorted(set(Device.objects.values_list("owner_id", flat=True)))
+        for owner_id in owners:
+            device_ids = list(Device.objects.filter(owner_id=owner_id).values_list("device_id", flat=True))
+            try:
+                moved = sharding.move_owner(owner_id, device_ids, batch_size=options["batch_size"], log=self.stdout.write)
+            except RuntimeError as exc:
+                raise CommandError(f"Owner {owner_id}: {exc}")
+            self.stdout.write(
+                f"Owner {owner_id} -> {sharding.db_for_owner(owner_id)}: {moved['fixes']} fixes, "
+                f"{moved['alerts']} alerts, {moved['archived_alerts']} archived alerts"
+            )
+        self.stdout.write(self.style.SUCCESS("Telemetry sharded; restart the server so no worker keeps old alert state"))
@@ -0,0 +1,51 @@
+from datetime import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from tracking import smoothing
+from tracking.models import Device, GPSData
+from tracking.sharding import databases
+
+
+class Command(BaseCommand):
+    help = "Recompute noise-filtered positions and outlier flags of stored telemetry"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--device", action="append", help="Device id to clean (repeatable; default: all)")
+        parser.add_argument("--owner", type=int, help="Only this owner's devices")
+        parser.add_argument("--since", help="Only fixes from this date (YYYY-MM-DD) on")
+        parser.add_argument("--devices-per-batch", type=int, default=200)
+        parser.add_argument("--dry-run", action="store_true", help="Only count outliers")
+
+    def handle(self, *args, **options):
+        if smoothing.np is None:
+            raise CommandError("numpy is required to clean history")
+
+        since = None
+        if options["since"]:
+            try:
+                since = timezone.make_aware(datetime.strptime(options["since"], "%Y-%m-%d"))
+            except ValueError:
+                raise CommandError("--since must be YYYY-MM-DD")
+
+        if options["device"]:
+            device_ids = options["device"]
+        elif options["owner"]:
+            device_ids = Device.objects.filter(owner_id=options["owner"]).values_list("device_id", flat=True)
+        else:
+            device_ids = {
+                device_id
+                for db in databases()
+                for device_id in GPSData.objects.using(db).values_list("device_id", flat=True).distinct()
+            }
+
+        processed, outliers = smoothing.smooth_history(
+            list(device_ids),
+            since=since,
+            devices_per_batch=options["devices_per_batch"],
+            dry_run=options["dry_run"],
+            log=self.stdout.write,
+        )
+        verb = "Would flag" if options["dry_run"] else "Flagged"
+        self.stdout.write(self.style.SUCCESS(f"{verb} {outliers} outliers in {processed} fixes"))
@@ -0,0 +1,33 @@
+# Generated by Django 5.2.18 on 2026-10-19 12:04
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tracking', '0007_add_profile_photo'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='alert',
+            name='last_seen_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='alert',
+            name='occurrence_count',
+            field=models.PositiveIntegerField(default=1),
+        ),
+        migrations.AddField(
+            model_name='ownerprofile',
+            name='alert_cooldown_seconds',
+            field=models.PositiveIntegerField(default=300),
+        ),
+        migrations.AddField(
+            model_name='ownerprofile',
+            name='speed_limit_kmh',
+            field=models.FloatField(default=40.0),
+        ),
+    ]
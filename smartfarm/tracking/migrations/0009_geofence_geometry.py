@@ -0,0 +1,64 @@
+# Generated by Django 5.2.18 on 2026-10-19 12:06
+
+from django.db import migrations, models
+
+from tracking import geometry
+
+
+def backfill_geometry(apps, schema_editor):
+    Geofence2 = apps.get_model('tracking', 'Geofence2')
+    for fence in Geofence2.objects.all():
+        ring = geometry.open_ring(fence.coordinates or [])
+        if len(ring) < 3:
+            continue
+        fence.min_lat, fence.min_lng, fence.max_lat, fence.max_lng = geometry.bounding_box(ring)
+        fence.area_m2 = geometry.polygon_area_m2(ring)
+        fence.vertex_count = len(ring)
+        fence.encoded_polyline = geometry.encode_polyline(ring)
+        fence.save()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tracking', '0008_alert_coalescing_and_thresholds'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='geofence2',
+            name='area_m2',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='geofence2',
+            name='encoded_polyline',
+            field=models.TextField(blank=True),
+        ),
+        migrations.AddField(
+            model_name='geofence2',
+            name='max_lat',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='geofence2',
+            name='max_lng',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='geofence2',
+            name='min_lat',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='geofence2',
+            name='min_lng',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='geofence2',
+            name='vertex_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(backfill_geometry, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,60 @@
+# Generated by Django 5.2.18 on 2026-10-19 12:08
+
+from django.db import migrations, models
+from django.db.models import Count, Min, Q
+
+CHUNK_SIZE = 200
+
+
+def remove_duplicates(apps, schema_editor):
+    """
+    Keep the lowest id of each duplicate (device_id, timestamp) group,
+    re-point its alerts to the kept row and delete the rest.
+
+    A frozen copy of tracking.dedupe.dedupe_gps_history, so later changes to
+    that module cannot change what this migration does. Large histories can be
+    cleaned beforehand with `manage.py dedupe_gps_data`.
+    """
+    GPSData = apps.get_model('tracking', 'GPSData')
+    Alert = apps.get_model('tracking', 'Alert')
+    db = schema_editor.connection.alias
+
+    groups = list(
+        GPSData.objects.using(db).values('device_id', 'timestamp')
+        .annotate(n=Count('id'), keep=Min('id'))
+        .filter(n__gt=1)
+        .order_by()
+        .values_list('device_id', 'timestamp', 'keep')
+    )
+
+    for start in range(0, len(groups), CHUNK_SIZE):
+        chunk = groups[start:start + CHUNK_SIZE]
+        keep = {(device_id, timestamp): pk for device_id, timestamp, pk in chunk}
+        match = Q()
+        for device_id, timestamp, _ in chunk:
+            match |= Q(device_id=device_id, timestamp=timestamp)
+
+        duplicates = {}
+        for pk, device_id, timestamp in GPSData.objects.using(db).filter(match).values_list('id', 'device_id', 'timestamp'):
+            kept = keep[(device_id, timestamp)]
+            if pk != kept:
+                duplicates.setdefault(kept, []).append(pk)
+
+        for kept, ids in duplicates.items():
+            Alert.objects.using(db).filter(gps_data_id__in=ids).update(gps_data_id=kept)
+        GPSData.objects.using(db).filter(id__in=[pk for ids in duplicates.values() for pk in ids]).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tracking', '0009_geofence_geometry'),
+    ]
+
+    operations = [
+        migrations.RunPython(remove_duplicates, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='gpsdata',
+            constraint=models.UniqueConstraint(fields=('device_id', 'timestamp'), name='unique_gpsdata_device_timestamp'),
+        ),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 5.2.18 on 2026-10-19 12:09
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tracking', '0010_unique_gpsdata_device_timestamp'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='alert',
+            name='alert_type',
+            field=models.CharField(choices=[('geofence', 'Geofence Breach'), ('speed', 'Overspeed'), ('offline', 'Device Offline')], max_length=20),
+        ),
+        migrations.CreateModel(
+            name='DeviceLiveness',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('device_id', models.CharField(max_length=100, unique=True)),
+                ('last_seen', models.DateTimeField()),
+                ('is_online', models.BooleanField(default=True)),
+                ('changed_at', models.DateTimeField()),
+                ('last_fix', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='tracking.gpsdata')),
+                ('owner', models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, related_name='device_liveness', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['owner', 'is_online'], name='tracking_de_owner_i_8115ff_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,40 @@
+# Generated by Django 5.2.18 on 2026-10-19 12:14
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tracking', '0011_device_liveness'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LivestockActivityDay',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('fixes', models.PositiveIntegerField(default=0)),
+                ('observed_minutes', models.FloatField(default=0.0)),
+                ('resting_minutes', models.FloatField(default=0.0)),
+                ('grazing_minutes', models.FloatField(default=0.0)),
+                ('walking_minutes', models.FloatField(default=0.0)),
+                ('distance_m', models.FloatField(default=0.0)),
+                ('activity_index', models.FloatField(blank=True, null=True)),
+                ('baseline_index', models.FloatField(blank=True, null=True)),
+                ('is_anomaly', models.BooleanField(default=False)),
+                ('anomaly_reason', models.CharField(blank=True, max_length=100)),
+                ('computed_at', models.DateTimeField(auto_now=True)),
+                ('livestock', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='activity_days', to='tracking.livestock')),
+                ('owner', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='livestock_activity', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['owner', 'date'], name='tracking_li_owner_i_0ec218_idx')],
+                'constraints': [models.UniqueConstraint(fields=('livestock', 'date'), name='unique_livestock_activity_day')],
+            },
+        ),
+    ]
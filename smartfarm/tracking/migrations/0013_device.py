@@ -0,0 +1,51 @@
+# Generated by Django 5.2.18 on 2026-10-19 12:16
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+def backfill_devices(apps, schema_editor):
+    # Same precedence the old per-table resolution used: equipment, employee, livestock
+    Device = apps.get_model('tracking', 'Device')
+    sources = [
+        ('equipment', apps.get_model('tracking', 'Equipment'), 'device_id'),
+        ('employee', apps.get_model('tracking', 'Employee'), 'tracker_device_id'),
+        ('livestock', apps.get_model('tracking', 'Livestock'), 'device_id'),
+    ]
+    taken = set()
+    devices = []
+    for kind, model, field in sources:
+        for asset in model.objects.order_by('pk'):
+            device_id = getattr(asset, field)
+            key = (device_id or '').strip().upper()
+            if not key or key in taken:
+                continue
+            taken.add(key)
+            devices.append(Device(key=key, device_id=device_id, kind=kind, owner_id=asset.owner_id, **{kind: asset}))
+    Device.objects.bulk_create(devices, batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tracking', '0012_livestock_activity_day'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Device',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.CharField(max_length=100, unique=True)),
+                ('device_id', models.CharField(max_length=100)),
+                ('kind', models.CharField(choices=[('equipment', 'Equipment'), ('employee', 'Employee'), ('livestock', 'Livestock')], max_length=20)),
+                ('employee', models.OneToOneField(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='device', to='tracking.employee')),
+                ('equipment', models.OneToOneField(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='device', to='tracking.equipment')),
+                ('livestock', models.OneToOneField(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='device', to='tracking.livestock')),
+                ('owner', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='devices', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.RunPython(backfill_devices, migrations.RunPython.noop),
+    ]
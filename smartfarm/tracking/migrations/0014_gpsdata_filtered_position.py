@@ -0,0 +1,28 @@
+# Generated by Django 5.2.18 on 2026-10-19 12:19
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tracking', '0013_device'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='gpsdata',
+            name='filtered_latitude',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='gpsdata',
+            name='filtered_longitude',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='gpsdata',
+            name='is_outlier',
+            field=models.BooleanField(default=False),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.2.18 on 2026-10-19 12:22
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tracking', '0014_gpsdata_filtered_position'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='gpsdata',
+            name='boundary_distance_m',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='ownerprofile',
+            name='boundary_warning_m',
+            field=models.FloatField(default=20.0),
+        ),
+        migrations.AlterField(
+            model_name='alert',
+            name='alert_type',
+            field=models.CharField(choices=[('geofence', 'Geofence Breach'), ('speed', 'Overspeed'), ('offline', 'Device Offline'), ('boundary', 'Approaching Boundary')], max_length=20),
+        ),
+    ]
@@ -0,0 +1,64 @@
+# Generated by Django 5.2.18 on 2026-10-19 12:33
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def backfill_owners(apps, schema_editor):
+    # Alerts belong to whoever owns the device now; counters start from the open ones
+    Alert = apps.get_model('tracking', 'Alert')
+    AlertCounters = apps.get_model('tracking', 'AlertCounters')
+    Device = apps.get_model('tracking', 'Device')
+    devices = {}
+    for device_id, owner_id in Device.objects.values_list('device_id', 'owner_id'):
+        devices.setdefault(owner_id, []).append(device_id)
+    for owner_id, device_ids in devices.items():
+        for start in range(0, len(device_ids), 500):
+            Alert.objects.filter(gps_data__device_id__in=device_ids[start:start + 500]).update(owner_id=owner_id)
+
+    counts = {}
+    rows = (
+        Alert.objects.filter(owner__isnull=False, is_resolved=False)
+        .values_list('owner_id', 'alert_type').annotate(n=Count('id')).order_by()
+    )
+    for owner_id, alert_type, n in rows:
+        counts.setdefault(owner_id, {})['open_' + alert_type] = n
+    AlertCounters.objects.bulk_create(
+        [AlertCounters(owner_id=owner_id, **fields) for owner_id, fields in counts.items()],
+        batch_size=500,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auth', '0012_alter_user_first_name_max_length'),
+        ('tracking', '0015_boundary_distance'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AlertCounters',
+            fields=[
+                ('owner', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='alert_counters', serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('open_geofence', models.IntegerField(default=0)),
+                ('open_speed', models.IntegerField(default=0)),
+                ('open_offline', models.IntegerField(default=0)),
+                ('open_boundary', models.IntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='alert',
+            name='owner',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='alerts', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddIndex(
+            model_name='alert',
+            index=models.Index(fields=['owner', 'is_resolved', 'created_at', 'id'], name='tracking_al_owner_i_b16a3b_idx'),
+        ),
+        migrations.RunPython(backfill_owners, migrations.RunPython.noop),
+    ]
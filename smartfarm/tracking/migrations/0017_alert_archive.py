@@ -0,0 +1,37 @@
+# Generated by Django 5.2.18 on 2026-10-19 12:37
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tracking', '0016_alert_owner_counters'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AlertArchive',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('alert_id', models.BigIntegerField(unique=True)),
+                ('alert_type', models.CharField(choices=[('geofence', 'Geofence Breach'), ('speed', 'Overspeed'), ('offline', 'Device Offline'), ('boundary', 'Approaching Boundary')], max_length=20)),
+                ('message', models.TextField()),
+                ('created_at', models.DateTimeField()),
+                ('occurrence_count', models.PositiveIntegerField(default=1)),
+                ('last_seen_at', models.DateTimeField(blank=True, null=True)),
+                ('device_id', models.CharField(max_length=100)),
+                ('fix_timestamp', models.DateTimeField()),
+                ('latitude', models.FloatField()),
+                ('longitude', models.FloatField()),
+                ('archived_at', models.DateTimeField(auto_now_add=True)),
+                ('owner', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='archived_alerts', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['owner', 'created_at'], name='tracking_al_owner_i_ed0c63_idx')],
+            },
+        ),
+    ]
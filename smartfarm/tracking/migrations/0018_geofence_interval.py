@@ -0,0 +1,35 @@
+# Generated by Django 5.2.18 on 2026-10-19 12:39
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tracking', '0017_alert_archive'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='GeofenceInterval',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('device_id', models.CharField(max_length=100)),
+                ('inside', models.BooleanField()),
+                ('started_at', models.DateTimeField()),
+                ('ended_at', models.DateTimeField()),
+                ('fixes', models.PositiveIntegerField(default=1)),
+                ('end_reason', models.CharField(blank=True, choices=[('', 'Open'), ('change', 'Crossed the boundary'), ('gap', 'Reporting gap')], max_length=10)),
+                ('signature', models.CharField(max_length=16)),
+                ('geofence', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='intervals', to='tracking.geofence2')),
+                ('owner', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='geofence_intervals', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['owner', 'ended_at'], name='tracking_ge_owner_i_7fb35c_idx')],
+                'constraints': [models.UniqueConstraint(fields=('geofence', 'device_id', 'started_at'), name='unique_geofence_interval')],
+            },
+        ),
+    ]
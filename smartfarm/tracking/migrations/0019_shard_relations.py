@@ -0,0 +1,46 @@
+# Generated by Django 5.2.18 on 2026-10-19 12:46
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tracking', '0018_geofence_interval'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='alert',
+            name='owner',
+            field=models.ForeignKey(blank=True, db_constraint=False, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='alerts', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AlterField(
+            model_name='alertarchive',
+            name='owner',
+            field=models.ForeignKey(blank=True, db_constraint=False, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='archived_alerts', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AlterField(
+            model_name='alertcounters',
+            name='owner',
+            field=models.OneToOneField(db_constraint=False, on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='alert_counters', serialize=False, to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AlterField(
+            model_name='deviceliveness',
+            name='last_fix',
+            field=models.ForeignKey(blank=True, db_constraint=False, null=True, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='tracking.gpsdata'),
+        ),
+        migrations.AlterField(
+            model_name='gpsdata',
+            name='employee',
+            field=models.ForeignKey(blank=True, db_constraint=False, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='gps_data', to='tracking.employee'),
+        ),
+        migrations.AlterField(
+            model_name='gpsdata',
+            name='equipment',
+            field=models.ForeignKey(blank=True, db_constraint=False, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='gps_data', to='tracking.equipment'),
+        ),
+    ]
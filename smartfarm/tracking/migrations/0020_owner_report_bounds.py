@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-19 13:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tracking', '0019_shard_relations'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='ownerprofile',
+            name='max_report_seconds',
+            field=models.PositiveIntegerField(default=300),
+        ),
+        migrations.AddField(
+            model_name='ownerprofile',
+            name='min_report_seconds',
+            field=models.PositiveIntegerField(default=2),
+        ),
+    ]
@@ -3,6 +3,8 @@ from django.contrib.auth.models import User
 import json
 from django.core.serializers.json import DjangoJSONEncoder
 
+from . import geometry
+
 
 class OwnerProfile(models.Model):
     """Extra info for system owners (linked to Django User)"""
@@ -10,7 +12,16 @@ class OwnerProfile(models.Model):
     phone_number = models.CharField(max_length=20, blank=True, null=True)
     address = models.TextField(blank=True, null=True)
     profile_photo = models.ImageField(upload_to='profile_photos/', blank=True, null=True)
-    
+
+    # Alert thresholds (tracking.alerting falls back to settings.TRACKING_ALERTS)
+    speed_limit_kmh = models.FloatField(default=40.0)
+    alert_cooldown_seconds = models.PositiveIntegerField(default=300)
+    # Warn when a device inside a fence gets this close to its edge (0 disables)
+    boundary_warning_m = models.FloatField(default=20.0)
+    # Bounds for the report interval recommended to devices (tracking.boundary)
+    min_report_seconds = models.PositiveIntegerField(default=2)
+    max_report_seconds = models.PositiveIntegerField(default=300)
+
     def __str__(self):
         return self.user.username
 
@@ -63,8 +74,10 @@ class Employee(models.Model):
 
 class GPSData(models.Model):
     """Raw telemetry sent from ESP32"""
-    equipment = models.ForeignKey(Equipment, on_delete=models.CASCADE, related_name="gps_data", null=True, blank=True)
-    employee = models.ForeignKey(Employee, on_delete=models.CASCADE, related_name="gps_data", null=True, blank=True)
+    # Telemetry may live in an owner's shard (tracking.sharding), so relations
+    # to rows of the default database carry no database constraint
+    equipment = models.ForeignKey(Equipment, on_delete=models.CASCADE, related_name="gps_data", null=True, blank=True, db_constraint=False)
+    employee = models.ForeignKey(Employee, on_delete=models.CASCADE, related_name="gps_data", null=True, blank=True, db_constraint=False)
 
     device_id = models.CharField(max_length=100)
     timestamp = models.DateTimeField()
@@ -74,6 +87,18 @@ class GPSData(models.Model):
     altitude = models.FloatField()
     created_at = models.DateTimeField(auto_now_add=True)
     inside_geofence = models.BooleanField(null=True, blank=True)
+    # Noise-filtered position (tracking.smoothing); the raw fix above is kept as sent
+    filtered_latitude = models.FloatField(null=True, blank=True)
+    filtered_longitude = models.FloatField(null=True, blank=True)
+    is_outlier = models.BooleanField(default=False)
+    # Signed distance to the nearest active fence edge; positive inside
+    boundary_distance_m = models.FloatField(null=True, blank=True)
+
+    class Meta:
+        constraints = [
+            # Devices retry uploads; the same fix must only be stored once
+            models.UniqueConstraint(fields=["device_id", "timestamp"], name="unique_gpsdata_device_timestamp"),
+        ]
 
     def __str__(self):
         return f"GPS {self.device_id} @ {self.timestamp}"
@@ -83,17 +108,70 @@ class Alert(models.Model):
     ALERT_TYPES = (
         ("geofence", "Geofence Breach"),
         ("speed", "Overspeed"),
+        ("offline", "Device Offline"),
+        ("boundary", "Approaching Boundary"),
     )
     gps_data = models.ForeignKey("GPSData", on_delete=models.CASCADE, related_name="alerts")
+    # Owner of the device when the alert was raised, so lists need no device join
+    owner = models.ForeignKey(User, on_delete=models.CASCADE, related_name="alerts", null=True, blank=True, db_constraint=False)
     alert_type = models.CharField(max_length=20, choices=ALERT_TYPES)
     message = models.TextField()
     is_resolved = models.BooleanField(default=False)
     created_at = models.DateTimeField(auto_now_add=True)
+    # Repeated triggers within the cooldown are coalesced into one alert
+    occurrence_count = models.PositiveIntegerField(default=1)
+    last_seen_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        # Keyset pagination walks (created_at, id) within an owner and state
+        indexes = [models.Index(fields=["owner", "is_resolved", "created_at", "id"])]
 
     def __str__(self):
         return f"{self.alert_type} - {self.message[:30]}"
 
 
+class AlertArchive(models.Model):
+    """
+    Resolved alerts moved out of Alert by tracking.alert_archive. The fix is
+    copied in, so the row stands alone even once the telemetry is gone.
+    """
+    alert_id = models.BigIntegerField(unique=True)
+    owner = models.ForeignKey(User, on_delete=models.CASCADE, related_name="archived_alerts", null=True, blank=True, db_constraint=False)
+    alert_type = models.CharField(max_length=20, choices=Alert.ALERT_TYPES)
+    message = models.TextField()
+    created_at = models.DateTimeField()
+    occurrence_count = models.PositiveIntegerField(default=1)
+    last_seen_at = models.DateTimeField(null=True, blank=True)
+    device_id = models.CharField(max_length=100)
+    fix_timestamp = models.DateTimeField()
+    latitude = models.FloatField()
+    longitude = models.FloatField()
+    archived_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [models.Index(fields=["owner", "created_at"])]
+
+    def __str__(self):
+        return f"{self.alert_type} - {self.message[:30]} (archived)"
+
+
+class AlertCounters(models.Model):
+    """Open alerts per type for one owner, kept in step by tracking.counters"""
+    owner = models.OneToOneField(User, on_delete=models.CASCADE, primary_key=True, related_name="alert_counters", db_constraint=False)
+    open_geofence = models.IntegerField(default=0)
+    open_speed = models.IntegerField(default=0)
+    open_offline = models.IntegerField(default=0)
+    open_boundary = models.IntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def as_dict(self):
+        counts = {alert_type: getattr(self, f"open_{alert_type}") for alert_type, _ in Alert.ALERT_TYPES}
+        return dict(counts, total=sum(counts.values()))
+
+    def __str__(self):
+        return f"{self.owner} open alerts"
+
+
 class Geofence2(models.Model):
     name = models.CharField(max_length=255, blank=True)
     description = models.TextField(blank=True)
@@ -103,17 +181,56 @@ class Geofence2(models.Model):
     is_active = models.BooleanField(default=True)
     owner = models.ForeignKey(User, on_delete=models.CASCADE, null=True)
 
+    # Precomputed on save from `coordinates`
+    min_lat = models.FloatField(null=True, blank=True)
+    min_lng = models.FloatField(null=True, blank=True)
+    max_lat = models.FloatField(null=True, blank=True)
+    max_lng = models.FloatField(null=True, blank=True)
+    area_m2 = models.FloatField(null=True, blank=True)
+    vertex_count = models.PositiveIntegerField(default=0)
+    encoded_polyline = models.TextField(blank=True)
+
     class Meta:
         db_table = 'geofences'
 
     def __str__(self):
         return self.name or f"Geofence {self.id}"
 
+    GEOMETRY_FIELDS = ("min_lat", "min_lng", "max_lat", "max_lng", "area_m2", "vertex_count", "encoded_polyline")
+
+    def save(self, *args, **kwargs):
+        self.update_geometry()
+        if kwargs.get("update_fields") is not None:
+            kwargs["update_fields"] = set(kwargs["update_fields"]) | set(self.GEOMETRY_FIELDS)
+        super().save(*args, **kwargs)
+
+    def update_geometry(self):
+        """Refresh bbox, area, vertex count and the encoded polyline"""
+        self.__dict__.pop("_edge_set", None)
+        self.__dict__.pop("_strip_index", None)
+        ring = geometry.open_ring(self.coordinates or [])
+        if len(ring) < 3:
+            self.min_lat = self.min_lng = self.max_lat = self.max_lng = self.area_m2 = None
+            self.vertex_count = len(ring)
+            self.encoded_polyline = ""
+            return
+        self.min_lat, self.min_lng, self.max_lat, self.max_lng = geometry.bounding_box(ring)
+        self.area_m2 = geometry.polygon_area_m2(ring)
+        self.vertex_count = len(ring)
+        self.encoded_polyline = geometry.encode_polyline(ring)
+
     def contains_point(self, lat, lng):
         """
         Simple point-in-polygon check using ray casting algorithm
         This is a basic implementation and may not handle all edge cases
         """
+        if self.min_lat is not None and not (
+            self.min_lat <= lat <= self.max_lat and self.min_lng <= lng <= self.max_lng
+        ):
+            return False
+        index = self.strip_index()
+        if index is not None:
+            return index.contains(lat, lng)
         try:
             coords = self.coordinates
             if not coords or len(coords) < 3:
@@ -139,6 +256,33 @@ class Geofence2(models.Model):
         except (ValueError, TypeError, IndexError):
             return False
 
+    def geometry_key(self):
+        """Process-wide cache key of this fence version (None before the first save)"""
+        return (self.pk, self.vertex_count, self.area_m2, self.encoded_polyline) if self.pk else None
+
+    def strip_index(self):
+        """geometry.StripIndex of the current coordinates (None for small fences), shared per process"""
+        if "_strip_index" not in self.__dict__:
+            self._strip_index = geometry.strip_index(self.coordinates, self.geometry_key())
+        return self._strip_index
+
+    def contains_many(self, lats, lngs):
+        """Vectorized ray casting (numpy arrays in, bool array out), without the bbox shortcut"""
+        index = self.strip_index()
+        if index is not None:
+            return index.contains_many(lats, lngs)
+        return geometry.contains_many(self.coordinates, lats, lngs)
+
+    def boundary_distance_m(self, lat, lng):
+        """Signed distance to the nearest edge in metres: positive inside, negative outside"""
+        if "_edge_set" not in self.__dict__:
+            # Shared per process like the strip index: ingest loads the fences on every request
+            self._edge_set = geometry.edge_set(self.coordinates, self.geometry_key())
+        if self._edge_set is None:
+            return None
+        distance = self._edge_set.distance_m(lat, lng)
+        return distance if self.contains_point(lat, lng) else -distance
+
 class Livestock(models.Model):
     ANIMAL_TYPES = [
         ('cow', 'Cow'),
@@ -160,4 +304,110 @@ class Livestock(models.Model):
     updated_at = models.DateTimeField(auto_now=True)
     
     def __str__(self):
-        return f"{self.name} ({self.animal_type})"
\ No newline at end of file
+        return f"{self.name} ({self.animal_type})"
+
+
+class DeviceLiveness(models.Model):
+    """Last-seen state per device, maintained by tracking.liveness"""
+    device_id = models.CharField(max_length=100, unique=True)
+    owner = models.ForeignKey(User, on_delete=models.CASCADE, related_name="device_liveness", null=True)
+    last_seen = models.DateTimeField()
+    # The fix may be in a shard; deleting it leaves a dangling id that readers tolerate
+    last_fix = models.ForeignKey(GPSData, on_delete=models.DO_NOTHING, null=True, blank=True, related_name="+", db_constraint=False)
+    is_online = models.BooleanField(default=True)
+    changed_at = models.DateTimeField()
+
+    class Meta:
+        indexes = [models.Index(fields=["owner", "is_online"])]
+
+    def __str__(self):
+        return f"{self.device_id} ({'online' if self.is_online else 'offline'})"
+
+
+class LivestockActivityDay(models.Model):
+    """Daily behaviour summary per animal, precomputed by tracking.behaviour"""
+    livestock = models.ForeignKey(Livestock, on_delete=models.CASCADE, related_name="activity_days")
+    owner = models.ForeignKey(User, on_delete=models.CASCADE, related_name="livestock_activity")
+    date = models.DateField()
+    fixes = models.PositiveIntegerField(default=0)
+    observed_minutes = models.FloatField(default=0.0)
+    resting_minutes = models.FloatField(default=0.0)
+    grazing_minutes = models.FloatField(default=0.0)
+    walking_minutes = models.FloatField(default=0.0)
+    distance_m = models.FloatField(default=0.0)
+    activity_index = models.FloatField(null=True, blank=True)
+    baseline_index = models.FloatField(null=True, blank=True)
+    is_anomaly = models.BooleanField(default=False)
+    anomaly_reason = models.CharField(max_length=100, blank=True)
+    computed_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["livestock", "date"], name="unique_livestock_activity_day"),
+        ]
+        indexes = [models.Index(fields=["owner", "date"])]
+
+    def __str__(self):
+        return f"{self.livestock.name} {self.date}"
+
+
+class GeofenceInterval(models.Model):
+    """
+    A run of consecutive fixes of one device on the same side of one fence,
+    built incrementally by tracking.dwell. The last interval of each
+    (device, fence) is open (end_reason "") and is extended by later fixes.
+    """
+    END_REASONS = [
+        ("", "Open"),
+        ("change", "Crossed the boundary"),
+        ("gap", "Reporting gap"),
+    ]
+
+    owner = models.ForeignKey(User, on_delete=models.CASCADE, related_name="geofence_intervals")
+    geofence = models.ForeignKey(Geofence2, on_delete=models.CASCADE, related_name="intervals")
+    device_id = models.CharField(max_length=100)
+    inside = models.BooleanField()
+    started_at = models.DateTimeField()
+    ended_at = models.DateTimeField()
+    fixes = models.PositiveIntegerField(default=1)
+    end_reason = models.CharField(max_length=10, choices=END_REASONS, blank=True)
+    # Fence geometry the interval was computed against; a mismatch means rebuild
+    signature = models.CharField(max_length=16)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["geofence", "device_id", "started_at"], name="unique_geofence_interval"),
+        ]
+        indexes = [models.Index(fields=["owner", "ended_at"])]
+
+    def __str__(self):
+        return f"{self.device_id} {'in' if self.inside else 'out'} {self.geofence_id} from {self.started_at}"
+
+
+class Device(models.Model):
+    """
+    One row per registered tracker, whichever asset carries it. `key` is the
+    normalized device id (trimmed, upper-cased) so lookups are a single
+    indexed equality match; `device_id` keeps the spelling used on the asset
+    and in GPSData. Maintained by tracking.devices.sync_device.
+    """
+    KINDS = [
+        ("equipment", "Equipment"),
+        ("employee", "Employee"),
+        ("livestock", "Livestock"),
+    ]
+
+    key = models.CharField(max_length=100, unique=True)
+    device_id = models.CharField(max_length=100)
+    kind = models.CharField(max_length=20, choices=KINDS)
+    owner = models.ForeignKey(User, on_delete=models.CASCADE, related_name="devices")
+    equipment = models.OneToOneField(Equipment, on_delete=models.CASCADE, null=True, blank=True, related_name="device")
+    employee = models.OneToOneField(Employee, on_delete=models.CASCADE, null=True, blank=True, related_name="device")
+    livestock = models.OneToOneField(Livestock, on_delete=models.CASCADE, null=True, blank=True, related_name="device")
+
+    @property
+    def asset(self):
+        return getattr(self, self.kind)
+
+    def __str__(self):
+        return f"{self.device_id} ({self.kind})"
@@ -0,0 +1,40 @@
+"""
+Keyset pagination over (created_at, id), newest first.
+
+A cursor is the position of the last row of a page, so fetching the next page
+is an index range scan from that point whatever the page number, and rows
+added meanwhile never shift a page. Cursors are opaque url-safe strings.
+"""
+import base64
+
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+
+
+def encode_cursor(created_at, pk):
+    return base64.urlsafe_b64encode(f"{created_at.isoformat()}|{pk}".encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor):
+    """(created_at, id) of a cursor; raises ValueError if it is not one"""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+        created, pk = raw.split("|")
+        created_at = parse_datetime(created)
+        pk = int(pk)
+    except (ValueError, UnicodeDecodeError):
+        raise ValueError("bad cursor")
+    if created_at is None:
+        raise ValueError("bad cursor")
+    return created_at, pk
+
+
+def keyset_page(qs, cursor=None, limit=100):
+    """One page of `qs` newest first, and the cursor of the next page (None at the end)"""
+    qs = qs.order_by("-created_at", "-id")
+    if cursor:
+        created_at, pk = decode_cursor(cursor)
+        qs = qs.filter(Q(created_at__lt=created_at) | Q(created_at=created_at, id__lt=pk))
+    rows = list(qs[:limit + 1])
+    next_cursor = encode_cursor(rows[limit - 1].created_at, rows[limit - 1].pk) if len(rows) > limit else None
+    return rows[:limit], next_cursor
@@ -0,0 +1,21 @@
+import time
+
+
+class TokenBucket:
+    """Classic token bucket: `capacity` burst, refilled at `rate` tokens per second"""
+    __slots__ = ("capacity", "rate", "tokens", "updated")
+
+    def __init__(self, capacity, rate):
+        self.capacity = float(capacity)
+        self.rate = float(rate)
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+
+    def consume(self, amount=1.0):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= amount:
+            self.tokens -= amount
+            return True
+        return False
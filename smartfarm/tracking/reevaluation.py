@@ -0,0 +1,152 @@
+"""
+Background re-evaluation of geofence state after a fence changes.
+
+Editing, toggling or deleting a fence makes stored `GPSData.inside_geofence`
+flags and open geofence alerts stale. Jobs run on a small thread pool once the
+triggering transaction commits, so the API call returns immediately. Repeated
+edits for the same owner collapse into one queued job.
+"""
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.db.models import OuterRef, Subquery
+from django.utils import timezone
+
+from .alerting import alert_policy
+from .boundary import evaluate_position
+from .cache import response_cache
+from .clustering import position_index
+from .counters import resolve_alerts
+from .devices import owner_device_ids
+from .models import Alert, Geofence2, GPSData
+from .sharding import owner_scope
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    "WORKERS": 2,
+    "BATCH_SIZE": 200,
+    "HISTORY_HOURS": 0,
+}
+
+
+FIELDS = (
+    "id", "device_id", "latitude", "longitude", "filtered_latitude", "filtered_longitude",
+    "inside_geofence", "boundary_distance_m",
+)
+
+
+def reevaluation_setting(name):
+    return getattr(settings, "TRACKING_GEOFENCE_REEVALUATION", {}).get(name, DEFAULTS[name])
+
+
+_executor = None
+_queued = set()
+_lock = threading.Lock()
+
+
+def _get_executor():
+    global _executor
+    with _lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=reevaluation_setting("WORKERS"),
+                thread_name_prefix="geofence-reevaluation",
+            )
+        return _executor
+
+
+def enqueue_geofence_reevaluation(owner_id):
+    """Schedule a re-evaluation for an owner after the current transaction commits"""
+    # Marked queued only at commit, so a rolled-back edit leaves no mark behind
+    transaction.on_commit(lambda: _submit(owner_id))
+
+
+def _submit(owner_id):
+    with _lock:
+        if owner_id in _queued:
+            return
+        _queued.add(owner_id)
+    _get_executor().submit(_run, owner_id)
+
+
+def _run(owner_id):
+    with _lock:
+        _queued.discard(owner_id)
+    close_old_connections()
+    try:
+        reevaluate_owner(owner_id)
+    except Exception:
+        logger.exception("Geofence re-evaluation failed for owner %s", owner_id)
+    finally:
+        close_old_connections()
+
+
+def reevaluate_owner(owner_id, history_hours=None):
+    """
+    Recompute the latest geofence state of every device an owner has, in
+    batches, resolving geofence alerts for devices now inside a fence. With
+    `history_hours` (default from settings) the flags of older fixes in that
+    window are rewritten too. Returns counts of what changed.
+    """
+    if history_hours is None:
+        history_hours = reevaluation_setting("HISTORY_HOURS")
+    batch_size = reevaluation_setting("BATCH_SIZE")
+    geofences = list(Geofence2.objects.filter(owner_id=owner_id, is_active=True))
+    device_ids = owner_device_ids(owner_id)
+
+    def evaluate(fix):
+        lat = fix.latitude if fix.filtered_latitude is None else fix.filtered_latitude
+        lng = fix.longitude if fix.filtered_longitude is None else fix.filtered_longitude
+        return evaluate_position(geofences, lat, lng)
+
+    # The owner's telemetry and alerts are all in one database
+    with owner_scope(owner_id):
+        summary = {"devices": len(device_ids), "latest_updated": 0, "history_updated": 0, "alerts_resolved": 0}
+        latest_pk = GPSData.objects.filter(device_id=OuterRef("device_id")).order_by("-timestamp").values("pk")[:1]
+
+        for start in range(0, len(device_ids), batch_size):
+            batch = device_ids[start:start + batch_size]
+            latest = list(GPSData.objects.filter(device_id__in=batch, pk=Subquery(latest_pk)).only(*FIELDS))
+
+            # Every latest fix gets a fresh boundary distance; device_config reads it
+            now_inside = []
+            for fix in latest:
+                inside, fix.boundary_distance_m = evaluate(fix)
+                if inside:
+                    now_inside.append(fix.device_id)
+                if fix.inside_geofence != inside:
+                    fix.inside_geofence = inside
+                    summary["latest_updated"] += 1
+            GPSData.objects.bulk_update(latest, ["inside_geofence", "boundary_distance_m"])
+
+            if now_inside:
+                summary["alerts_resolved"] += resolve_alerts(Alert.objects.filter(
+                    alert_type="geofence",
+                    gps_data__device_id__in=now_inside,
+                ))
+                alert_policy.forget_devices(now_inside, alert_type="geofence")
+
+            if history_hours:
+                since = timezone.now() - timedelta(hours=history_hours)
+                history = GPSData.objects.filter(device_id__in=batch, timestamp__gte=since).only(*FIELDS)
+                changed = []
+                for fix in history.iterator(chunk_size=batch_size * 10):
+                    inside, fix.boundary_distance_m = evaluate(fix)
+                    if fix.inside_geofence != inside:
+                        fix.inside_geofence = inside
+                        changed.append(fix)
+                    if len(changed) >= batch_size * 10:
+                        GPSData.objects.bulk_update(changed, ["inside_geofence", "boundary_distance_m"])
+                        summary["history_updated"] += len(changed)
+                        changed = []
+                GPSData.objects.bulk_update(changed, ["inside_geofence", "boundary_distance_m"])
+                summary["history_updated"] += len(changed)
+
+    response_cache.bump(owner_id)
+    position_index.forget_owner(owner_id)
+    return summary
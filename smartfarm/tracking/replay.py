@@ -0,0 +1,385 @@
+"""
+Deterministic replay of recorded telemetry through the ingest path.
+
+Recorded fixes come from GPSData and the cold archive, or from a JSON-lines
+export of them. Every
+timestamp is shifted by one constant offset, so the replayed fixes are new rows
+that keep their spacing, and are sent through `ingest_fixes` in real time, N
+times faster or as fast as possible. Devices are split across a thread pool; each
+worker sends its devices' fixes in time order, as a device would.
+
+Afterwards the replayed fixes are compared with the recorded ones: the
+`inside_geofence` flag of every fix, and the ingest alert types (geofence,
+boundary, speed) raised on it; alerts of fixes found only in the archive are
+not known, so only their flag is compared. Cooldowns run on wall-clock time, so at speeds
+other than 1x coalescing, and with it the alert counts, can legitimately
+differ. By default the replayed rows and their alerts are deleted at the end,
+the devices' liveness rows are put back as they were and their in-memory
+ingest state (positions, motion, smoothing, open alerts) is dropped.
+Run it against a copy of the database. Live dashboards of the owners will
+show the replayed positions while it runs.
+"""
+import json
+import threading
+import time
+from collections import Counter, defaultdict, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.db import DatabaseError, connections
+from django.db.models import Max
+from django.utils import timezone
+
+from . import counters
+from .cold_archive import from_micros, open_tracks
+from .alerting import alert_policy
+from .boundary import motion_tracker
+from .cache import response_cache
+from .clustering import position_index
+from .devices import owner_id_for_device
+from .ingest import ingest_fixes, recent_fixes
+from .listener import parse_fix
+from .liveness import liveness_monitor
+from .models import Alert, Device, DeviceLiveness, GPSData
+from .sharding import databases
+from .smoothing import noise_filter
+
+# Alert types raised by ingest itself (offline alerts come from the liveness monitor)
+INGEST_ALERT_TYPES = ("geofence", "boundary", "speed")
+FIELDS = ("device_id", "timestamp", "latitude", "longitude", "speed", "altitude")
+LIVENESS_FIELDS = ("owner_id", "last_seen", "last_fix_id", "is_online", "changed_at")
+
+Recorded = namedtuple("Recorded", "row inside_geofence alerts")
+
+
+def load_recorded(device_ids=None, since=None, until=None, limit=None):
+    """Recorded fixes from GPSData (every shard), oldest first, with their flags and alert types"""
+    recorded = []
+    for db in databases():
+        qs = GPSData.objects.using(db)
+        if device_ids is not None:
+            qs = qs.filter(device_id__in=device_ids)
+        if since:
+            qs = qs.filter(timestamp__gte=since)
+        if until:
+            qs = qs.filter(timestamp__lt=until)
+        qs = qs.order_by("timestamp", "id")
+        if limit:
+            qs = qs[:limit]
+        rows = list(qs.values_list("id", "inside_geofence", *FIELDS))
+
+        alerts = defaultdict(set)
+        ids = [r[0] for r in rows]
+        for start in range(0, len(ids), 500):
+            for gps_id, alert_type in Alert.objects.using(db).filter(
+                gps_data_id__in=ids[start:start + 500], alert_type__in=INGEST_ALERT_TYPES
+            ).values_list("gps_data_id", "alert_type"):
+                alerts[gps_id].add(alert_type)
+
+        recorded += [
+            Recorded(dict(zip(FIELDS, r[2:])), r[1], frozenset(alerts[r[0]]))
+            for r in rows
+        ]
+    stored = {(r.row["device_id"], r.row["timestamp"]) for r in recorded}
+    recorded += _load_archived(device_ids, since, until, stored)
+    recorded.sort(key=lambda r: r.row["timestamp"])
+    return recorded[:limit] if limit else recorded
+
+
+def _load_archived(device_ids, since, until, stored):
+    """Fixes packed into the cold archive and not in `stored` (device id, timestamp) pairs"""
+    if device_ids is None:
+        device_ids = Device.objects.values_list("device_id", flat=True)
+    recorded = []
+    for device_id, track in open_tracks(device_ids).items():
+        cols = track.window(since, until, include_end=False, columns=("t", "lat", "lng", "speed", "altitude", "inside"))
+        for i in range(len(cols["t"])):
+            timestamp = from_micros(cols["t"][i])
+            if (device_id, timestamp) in stored:
+                continue
+            inside = int(cols["inside"][i])
+            recorded.append(Recorded(
+                {
+                    "device_id": device_id,
+                    "timestamp": timestamp,
+                    "latitude": float(cols["lat"][i]),
+                    "longitude": float(cols["lng"][i]),
+                    "speed": float(cols["speed"][i]),
+                    "altitude": float(cols["altitude"][i]),
+                },
+                None if inside < 0 else bool(inside),
+                None,
+            ))
+    return recorded
+
+
+def load_file(path):
+    """
+    Recorded fixes from a file of listener lines (CSV or JSON). JSON lines
+    written by `export` also carry the recorded flag and alert types.
+    """
+    recorded = []
+    with open(path, encoding="utf-8") as handle:
+        for number, line in enumerate(handle, 1):
+            if not line.strip():
+                continue
+            try:
+                row = parse_fix(line)
+            except (ValueError, TypeError) as exc:
+                raise ValueError(f"{path}:{number}: {exc}")
+            extra = json.loads(line) if line.lstrip().startswith("{") else {}
+            alerts = extra.get("alerts")
+            recorded.append(Recorded(
+                row,
+                extra.get("inside_geofence"),
+                frozenset(alerts) if alerts is not None else None,
+            ))
+    recorded.sort(key=lambda r: r.row["timestamp"])
+    return recorded
+
+
+def export(recorded, path):
+    """Write recorded fixes as JSON lines that `load_file` reads back"""
+    with open(path, "w", encoding="utf-8") as handle:
+        for r in recorded:
+            handle.write(json.dumps(dict(
+                r.row,
+                timestamp=r.row["timestamp"].isoformat(),
+                inside_geofence=r.inside_geofence,
+                alerts=sorted(r.alerts) if r.alerts is not None else None,
+            )) + "\n")
+
+
+def _percentile(ordered, q):
+    if not ordered:
+        return None
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+class Replay:
+    def __init__(self, recorded, speed=1.0, workers=4, batch_size=1, start_at=None):
+        """`speed` is the time multiplier; 0 sends as fast as ingest accepts"""
+        self.recorded = recorded
+        self.speed = speed
+        self.workers = max(1, workers)
+        self.batch_size = max(1, batch_size)
+        self.stats = Counter()
+        self.errors = Counter()
+        self.latencies = []
+        self.lags = []
+        self.replayed = {}
+        # device id -> its DeviceLiveness values before the run (None: no row)
+        self.liveness = None
+        self._lock = threading.Lock()
+
+        self.first = recorded[0].row["timestamp"] if recorded else None
+        start_at = start_at or timezone.now()
+        # Land after anything these devices already stored, earlier replays included
+        stored = [
+            GPSData.objects.using(db).filter(
+                device_id__in={r.row["device_id"] for r in recorded}
+            ).aggregate(latest=Max("timestamp"))["latest"]
+            for db in databases()
+        ]
+        latest = max(filter(None, stored), default=None)
+        if latest and latest >= start_at:
+            start_at = latest + timedelta(seconds=1)
+        # Whole seconds keep shifted timestamps as precise as the recorded ones
+        self.offset = (
+            timedelta(seconds=int((start_at - self.first).total_seconds()) + 1)
+            if recorded else None
+        )
+
+    def shifted(self, timestamp):
+        return timestamp + self.offset
+
+    def due(self, timestamp):
+        """Seconds after the start at which a recorded fix is sent"""
+        if not self.speed:
+            return 0.0
+        return (timestamp - self.first).total_seconds() / self.speed
+
+    # ---------- sending ----------
+    def run(self):
+        """Send every recorded fix; returns the report dict"""
+        device_ids = sorted({r.row["device_id"] for r in self.recorded})
+        self.liveness = dict.fromkeys(device_ids)
+        for row in DeviceLiveness.objects.filter(device_id__in=device_ids).values("device_id", *LIVENESS_FIELDS):
+            self.liveness[row.pop("device_id")] = row
+        # Start every device clean: no smoothing track and no open alert to coalesce into
+        alert_policy.forget_devices(device_ids)
+        for device_id in device_ids:
+            noise_filter.forget(device_id)
+
+        lanes = defaultdict(list)
+        lane_of = {device_id: i % self.workers for i, device_id in enumerate(device_ids)}
+        for index, r in enumerate(self.recorded):
+            lanes[lane_of[r.row["device_id"]]].append(index)
+
+        started = time.monotonic()
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="replay") as pool:
+            for future in [pool.submit(self._send_lane, lane, started) for lane in lanes.values()]:
+                future.result()
+        elapsed = time.monotonic() - started
+        return self.report(elapsed)
+
+    def _send_lane(self, indexes, started):
+        try:
+            position = 0
+            while position < len(indexes):
+                due = self.due(self.recorded[indexes[position]].row["timestamp"])
+                wait = started + due - time.monotonic()
+                if wait > 0:
+                    time.sleep(wait)
+                now = time.monotonic() - started
+
+                # Whatever else is already due goes in the same batch
+                batch = [indexes[position]]
+                position += 1
+                while position < len(indexes) and len(batch) < self.batch_size \
+                        and self.due(self.recorded[indexes[position]].row["timestamp"]) <= now:
+                    batch.append(indexes[position])
+                    position += 1
+                self._send(batch, max(0.0, now - due))
+        finally:
+            # Pool threads end with the replay; do not leave their connections open
+            connections.close_all()
+
+    def _send(self, batch, lag):
+        rows = [
+            dict(self.recorded[i].row, timestamp=self.shifted(self.recorded[i].row["timestamp"]))
+            for i in batch
+        ]
+        sent = time.monotonic()
+        try:
+            results = ingest_fixes(rows)
+        except DatabaseError as exc:
+            with self._lock:
+                self.stats["failed"] += len(batch)
+                self.errors[str(exc)] += 1
+            return
+        latency = time.monotonic() - sent
+
+        with self._lock:
+            self.latencies.append(latency)
+            self.lags.append(lag)
+            self.stats["batches"] += 1
+            for i, result in zip(batch, results):
+                if result.duplicate:
+                    self.stats["duplicates"] += 1
+                else:
+                    self.stats["stored"] += 1
+                    self.replayed[i] = (result.gps._state.db, result.gps.pk)
+
+    def report(self, elapsed):
+        latencies = sorted(self.latencies)
+        lags = sorted(self.lags)
+        sent = len(self.recorded)
+        return {
+            "fixes": sent,
+            "stored": self.stats["stored"],
+            "duplicates": self.stats["duplicates"],
+            "failed": self.stats["failed"],
+            "batches": self.stats["batches"],
+            "elapsed_s": round(elapsed, 3),
+            "fixes_per_s": round(sent / elapsed, 1) if elapsed else None,
+            "latency_ms": {
+                name: round(_percentile(latencies, q) * 1000, 2) if latencies else None
+                for name, q in (("p50", 0.5), ("p95", 0.95), ("p99", 0.99), ("max", 1.0))
+            },
+            # How far behind schedule batches were sent (paced replays only)
+            "lag_ms": {
+                name: round(_percentile(lags, q) * 1000, 2) if lags and self.speed else None
+                for name, q in (("p95", 0.95), ("max", 1.0))
+            },
+            "errors": dict(self.errors.most_common(5)),
+        }
+
+    # ---------- comparison ----------
+    def diff(self, examples=10):
+        """Compare the replayed fixes with the recorded ones"""
+        alerts = defaultdict(set)
+        inside = {}
+        for db, pks in self._by_database().items():
+            for start in range(0, len(pks), 500):
+                chunk = pks[start:start + 500]
+                for gps_id, alert_type in Alert.objects.using(db).filter(
+                    gps_data_id__in=chunk, alert_type__in=INGEST_ALERT_TYPES
+                ).values_list("gps_data_id", "alert_type"):
+                    alerts[(db, gps_id)].add(alert_type)
+                inside.update(
+                    ((db, pk), flag)
+                    for pk, flag in GPSData.objects.using(db).filter(pk__in=chunk).values_list("pk", "inside_geofence")
+                )
+
+        result = {
+            "compared": 0,
+            "inside_mismatches": 0,
+            "recorded_alerts": Counter(),
+            "replayed_alerts": Counter(),
+            "missing_alerts": Counter(),
+            "extra_alerts": Counter(),
+            "examples": [],
+        }
+        for index, key in sorted(self.replayed.items()):
+            recorded = self.recorded[index]
+            result["compared"] += 1
+            row = recorded.row
+            now_inside = inside.get(key)
+            if recorded.inside_geofence is not None and now_inside != recorded.inside_geofence:
+                result["inside_mismatches"] += 1
+                if len(result["examples"]) < examples:
+                    result["examples"].append(
+                        f"{row['device_id']} {row['timestamp'].isoformat()}: inside {recorded.inside_geofence} -> {now_inside}"
+                    )
+            if recorded.alerts is None:
+                continue
+            now_alerts = alerts[key]
+            result["recorded_alerts"].update(recorded.alerts)
+            result["replayed_alerts"].update(now_alerts)
+            result["missing_alerts"].update(recorded.alerts - now_alerts)
+            result["extra_alerts"].update(now_alerts - recorded.alerts)
+            if recorded.alerts != now_alerts and len(result["examples"]) < examples:
+                result["examples"].append(
+                    f"{row['device_id']} {row['timestamp'].isoformat()}: alerts "
+                    f"{sorted(recorded.alerts)} -> {sorted(now_alerts)}"
+                )
+        return result
+
+    def cleanup(self):
+        """Delete the replayed fixes (their alerts cascade) and the state they left behind"""
+        for db, pks in self._by_database().items():
+            for start in range(0, len(pks), 500):
+                with counters.batched(using=db):
+                    GPSData.objects.using(db).filter(pk__in=pks[start:start + 500]).delete()
+        device_ids = {r.row["device_id"] for r in self.recorded}
+        self._restore_liveness()
+        alert_policy.forget_devices(device_ids)
+        owners = set()
+        for device_id in device_ids:
+            noise_filter.forget(device_id)
+            motion_tracker.forget(device_id)
+            recent_fixes.forget(device_id)
+            owners.add(owner_id_for_device(device_id))
+        for owner in owners - {None}:
+            # Grids keep the newest position per device, which was a replayed one
+            position_index.forget_owner(owner)
+            response_cache.bump(owner)
+        return len(self.replayed)
+
+    def _restore_liveness(self):
+        """Put the liveness rows back; they pointed at replayed fixes, now deleted"""
+        if self.liveness is None:
+            return
+        for device_id, values in self.liveness.items():
+            if values is None:
+                DeviceLiveness.objects.filter(device_id=device_id).delete()
+            else:
+                DeviceLiveness.objects.filter(device_id=device_id).update(**values)
+        liveness_monitor.reload(self.liveness)
+
+    def _by_database(self):
+        pks = defaultdict(list)
+        for db, pk in self.replayed.values():
+            pks[db].append(pk)
+        return pks
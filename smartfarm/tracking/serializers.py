@@ -1,6 +1,9 @@
 from rest_framework import serializers
-from .models import OwnerProfile, Equipment, Employee, Geofence, GPSData,Alert,Geofence2,Livestock
+from .models import OwnerProfile, Equipment, Employee, Geofence, GPSData,Alert,Geofence2,Livestock, LivestockActivityDay
 from django.contrib.auth.models import User
+from django.conf import settings
+from .geometry import simplify_polygon
+from .devices import device_conflict
 
 class OverviewSerializer(serializers.Serializer):
     id = serializers.IntegerField()
@@ -30,12 +33,48 @@ class OwnerProfileSerializer(serializers.ModelSerializer):
         fields = "__all__"
 
 
+class OwnerSettingsSerializer(serializers.ModelSerializer):
+    """The owner-editable profile fields, validated before user_profile_detail saves them"""
+
+    class Meta:
+        model = OwnerProfile
+        fields = [
+            'phone_number', 'address', 'speed_limit_kmh', 'alert_cooldown_seconds', 'boundary_warning_m',
+            'min_report_seconds', 'max_report_seconds',
+        ]
+        extra_kwargs = {
+            'speed_limit_kmh': {'min_value': 0},
+            'boundary_warning_m': {'min_value': 0},
+            'min_report_seconds': {'min_value': 1},
+        }
+
+    def validate(self, attrs):
+        low = attrs.get('min_report_seconds', self.instance.min_report_seconds if self.instance else 0)
+        high = attrs.get('max_report_seconds', self.instance.max_report_seconds if self.instance else low)
+        if low > high:
+            raise serializers.ValidationError(
+                {'max_report_seconds': 'Must be at least min_report_seconds.'}
+            )
+        return attrs
+
+
 class GeofenceSerializer(serializers.ModelSerializer):
     class Meta:
         model = Geofence
         fields = "__all__"
 
 
+def validate_unregistered_device(serializer, value):
+    """Reject a tracker id that another asset already uses, in any case or spacing"""
+    if value and not value.strip(" ./\\"):
+        # Ids name files and URL segments (cold archive, /api/devices/<id>/)
+        raise serializers.ValidationError("Device id cannot be only dots, slashes and spaces.")
+    taken = device_conflict(value, serializer.instance)
+    if taken:
+        raise serializers.ValidationError(f"Device '{value}' is already registered to another {taken.kind}.")
+    return value
+
+
 class EquipmentSerializer(serializers.ModelSerializer):
     owner = serializers.StringRelatedField(read_only=True)  # Just show the username
 
@@ -48,6 +87,9 @@ class EquipmentSerializer(serializers.ModelSerializer):
             "category": {"required": True},
         }
 
+    def validate_device_id(self, value):
+        return validate_unregistered_device(self, value)
+
 class EmployeeSerializer(serializers.ModelSerializer):
     owner = serializers.StringRelatedField(read_only=True)  # read-only for owner
 
@@ -59,6 +101,9 @@ class EmployeeSerializer(serializers.ModelSerializer):
             "full_name": {"required": True},
         }
 
+    def validate_tracker_device_id(self, value):
+        return validate_unregistered_device(self, value)
+
 
 
 
@@ -69,11 +114,14 @@ class GPSDataSerializer(serializers.ModelSerializer):
     class Meta:
         model = GPSData
         fields = "__all__"
+        read_only_fields = ["filtered_latitude", "filtered_longitude", "is_outlier", "boundary_distance_m"]
+        # Duplicate (device_id, timestamp) fixes are dropped by ingest, not rejected
+        validators = []
 
 class AlertSerializer(serializers.ModelSerializer):
     class Meta:
         model = Alert
-        fields = "__all__"
+        exclude = ("owner",)
 
 class UserRegistrationSerializer(serializers.ModelSerializer):
     password = serializers.CharField(write_only=True)
@@ -102,11 +150,26 @@ class UserRegistrationSerializer(serializers.ModelSerializer):
         return user
     
 class GeofenceSerializer2(serializers.ModelSerializer):
-    
+    # Optional Douglas-Peucker tolerance in metres applied before saving
+    simplify_tolerance_m = serializers.FloatField(write_only=True, required=False, min_value=0)
+
     class Meta:
         model = Geofence2
-        fields = ['id', 'name', 'description', 'coordinates', 'created_at', 'updated_at', 'is_active']
-        read_only_fields = ['created_at', 'updated_at']
+        fields = [
+            'id', 'name', 'description', 'coordinates', 'created_at', 'updated_at', 'is_active',
+            'simplify_tolerance_m', 'min_lat', 'min_lng', 'max_lat', 'max_lng',
+            'area_m2', 'vertex_count', 'encoded_polyline',
+        ]
+        read_only_fields = [
+            'created_at', 'updated_at', 'min_lat', 'min_lng', 'max_lat', 'max_lng',
+            'area_m2', 'vertex_count', 'encoded_polyline',
+        ]
+
+    def validate(self, data):
+        tolerance = data.pop('simplify_tolerance_m', None)
+        if 'coordinates' in data:
+            data['coordinates'] = simplify_geofence(data['coordinates'], tolerance)
+        return data
 
     def validate_coordinates(self, value):
         """Validate that coordinates form a valid polygon"""
@@ -130,4 +193,24 @@ class LivestockSerializer(serializers.ModelSerializer):
     class Meta:
         model = Livestock
         fields = '__all__'
-        read_only_fields = ('owner', 'created_at', 'updated_at')
\ No newline at end of file
+        read_only_fields = ('owner', 'created_at', 'updated_at')
+
+    def validate_device_id(self, value):
+        return validate_unregistered_device(self, value)
+
+class LivestockActivityDaySerializer(serializers.ModelSerializer):
+    livestock_name = serializers.CharField(source='livestock.name', read_only=True)
+
+    class Meta:
+        model = LivestockActivityDay
+        exclude = ['owner']
+
+
+def simplify_geofence(coordinates, tolerance_m=None):
+    """Simplify a fence with the given (or default) tolerance, bounded inward shrink"""
+    options = getattr(settings, 'TRACKING_GEOFENCE_SIMPLIFY', {})
+    if tolerance_m is None:
+        tolerance_m = options.get('DEFAULT_TOLERANCE_M', 0)
+    if not tolerance_m:
+        return coordinates
+    return simplify_polygon(coordinates, tolerance_m, options.get('MAX_INWARD_M', 1.0))
@@ -0,0 +1,302 @@
+"""
+Optional per-owner sharding of telemetry and alerts across SQLite files.
+
+With TRACKING_SHARDING["SHARDS"] = N, settings declare databases shard_0 ..
+shard_<N-1> next to the default one, and OwnerShardRouter sends the GPSData,
+Alert, AlertCounters and AlertArchive rows of owner k to shard_<k % N>. Users,
+assets, fences and everything else stay in the default database, so one
+owner's ingest only takes the write lock of their own shard. With N = 0 (the
+default) nothing is routed and every row lives in the default database.
+
+The database of a sharded query is, in order: the database of the sharded
+instance it starts from, the owner of the instance it starts from, the
+innermost `database_scope`/`owner_scope`, and the authenticated user of the
+current request (ShardScopeMiddleware). Code that works across owners loops
+over `databases()`; rows of devices without an owner stay in the default one.
+
+Each shard hands out ids from its own block of ID_BLOCK, seeded after
+migrate, so ids stay unique across databases and `shard_telemetry` can move
+rows stored before sharding was switched on without renumbering them. A
+device's history stays in the shard of the owner it had when the fixes arrived.
+"""
+import threading
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, transaction
+
+DEFAULTS = {
+    "SHARDS": 0,
+}
+
+SHARDED_MODELS = {"gpsdata", "alert", "alertcounters", "alertarchive"}
+ID_BLOCK = 10 ** 12
+
+_local = threading.local()
+
+
+def sharding_setting(name):
+    return getattr(settings, "TRACKING_SHARDING", {}).get(name, DEFAULTS[name])
+
+
+def enabled():
+    return sharding_setting("SHARDS") > 0
+
+
+def shard_alias(index):
+    return f"shard_{index}"
+
+
+def databases():
+    """Every database that can hold sharded rows, the default one first"""
+    return [DEFAULT_DB_ALIAS] + [shard_alias(i) for i in range(sharding_setting("SHARDS"))]
+
+
+def is_sharded(model):
+    return model._meta.app_label == "tracking" and model._meta.model_name in SHARDED_MODELS
+
+
+def db_for_owner(owner_id):
+    shards = sharding_setting("SHARDS")
+    if not shards or owner_id is None:
+        return DEFAULT_DB_ALIAS
+    return shard_alias(int(owner_id) % shards)
+
+
+def db_for_device(device_id):
+    if not enabled():
+        return DEFAULT_DB_ALIAS
+    from .devices import owner_id_for_device
+
+    return db_for_owner(owner_id_for_device(device_id))
+
+
+def devices_by_database(device_ids):
+    """{database: [device ids]}, with one query for the owners"""
+    device_ids = list(device_ids)
+    if not enabled():
+        return {DEFAULT_DB_ALIAS: device_ids} if device_ids else {}
+    from .models import Device
+
+    owners = dict(Device.objects.filter(device_id__in=device_ids).values_list("device_id", "owner_id"))
+    grouped = defaultdict(list)
+    for device_id in device_ids:
+        grouped[db_for_owner(owners.get(device_id))].append(device_id)
+    return dict(grouped)
+
+
+# ---------- current database ----------
+@contextmanager
+def database_scope(alias):
+    """Route sharded queries without an instance to `alias` inside the block"""
+    stack = _local.__dict__.setdefault("stack", [])
+    stack.append(alias)
+    try:
+        yield alias
+    finally:
+        stack.pop()
+
+
+def owner_scope(owner_id):
+    return database_scope(db_for_owner(owner_id))
+
+
+def current_db():
+    if not enabled():
+        return DEFAULT_DB_ALIAS
+    stack = getattr(_local, "stack", None)
+    if stack:
+        return stack[-1]
+    # DRF sets the authenticated user on the underlying request too
+    user = getattr(getattr(_local, "request", None), "user", None)
+    if user is not None and user.is_authenticated:
+        return db_for_owner(user.pk)
+    return DEFAULT_DB_ALIAS
+
+
+class ShardScopeMiddleware:
+    """Makes the request's user the default owner for sharded queries"""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        previous = getattr(_local, "request", None)
+        _local.request = request
+        try:
+            return self.get_response(request)
+        finally:
+            _local.request = previous
+
+
+def seed_sequences(using, **kwargs):
+    """post_migrate: start the id sequences of a shard's tables at its own block"""
+    if not using.startswith("shard_"):
+        return
+    from django.apps import apps
+    from django.db import connections
+
+    floor = (int(using.split("_")[1]) + 1) * ID_BLOCK
+    with connections[using].cursor() as cursor:
+        for model in apps.get_app_config("tracking").get_models():
+            if not is_sharded(model) or not model._meta.auto_field:
+                continue
+            table = model._meta.db_table
+            cursor.execute("SELECT seq FROM sqlite_sequence WHERE name = %s", [table])
+            row = cursor.fetchone()
+            if row is None:
+                cursor.execute("INSERT INTO sqlite_sequence (name, seq) VALUES (%s, %s)", [table, floor])
+            elif row[0] < floor:
+                cursor.execute("UPDATE sqlite_sequence SET seq = %s WHERE name = %s", [floor, table])
+
+
+# ---------- router ----------
+def _instance_owner(instance):
+    """Owner id of a hinted instance, or False when it does not say"""
+    from django.contrib.auth.models import User
+
+    if isinstance(instance, User):
+        return instance.pk
+    if hasattr(instance, "owner_id"):
+        return instance.owner_id
+    return False
+
+
+class OwnerShardRouter:
+    def db_for_read(self, model, **hints):
+        if not enabled():
+            return None
+        if not is_sharded(model):
+            # Without this, relations followed from a shard row would stay in the shard
+            return DEFAULT_DB_ALIAS
+        instance = hints.get("instance")
+        if instance is not None:
+            if is_sharded(type(instance)) and instance._state.db:
+                return instance._state.db
+            owner_id = _instance_owner(instance)
+            if owner_id is not False:
+                return db_for_owner(owner_id)
+        stack = getattr(_local, "stack", None)
+        if stack:
+            return stack[-1]
+        if instance is not None and hasattr(instance, "device_id"):
+            return db_for_device(instance.device_id)
+        return current_db()
+
+    db_for_write = db_for_read
+
+    def allow_relation(self, obj1, obj2, **hints):
+        if is_sharded(type(obj1)) or is_sharded(type(obj2)):
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if db == DEFAULT_DB_ALIAS:
+            return None
+        # Shards hold only the sharded tables; data migrations run on the default database
+        return app_label == "tracking" and model_name in SHARDED_MODELS
+
+
+# ---------- moving rows ----------
+def _copy(db, model, objs, same):
+    """
+    Insert rows read from the default database into `db` with their ids.
+    Ids already there must hold the same row (an interrupted earlier move);
+    anything else means the shard took new rows first, and the move stops.
+    """
+    existing = {
+        o.pk: o for o in model.objects.using(db).filter(pk__in=[o.pk for o in objs])
+    }
+    for obj in objs:
+        other = existing.get(obj.pk)
+        if other is not None and any(getattr(other, f) != getattr(obj, f) for f in same):
+            raise RuntimeError(f"{db} already holds a different {model.__name__} with id {obj.pk}")
+    new = [o for o in objs if o.pk not in existing]
+    _insert(db, model, new)
+    return len(new)
+
+
+def _insert(db, model, objs):
+    """bulk_create that keeps auto_now_add values instead of stamping the copy time"""
+    stamps = [f.attname for f in model._meta.concrete_fields if getattr(f, "auto_now_add", False)]
+    original = [[getattr(o, name) for name in stamps] for o in objs]
+    model.objects.using(db).bulk_create(objs, batch_size=500)
+    for obj, values in zip(objs, original):
+        for name, value in zip(stamps, values):
+            setattr(obj, name, value)
+    if objs and stamps:
+        model.objects.using(db).bulk_update(objs, stamps, batch_size=500)
+
+
+def move_owner(owner_id, device_ids, batch_size=1000, log=None):
+    """
+    Move an owner's telemetry, alerts and archived alerts from the default
+    database to their shard, keeping ids, a batch of fixes (with the alerts
+    on them) at a time. Rerunning after an interruption picks up where it
+    stopped. Returns a Counter of rows moved per model.
+    """
+    from . import counters
+    from .models import Alert, AlertArchive, AlertCounters, GPSData
+
+    moved = Counter()
+    db = db_for_owner(owner_id)
+    if db == DEFAULT_DB_ALIAS:
+        return moved
+
+    fixes = GPSData.objects.using(DEFAULT_DB_ALIAS).filter(device_id__in=device_ids).order_by("pk")
+    last_id = 0
+    while True:
+        batch = list(fixes.filter(pk__gt=last_id)[:batch_size])
+        if not batch:
+            break
+        last_id = batch[-1].pk
+        pks = [f.pk for f in batch]
+        alerts = list(Alert.objects.using(DEFAULT_DB_ALIAS).filter(gps_data_id__in=pks))
+        with transaction.atomic(using=db):
+            moved["fixes"] += _copy(db, GPSData, batch, ("device_id", "timestamp"))
+            moved["alerts"] += _copy(db, Alert, alerts, ("gps_data_id", "alert_type"))
+        # Counter changes from the cascade are settled by the recount below
+        with counters.batched(using=DEFAULT_DB_ALIAS):
+            GPSData.objects.using(DEFAULT_DB_ALIAS).filter(pk__in=pks).delete()
+        if log:
+            log(f"owner {owner_id}: {moved['fixes']} fixes, {moved['alerts']} alerts moved to {db}")
+
+    # Archived alerts are unique by alert id, which the move kept
+    archived = AlertArchive.objects.using(DEFAULT_DB_ALIAS).filter(owner_id=owner_id)
+    while True:
+        batch = list(archived.order_by("pk")[:batch_size])
+        if not batch:
+            break
+        present = set(
+            AlertArchive.objects.using(db).filter(alert_id__in=[a.alert_id for a in batch])
+            .values_list("alert_id", flat=True)
+        )
+        new = [a for a in batch if a.alert_id not in present]
+        with transaction.atomic(using=db):
+            for row in new:
+                row.pk = None
+            _insert(db, AlertArchive, new)
+        AlertArchive.objects.using(DEFAULT_DB_ALIAS).filter(pk__in=[a.pk for a in batch]).delete()
+        moved["archived_alerts"] += len(new)
+
+    AlertCounters.objects.using(DEFAULT_DB_ALIAS).filter(owner_id=owner_id).delete()
+    counters.recount([owner_id])
+    return moved
+
+
+def purge_owner(owner_id, device_ids, batch_size=500):
+    """Delete a deleted owner's rows from their shard"""
+    from . import counters
+    from .models import Alert, AlertArchive, AlertCounters, GPSData
+
+    db = db_for_owner(owner_id)
+    if db == DEFAULT_DB_ALIAS:
+        return
+    for start in range(0, len(device_ids), batch_size):
+        with counters.batched(using=db):
+            GPSData.objects.using(db).filter(device_id__in=device_ids[start:start + batch_size]).delete()
+    with counters.batched(using=db):
+        Alert.objects.using(db).filter(owner_id=owner_id).delete()
+    AlertArchive.objects.using(db).filter(owner_id=owner_id).delete()
+    AlertCounters.objects.using(db).filter(owner_id=owner_id).delete()
@@ -0,0 +1,118 @@
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete, pre_delete, pre_save
+from django.dispatch import receiver
+
+from .models import Equipment, Employee, Livestock, Geofence2, GPSData, Alert, OwnerProfile, Device
+from . import cold_archive, counters, sharding
+from .alerting import alert_policy
+from .authentication import user_cache
+from .cache import response_cache
+from .clustering import position_index
+from .devices import forget_devices, owner_id_for_device, registry_changed, sync_device
+from .reevaluation import enqueue_geofence_reevaluation
+
+
+@receiver(post_save, sender=Equipment)
+@receiver(post_save, sender=Employee)
+@receiver(post_save, sender=Livestock)
+def register_device(sender, instance, **kwargs):
+    """Keep the Device table in step with asset tracker ids; deletes cascade"""
+    sync_device(instance, sender.__name__.lower())
+
+
+@receiver(pre_save, sender=Device)
+def drop_archive_of_old_registration(sender, instance, using, **kwargs):
+    """A tracker id that moves to another owner must not bring the old owner's packed history"""
+    if instance.pk is None:
+        return
+    old = Device.objects.using(using).filter(pk=instance.pk).values_list("device_id", "owner_id").first()
+    if old and old != (instance.device_id, instance.owner_id):
+        transaction.on_commit(lambda: cold_archive.remove_device(old[0]), using=using)
+
+
+@receiver(post_delete, sender=Device)
+def drop_archive_of_deleted_device(sender, instance, using, **kwargs):
+    device_id = instance.device_id
+    transaction.on_commit(lambda: cold_archive.remove_device(device_id), using=using)
+
+
+@receiver([post_save, post_delete], sender=Device)
+def announce_registry_change(sender, instance, using, **kwargs):
+    """Other processes drop their cached owner ids once the change commits"""
+    transaction.on_commit(registry_changed, using=using)
+
+
+@receiver([post_save, post_delete], sender=Equipment)
+@receiver([post_save, post_delete], sender=Employee)
+@receiver([post_save, post_delete], sender=Livestock)
+@receiver([post_save, post_delete], sender=Geofence2)
+def reset_position_index(sender, instance, **kwargs):
+    """Asset or fence changes alter names and inside flags, so re-warm the owner"""
+    if instance.owner_id:
+        position_index.forget_owner(instance.owner_id)
+        response_cache.bump(instance.owner_id)
+    if sender is not Geofence2:
+        forget_devices()
+
+
+@receiver([post_save, post_delete], sender=Geofence2)
+def reevaluate_after_fence_change(sender, instance, **kwargs):
+    if instance.owner_id:
+        enqueue_geofence_reevaluation(instance.owner_id)
+
+
+@receiver(post_save, sender=GPSData)
+def bump_for_fix(sender, instance, created, **kwargs):
+    response_cache.bump(owner_id_for_device(instance.device_id))
+
+
+@receiver([post_save, post_delete], sender=Alert)
+def bump_for_alert(sender, instance, **kwargs):
+    # Read the owner off the row: bulk deletes send this for every alert
+    response_cache.bump(instance.owner_id or owner_id_for_device(instance.gps_data.device_id))
+    if instance.is_resolved or kwargs["signal"] is post_delete:
+        alert_policy.alert_closed(instance.id, using=kwargs["using"])
+
+
+@receiver(post_save, sender=Alert)
+def count_saved_alert(sender, instance, created, **kwargs):
+    if not created:
+        # The previous state is unknown, so recount rather than guess
+        counters.recount([instance.owner_id])
+    elif not instance.is_resolved:
+        counters.adjust(instance.owner_id, {instance.alert_type: 1})
+
+
+@receiver(post_delete, sender=Alert)
+def count_deleted_alert(sender, instance, origin=None, **kwargs):
+    # Deleting a user takes their counters row with it
+    if isinstance(origin, User) or getattr(origin, "model", None) is User:
+        return
+    if not instance.is_resolved:
+        counters.adjust(instance.owner_id, {instance.alert_type: -1})
+
+
+@receiver(post_save, sender=OwnerProfile)
+def reset_alert_thresholds(sender, instance, **kwargs):
+    alert_policy.forget_thresholds(instance.user_id)
+
+
+@receiver(pre_delete, sender=User)
+def purge_sharded_rows(sender, instance, **kwargs):
+    """The delete cascade only reaches the default database; clear the owner's shard once it commits"""
+    if sharding.enabled():
+        # The collector clears instance.pk before an outer transaction commits
+        owner_id = instance.pk
+        device_ids = list(instance.devices.values_list("device_id", flat=True))
+        transaction.on_commit(lambda: sharding.purge_owner(owner_id, device_ids), using=kwargs["using"])
+
+
+@receiver([post_save, post_delete], sender=User)
+def evict_cached_user(sender, instance, **kwargs):
+    user_cache.evict(instance.pk)
+
+
+@receiver([post_save, post_delete], sender=OwnerProfile)
+def evict_cached_profile_user(sender, instance, **kwargs):
+    user_cache.evict(instance.user_id)
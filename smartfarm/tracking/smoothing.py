@@ -0,0 +1,302 @@
+"""
+GPS noise filtering.
+
+Each device gets a constant-velocity Kalman filter in a local metre frame
+(x east, y north), kept in memory between fixes. Both axes share one
+covariance, so the whole update is a handful of float operations. Before a
+fix is accepted its implied speed from the current filtered position is
+checked with `haversine_m`; implausible jumps are marked as outliers and the
+filter coasts on its prediction. A run of consecutive outliers, a long gap or
+a fix older than the track restarts the filter at the raw fix.
+
+`filter_tracks` is the same filter vectorized across many devices at once for
+cleaning stored history (numpy required).
+"""
+import math
+import threading
+from collections import OrderedDict, namedtuple
+
+from django.conf import settings
+
+from .geometry import EARTH_RADIUS_M, haversine_m
+
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover - only the history cleaner needs numpy
+    np = None
+
+DEFAULTS = {
+    "ENABLED": True,
+    "MEASUREMENT_SIGMA_M": 8.0,
+    "ACCEL_SIGMA_MPS2": 0.5,
+    "INITIAL_SPEED_SIGMA_MPS": 10.0,
+    "MAX_SPEED_KMH": 120.0,
+    "MAX_REJECTS": 3,
+    "RESET_AFTER_SECONDS": 600,
+    "MAX_DEVICES": 100000,
+}
+
+Filtered = namedtuple("Filtered", "latitude longitude speed_kmh outlier")
+
+KY = math.radians(1) * EARTH_RADIUS_M
+
+
+def smoothing_setting(name):
+    return getattr(settings, "TRACKING_NOISE_FILTER", {}).get(name, DEFAULTS[name])
+
+
+class KalmanTrack:
+    """Constant-velocity filter for one device"""
+
+    def __init__(self, lat, lng, t):
+        self.lat0, self.lng0 = lat, lng
+        self.kx = KY * math.cos(math.radians(lat))
+        self.t = t
+        self.x = self.y = self.vx = self.vy = 0.0
+        # Shared covariance [[a, b], [b, c]] of (position, velocity) per axis
+        self.a = smoothing_setting("MEASUREMENT_SIGMA_M") ** 2
+        self.b = 0.0
+        self.c = smoothing_setting("INITIAL_SPEED_SIGMA_MPS") ** 2
+        self.updates = 0
+        self.rejects = 0
+
+    def position(self, x=None, y=None):
+        x = self.x if x is None else x
+        y = self.y if y is None else y
+        return self.lat0 + y / KY, self.lng0 + x / self.kx
+
+    def speed_kmh(self):
+        return math.hypot(self.vx, self.vy) * 3.6
+
+    def step(self, lat, lng, t):
+        """Predict to `t` and, unless the fix is gated out, correct with it"""
+        dt = t - self.t
+        q = smoothing_setting("ACCEL_SIGMA_MPS2") ** 2
+        px, py = self.x + self.vx * dt, self.y + self.vy * dt
+        a = self.a + 2 * dt * self.b + dt * dt * self.c + q * dt ** 4 / 4
+        b = self.b + dt * self.c + q * dt ** 3 / 2
+        c = self.c + q * dt * dt
+        self.t = t
+
+        implied_kmh = haversine_m(*self.position(px, py), lat, lng) / dt * 3.6
+        if implied_kmh > smoothing_setting("MAX_SPEED_KMH"):
+            self.x, self.y, self.a, self.b, self.c = px, py, a, b, c
+            self.rejects += 1
+            return False
+
+        r = smoothing_setting("MEASUREMENT_SIGMA_M") ** 2
+        s = a + r
+        k0, k1 = a / s, b / s
+        zx, zy = (lng - self.lng0) * self.kx, (lat - self.lat0) * KY
+        self.x, self.y = px + k0 * (zx - px), py + k0 * (zy - py)
+        self.vx, self.vy = self.vx + k1 * (zx - px), self.vy + k1 * (zy - py)
+        self.a, self.b, self.c = (1 - k0) * a, (1 - k0) * b, c - k1 * b
+        self.updates += 1
+        self.rejects = 0
+        return True
+
+
+class NoiseFilter:
+    """Per-process registry of device tracks, bounded LRU"""
+
+    def __init__(self):
+        self._tracks = OrderedDict()
+        self._lock = threading.Lock()
+
+    def update(self, device_id, lat, lng, timestamp):
+        """Filter one fix; fixes must arrive in timestamp order per device to be smoothed"""
+        t = timestamp.timestamp()
+        with self._lock:
+            track = self._tracks.get(device_id)
+            if track is not None:
+                self._tracks.move_to_end(device_id)
+
+            if track is None or t - track.t > smoothing_setting("RESET_AFTER_SECONDS") \
+                    or track.rejects >= smoothing_setting("MAX_REJECTS"):
+                self._tracks[device_id] = KalmanTrack(lat, lng, t)
+                if len(self._tracks) > smoothing_setting("MAX_DEVICES"):
+                    self._tracks.popitem(last=False)
+                return Filtered(lat, lng, None, False)
+
+            if t <= track.t:
+                # Late fix: report it unfiltered rather than rewinding the track
+                return Filtered(lat, lng, None, False)
+
+            accepted = track.step(lat, lng, t)
+            flat, flng = track.position()
+            speed = track.speed_kmh() if track.updates >= 2 else None
+            return Filtered(flat, flng, speed, not accepted)
+
+    def forget(self, device_id):
+        with self._lock:
+            self._tracks.pop(device_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._tracks.clear()
+
+
+noise_filter = NoiseFilter()
+
+
+def filter_tracks(tracks):
+    """
+    Run the filter over many stored tracks at once, one time step per
+    iteration across all devices. `tracks` is a list of (t, lat, lng) numpy
+    arrays, each sorted by time (t in epoch seconds). Returns a list of
+    (filtered_lat, filtered_lng, outlier) arrays in the same shapes.
+    """
+    n = len(tracks)
+    if not n:
+        return []
+    length = max(len(t) for t, _, _ in tracks)
+    T = np.full((n, length), np.nan)
+    LAT = np.full((n, length), np.nan)
+    LNG = np.full((n, length), np.nan)
+    for i, (t, lat, lng) in enumerate(tracks):
+        T[i, :len(t)], LAT[i, :len(t)], LNG[i, :len(t)] = t, lat, lng
+    OUT_LAT, OUT_LNG = LAT.copy(), LNG.copy()
+    OUTLIER = np.zeros((n, length), dtype=bool)
+
+    r = smoothing_setting("MEASUREMENT_SIGMA_M") ** 2
+    q = smoothing_setting("ACCEL_SIGMA_MPS2") ** 2
+    c0 = smoothing_setting("INITIAL_SPEED_SIGMA_MPS") ** 2
+    max_mps = smoothing_setting("MAX_SPEED_KMH") / 3.6
+    reset_after = smoothing_setting("RESET_AFTER_SECONDS")
+    max_rejects = smoothing_setting("MAX_REJECTS")
+
+    lat0, lng0, t_prev = LAT[:, 0].copy(), LNG[:, 0].copy(), T[:, 0].copy()
+    kx = KY * np.cos(np.radians(lat0))
+    x, y, vx, vy = (np.zeros(n) for _ in range(4))
+    a, b, c = np.full(n, r), np.zeros(n), np.full(n, c0)
+    rejects = np.zeros(n, dtype=np.int64)
+
+    for j in range(1, length):
+        live = ~np.isnan(T[:, j])
+        if not live.any():
+            break
+        tj, zlat, zlng = T[:, j], LAT[:, j], LNG[:, j]
+        dt = np.where(live, tj - t_prev, 0.0)
+
+        # Restart tracks after a long gap or a run of outliers
+        reset = live & ((dt > reset_after) | (rejects >= max_rejects))
+        if reset.any():
+            lat0[reset], lng0[reset], t_prev[reset] = zlat[reset], zlng[reset], tj[reset]
+            kx[reset] = KY * np.cos(np.radians(zlat[reset]))
+            x[reset] = y[reset] = vx[reset] = vy[reset] = b[reset] = 0.0
+            a[reset], c[reset], rejects[reset] = r, c0, 0
+        step = live & ~reset & (dt > 0)
+        dt = np.where(step, dt, 0.0)
+
+        px, py = x + vx * dt, y + vy * dt
+        pa = a + 2 * dt * b + dt * dt * c + q * dt ** 4 / 4
+        pb = b + dt * c + q * dt ** 3 / 2
+        pc = c + q * dt * dt
+
+        plat, plng = lat0 + py / KY, lng0 + px / kx
+        p1, p2 = np.radians(plat), np.radians(zlat)
+        h = np.sin((p2 - p1) / 2) ** 2 + np.cos(p1) * np.cos(p2) * np.sin(np.radians(zlng - plng) / 2) ** 2
+        jump = EARTH_RADIUS_M * 2 * np.arctan2(np.sqrt(h), np.sqrt(np.clip(1 - h, 0, None)))
+        with np.errstate(divide="ignore", invalid="ignore"):
+            gated = step & (jump / np.where(dt > 0, dt, 1.0) > max_mps)
+        accept = step & ~gated
+
+        zx, zy = (zlng - lng0) * kx, (zlat - lat0) * KY
+        k0, k1 = pa / (pa + r), pb / (pa + r)
+        nx = np.where(accept, px + k0 * (zx - px), px)
+        ny = np.where(accept, py + k0 * (zy - py), py)
+        vx = np.where(accept, vx + k1 * (zx - px), vx)
+        vy = np.where(accept, vy + k1 * (zy - py), vy)
+        a_new = np.where(accept, (1 - k0) * pa, pa)
+        b_new = np.where(accept, (1 - k0) * pb, pb)
+        c_new = np.where(accept, pc - k1 * pb, pc)
+
+        x, y = np.where(step, nx, x), np.where(step, ny, y)
+        a, b, c = np.where(step, a_new, a), np.where(step, b_new, b), np.where(step, c_new, c)
+        t_prev = np.where(step, tj, t_prev)
+        rejects = np.where(gated, rejects + 1, np.where(accept, 0, rejects))
+
+        OUT_LAT[step, j] = (lat0 + y / KY)[step]
+        OUT_LNG[step, j] = (lng0 + x / kx)[step]
+        OUTLIER[:, j] = gated
+
+    return [
+        (OUT_LAT[i, :len(t)], OUT_LNG[i, :len(t)], OUTLIER[i, :len(t)])
+        for i, (t, _, _) in enumerate(tracks)
+    ]
+
+
+def smooth_history(device_ids, since=None, devices_per_batch=200, dry_run=False, log=None):
+    """
+    Recompute filtered positions and outlier flags of stored fixes, a group
+    of devices at a time. Fixes only in the cold archive are filtered along
+    for context and left as packed. Returns (fixes processed, outliers found).
+    """
+    from .cold_archive import open_tracks, to_micros
+    from .models import GPSData
+    from .sharding import devices_by_database
+
+    processed = outliers = done = 0
+    # Groups never span databases (tracking.sharding)
+    groups = []
+    for db, ids in sorted(devices_by_database(device_ids).items()):
+        ids.sort()
+        groups += [(db, ids[i:i + devices_per_batch]) for i in range(0, len(ids), devices_per_batch)]
+    total = sum(len(group) for _, group in groups)
+    for db, group in groups:
+        done += len(group)
+        qs = GPSData.objects.using(db).filter(device_id__in=group)
+        if since:
+            qs = qs.filter(timestamp__gte=since)
+        rows = list(qs.order_by("device_id", "timestamp").values_list("pk", "device_id", "timestamp", "latitude", "longitude"))
+        if not rows:
+            continue
+
+        pks = np.fromiter((r[0] for r in rows), dtype=np.int64, count=len(rows))
+        devices = np.array([r[1] for r in rows], dtype=object)
+        micros = np.fromiter((to_micros(r[2]) for r in rows), dtype=np.int64, count=len(rows))
+        lat = np.fromiter((r[3] for r in rows), dtype=np.float64, count=len(rows))
+        lng = np.fromiter((r[4] for r in rows), dtype=np.float64, count=len(rows))
+        edges = np.flatnonzero(devices[1:] != devices[:-1]) + 1
+        slices = list(zip(np.r_[0, edges], np.r_[edges, len(rows)]))
+
+        tracks = open_tracks(group)
+        inputs, stored = [], []
+        for lo, hi in slices:
+            track = tracks.get(devices[lo])
+            if track is None:
+                inputs.append((micros[lo:hi] / 1e6, lat[lo:hi], lng[lo:hi]))
+                stored.append(None)
+                continue
+            cold = track.window(since, None, columns=("t", "lat", "lng"))
+            extra = ~np.isin(cold["t"], micros[lo:hi])
+            order = np.argsort(np.concatenate([cold["t"][extra], micros[lo:hi]]), kind="stable")
+            merged = {
+                name: np.concatenate([cold[name][extra], values])[order]
+                for name, values in (("t", micros[lo:hi]), ("lat", lat[lo:hi]), ("lng", lng[lo:hi]))
+            }
+            inputs.append((merged["t"] / 1e6, merged["lat"], merged["lng"]))
+            stored.append(np.r_[np.zeros(int(extra.sum()), dtype=bool), np.ones(hi - lo, dtype=bool)][order])
+
+        results = [
+            r if mask is None else tuple(values[mask] for values in r)
+            for r, mask in zip(filter_tracks(inputs), stored)
+        ]
+        flat = np.concatenate([r[0] for r in results])
+        flng = np.concatenate([r[1] for r in results])
+        outlier = np.concatenate([r[2] for r in results])
+        processed += len(rows)
+        outliers += int(outlier.sum())
+
+        if not dry_run:
+            GPSData.objects.using(db).bulk_update(
+                [
+                    GPSData(pk=int(pk), filtered_latitude=float(a), filtered_longitude=float(b), is_outlier=bool(o))
+                    for pk, a, b, o in zip(pks, flat, flng, outlier)
+                ],
+                ["filtered_latitude", "filtered_longitude", "is_outlier"],
+                batch_size=500,
+            )
+        if log:
+            log(f"{done}/{total} devices, {processed} fixes")
+    return processed, outliers
@@ -1,3 +1,1428 @@
-from django.test import TestCase
+import asyncio
+import base64
+import concurrent.futures
+import json
+import math
+import random
+import tempfile
+import time
+from collections import Counter
+from datetime import datetime, timedelta, timezone as dt_timezone
+from pathlib import Path
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from asgiref.sync import async_to_sync, sync_to_async
+from django.contrib.auth.models import User
+from django.db import OperationalError, transaction
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import AccessToken
+
+from . import (
+    behaviour, cache, clustering, cold_archive, devices, dwell, geometry, heatmap, listener, pagination, reevaluation,
+    replay, sharding, smoothing, track_encoding,
+)
+from .alerting import AlertPolicy, alert_policy, alert_setting
+from .authentication import CachedJWTAuthentication, user_cache
+from .boundary import motion_tracker
+from .cache import response_cache
+from .ingest import recent_fixes
+from .live import live_hub, positions_socket
+from .liveness import liveness_monitor
+from .smoothing import noise_filter
+from .throttling import ingest_stats
+from .liveness import LivenessMonitor
+from .models import (
+    Alert, AlertCounters, DeviceLiveness, Equipment, GPSData, Geofence2, GeofenceInterval, Livestock,
+    LivestockActivityDay, OwnerProfile,
+)
+
+
+def reset_tracking_state():
+    """
+    Drop the per-process caches. They outlive the rows each test rolls back,
+    and SQLite hands the same ids out again.
+    """
+    for cache in (
+        recent_fixes, alert_policy, noise_filter, clustering.position_index, motion_tracker,
+        user_cache, ingest_stats, liveness_monitor, response_cache,
+    ):
+        cache.clear()
+    devices.forget_devices()
+    geometry.clear_shared()
+    dwell._queued.clear()
+    reevaluation._queued.clear()
+
+
+class TrackingTestCase(TestCase):
+    # Sharded rows live in shard_<n> under settings_sharded_test
+    databases = "__all__"
+
+    def setUp(self):
+        super().setUp()
+        reset_tracking_state()
+        self.addCleanup(reset_tracking_state)
+
+
+def store(model, **fields):
+    """Save a row through the shard router; QuerySet.create() gives it no instance to route by"""
+    obj = model(**fields)
+    obj.save()
+    return obj
+
+
+def ray_cast(coords, lat, lng):
+    """The crossing loop of Geofence2.contains_point, without the bbox shortcut"""
+    if coords[0] != coords[-1]:
+        coords = coords + [coords[0]]
+    inside = False
+    j = len(coords) - 1
+    for i in range(len(coords)):
+        xi, yi = coords[i]
+        xj, yj = coords[j]
+        if ((yi > lng) != (yj > lng)) and (lat < (xj - xi) * (lng - yi) / (yj - yi) + xi):
+            inside = not inside
+        j = i
+    return inside
+
+
+def star_polygon(rng, n, lat0=-15.41, lng0=28.31, radius=0.01):
+    """Simple polygon with n vertices at random radii around a centre"""
+    angles = sorted(rng.uniform(0, 2 * math.pi) for _ in range(n))
+    return [
+        [lat0 + r * math.sin(a), lng0 + r * math.cos(a)]
+        for a, r in ((a, radius * rng.uniform(0.3, 1.0)) for a in angles)
+    ]
+
+
+def grid_polygon(rng, n):
+    """Vertices snapped to a coarse grid: shared lng values, horizontal edges, repeated points"""
+    poly = star_polygon(rng, n)
+    return [[round(lat, 3), round(lng, 3)] for lat, lng in poly]
+
+
+def random_polygon(rng, n):
+    """Self-intersecting polygon from unordered random vertices"""
+    return [[rng.uniform(-15.42, -15.40), rng.uniform(28.30, 28.32)] for _ in range(n)]
+
+
+def query_points(rng, coords, n=400):
+    """Random points plus the vertices, edge midpoints and points on vertex lng lines"""
+    lats = [p[0] for p in coords]
+    lngs = [p[1] for p in coords]
+    lo_lat, hi_lat, lo_lng, hi_lng = min(lats), max(lats), min(lngs), max(lngs)
+    pad_lat, pad_lng = (hi_lat - lo_lat) * 0.1, (hi_lng - lo_lng) * 0.1
+    points = [
+        (rng.uniform(lo_lat - pad_lat, hi_lat + pad_lat), rng.uniform(lo_lng - pad_lng, hi_lng + pad_lng))
+        for _ in range(n)
+    ]
+    for k in rng.sample(range(len(coords)), min(len(coords), 300)):
+        lat, lng = coords[k]
+        nxt = coords[(k + 1) % len(coords)]
+        points.append((lat, lng))
+        points.append(((lat + nxt[0]) / 2, (lng + nxt[1]) / 2))
+        points.append((rng.uniform(lo_lat, hi_lat), lng))
+    points += [(lo_lat, lo_lng), (hi_lat, hi_lng), (float("nan"), lo_lng), (lo_lat, float("nan"))]
+    return points
+
+
+class StripIndexPropertyTests(SimpleTestCase):
+    """StripIndex must give exactly the ray-casting answer, including on edges and vertices"""
+
+    SHAPES = (star_polygon, grid_polygon, random_polygon)
+
+    def cases(self):
+        rng = random.Random(49)
+        for shape in self.SHAPES:
+            for n in (3, 4, 7, 32, 100, 1000, 3000):
+                coords = shape(rng, n)
+                if rng.random() < 0.5:
+                    coords = coords + [coords[0]]
+                yield coords, query_points(rng, coords)
+
+    def test_contains_agrees_with_ray_casting(self):
+        for coords, points in self.cases():
+            index = geometry.StripIndex(coords)
+            for lat, lng in points:
+                self.assertEqual(index.contains(lat, lng), ray_cast(coords, lat, lng), (len(coords), lat, lng))
+
+    def test_contains_many_agrees_with_vectorized_ray_casting(self):
+        if geometry.np is None:
+            self.skipTest("numpy is not installed")
+        np = geometry.np
+        for coords, points in self.cases():
+            lats = np.array([p[0] for p in points])
+            lngs = np.array([p[1] for p in points])
+            expected = geometry.contains_many(coords, lats, lngs)
+            np.testing.assert_array_equal(geometry.StripIndex(coords).contains_many(lats, lngs), expected)
+            np.testing.assert_array_equal(expected, [ray_cast(coords, lat, lng) for lat, lng in points])
+
+    def test_geofence_contains_point_is_unchanged(self):
+        rng = random.Random(7)
+        for shape in self.SHAPES:
+            coords = shape(rng, 2000)
+            fence = Geofence2(coordinates=coords)
+            fence.update_geometry()
+            self.assertIsNotNone(fence.strip_index())
+            for lat, lng in query_points(rng, coords, 200):
+                in_bbox = fence.min_lat <= lat <= fence.max_lat and fence.min_lng <= lng <= fence.max_lng
+                self.assertEqual(fence.contains_point(lat, lng), in_bbox and ray_cast(coords, lat, lng))
+
+    def test_integer_coordinates(self):
+        # A comb: teeth share lng values and the base is a horizontal run
+        coords = [[0, 0]]
+        for tooth in range(20):
+            coords += [[10, 2 * tooth], [10, 2 * tooth + 1], [1, 2 * tooth + 1], [1, 2 * tooth + 2]]
+        coords += [[0, 40]]
+        index = geometry.StripIndex(coords)
+        for lat in range(-1, 12):
+            for lng in range(-1, 42):
+                self.assertEqual(index.contains(lat, lng), ray_cast(coords, lat, lng))
+
+    def test_index_follows_coordinate_edits(self):
+        rng = random.Random(3)
+        fence = Geofence2(pk=1, coordinates=star_polygon(rng, 64))
+        fence.update_geometry()
+        first = fence.strip_index()
+        fence.coordinates = [[lat + 0.005, lng] for lat, lng in fence.coordinates]
+        fence.update_geometry()
+        self.assertIsNot(fence.strip_index(), first)
+        self.assertEqual(fence.strip_index().coords, fence.coordinates)
+
+        # A reused key never hands out the index of other coordinates
+        moved = [[lat, lng + 1e-9] for lat, lng in fence.coordinates]
+        key = ("fence", 1)
+        self.assertIs(geometry.strip_index(fence.coordinates, key), geometry.strip_index(fence.coordinates, key))
+        self.assertEqual(geometry.strip_index(moved, key).coords, moved)
+
+    def test_edge_set_is_shared_between_loads(self):
+        rng = random.Random(5)
+        coords = star_polygon(rng, 64)
+        loads = []
+        for _ in range(2):
+            # As each ingest request loads the fence again
+            fence = Geofence2(pk=2, coordinates=[list(p) for p in coords])
+            fence.update_geometry()
+            fence.boundary_distance_m(-15.41, 28.31)
+            loads.append(fence)
+        self.assertIs(loads[0]._edge_set, loads[1]._edge_set)
+
+        edited = Geofence2(pk=2, coordinates=[[lat + 0.001, lng] for lat, lng in coords])
+        edited.update_geometry()
+        edited.boundary_distance_m(-15.41, 28.31)
+        self.assertIsNot(edited._edge_set, loads[0]._edge_set)
+        self.assertEqual(edited._edge_set.coords, edited.coordinates)
+
+    def test_small_fences_skip_the_index(self):
+        fence = Geofence2(coordinates=[[0.0, 0.0], [0.0, 1.0], [1.0, 1.0], [1.0, 0.0]])
+        fence.update_geometry()
+        self.assertIsNone(fence.strip_index())
+        self.assertTrue(fence.contains_point(0.5, 0.5))
+
+
+def dented_square(dent_m=3.0, bump_m=5.0, per_edge=50):
+    """A 0.01 degree square whose edge points are pushed inward by dent_m, with one bump outward"""
+    dlat = 1 / 111320
+    dlng = dlat / math.cos(math.radians(15.405))
+    corners = [(-15.40, 28.30), (-15.40, 28.31), (-15.41, 28.31), (-15.41, 28.30)]
+    inward = [(-dlat, 0), (0, -dlng), (dlat, 0), (0, dlng)]
+    coords = []
+    for side, ((lat0, lng0), (lat1, lng1)) in enumerate(zip(corners, corners[1:] + corners[:1])):
+        coords.append([lat0, lng0])
+        for k in range(1, per_edge):
+            t = k / per_edge
+            push = dent_m if k % 2 else 0.0
+            coords.append([lat0 + (lat1 - lat0) * t + inward[side][0] * push, lng0 + (lng1 - lng0) * t + inward[side][1] * push])
+    bump = [-15.41 - dlat * bump_m, 28.305]
+    coords.insert(2 * per_edge + per_edge // 2, bump)
+    return coords, bump
+
+
+class GeofenceSimplificationTests(TrackingTestCase):
+    def test_simplified_fence_never_moves_inward_past_the_bound(self):
+        coords, bump = dented_square()
+        simplified = geometry.simplify_polygon(coords, tolerance_m=10, max_inward_m=1.0)
+        self.assertLess(len(simplified), 10)
+        self.assertEqual(simplified[0], simplified[-1])
+        # The outward bump would be cut off by more than 1 m, so it stays
+        self.assertIn(bump, simplified)
+        fence = Geofence2(coordinates=simplified)
+        fence.update_geometry()
+        for lat, lng in coords:
+            self.assertGreater(fence.boundary_distance_m(lat, lng), -1.0 - 1e-6, (lat, lng))
+
+    def test_small_or_zero_tolerance_keeps_the_polygon(self):
+        coords, _ = dented_square()
+        self.assertEqual(geometry.simplify_polygon(coords, 0), coords)
+        triangle = [[0.0, 0.0], [0.0, 1.0], [1.0, 0.0]]
+        self.assertEqual(geometry.simplify_polygon(triangle, 1000), triangle)
+
+    def test_save_stores_the_precomputed_geometry(self):
+        owner = User.objects.create_user("owner", "owner@example.com", "pw")
+        client = APIClient()
+        client.force_authenticate(owner)
+        coords, _ = dented_square()
+        response = client.post("/api/geofences-api/", {
+            "name": "Paddock", "coordinates": coords, "simplify_tolerance_m": 10,
+        }, format="json")
+        self.assertEqual(response.status_code, 201)
+        fence = Geofence2.objects.get(pk=response.data["id"])
+        ring = geometry.open_ring(fence.coordinates)
+        self.assertEqual(fence.vertex_count, len(ring))
+        self.assertLess(fence.vertex_count, 10)
+        self.assertEqual(
+            (fence.min_lat, fence.max_lat, fence.min_lng, fence.max_lng),
+            (min(p[0] for p in ring), max(p[0] for p in ring), min(p[1] for p in ring), max(p[1] for p in ring)),
+        )
+        # About 1.1 km a side
+        self.assertAlmostEqual(fence.area_m2, 1113 * 1073, delta=0.01 * 1113 * 1073)
+        decoded = geometry.decode_polyline(fence.encoded_polyline)
+        self.assertEqual(len(decoded), len(ring))
+        for (lat, lng), (dlat, dlng) in zip(ring, decoded):
+            self.assertAlmostEqual(lat, dlat, places=5)
+            self.assertAlmostEqual(lng, dlng, places=5)
+
+        Livestock.objects.create(owner=owner, name="Cow", device_id="COW1", animal_type="cow")
+        compact = APIClient().get("/api/devices/cow1/config/", {"compact": 1}).data["geofence"]
+        self.assertEqual((compact["encoded"], compact["vertex_count"]), (fence.encoded_polyline, fence.vertex_count))
+        self.assertNotIn("coordinates", compact)
+
+
+class PositionIndexRefreshTests(TrackingTestCase):
+    """Grids pick up fixes stored by other processes and keep fixes recorded while building"""
+
+    def setUp(self):
+        super().setUp()
+        self.owner = User.objects.create_user("owner", "owner@example.com", "pw")
+        Livestock.objects.create(owner=self.owner, name="Cow", device_id="COW1", animal_type="cow")
+        self.add_fix(-15.41, datetime(2025, 1, 1, 10, tzinfo=dt_timezone.utc))
+
+    def add_fix(self, lat, timestamp):
+        return store(
+            GPSData, device_id="COW1", timestamp=timestamp, latitude=lat, longitude=28.31, speed=0, altitude=0
+        )
+
+    def latitude(self, index):
+        return index.query(self.owner.id, (-180, -85, 180, 85), 20)["points"][0]["latitude"]
+
+    def test_stale_grid_is_rebuilt(self):
+        index = clustering.PositionIndex(refresh_seconds=60)
+        self.assertEqual(self.latitude(index), -15.41)
+        # Stored without record_fix, as another worker would
+        self.add_fix(-15.42, datetime(2025, 1, 1, 10, 5, tzinfo=dt_timezone.utc))
+        self.assertEqual(self.latitude(index), -15.41)
+        index.refresh_seconds = 0
+        self.assertEqual(self.latitude(index), -15.42)
+
+    def test_fix_recorded_during_build_is_kept(self):
+        index = clustering.PositionIndex(refresh_seconds=60)
+        load = clustering._load_latest_positions
+        later = datetime(2025, 1, 1, 11, tzinfo=dt_timezone.utc)
+
+        def load_then_record(owner_id):
+            positions = load(owner_id)
+            index.record_fix(owner_id, "COW1", -15.43, 28.31, True, later)
+            return positions
+
+        with mock.patch.object(clustering, "_load_latest_positions", load_then_record):
+            self.assertEqual(self.latitude(index), -15.43)
+
+
+class AlertPolicyTests(TrackingTestCase):
+    def setUp(self):
+        super().setUp()
+        owner = User.objects.create_user("owner", "owner@example.com", "pw")
+        Livestock.objects.create(owner=owner, name="Cow", device_id="COW1", animal_type="cow")
+        self.policy = AlertPolicy()
+        self.minute = 0
+
+    def trigger(self, cooldown=None):
+        self.minute += 1
+        gps = store(
+            GPSData, device_id="COW1", timestamp=datetime(2025, 1, 1, 10, self.minute, tzinfo=dt_timezone.utc),
+            latitude=-15.41, longitude=28.31, speed=0, altitude=0,
+        )
+        return self.policy.raise_alert(gps, "geofence", "outside", cooldown)
+
+    def test_coalesces_into_the_open_alert(self):
+        first = self.trigger()
+        self.assertIsNone(self.trigger())
+        first.refresh_from_db()
+        self.assertEqual(first.occurrence_count, 2)
+
+    def test_new_alerts_are_rate_limited_per_device(self):
+        burst = alert_setting("RAISE_BURST")
+        raised = []
+        for _ in range(burst + 2):
+            raised.append(self.trigger())
+            self.policy.resolve("COW1", "geofence")
+        # A device flapping in and out of its fence opens at most a burst of alerts
+        self.assertEqual([a is not None for a in raised], [True] * burst + [False] * 2)
+
+    def test_over_the_rate_triggers_coalesce_past_the_cooldown(self):
+        raised = [self.trigger(cooldown=timedelta(0)) for _ in range(alert_setting("RAISE_BURST") + 1)]
+        self.assertIsNone(raised[-1])
+        last = raised[-2]
+        last.refresh_from_db()
+        self.assertEqual(last.occurrence_count, 2)
+
+    def test_alert_resolved_elsewhere_is_not_reused(self):
+        first = self.trigger()
+        # As another process would, without this process seeing a signal
+        Alert.objects.using(first._state.db).filter(pk=first.pk).update(is_resolved=True)
+        second = self.trigger()
+        self.assertIsNotNone(second)
+        self.assertNotEqual(second.pk, first.pk)
+        first.refresh_from_db()
+        self.assertEqual(first.occurrence_count, 1)
+        self.assertIsNone(self.trigger())
+
+
+class CachedAuthenticationTests(TrackingTestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user("owner", "owner@example.com", "pw")
+        OwnerProfile.objects.create(user=self.user, phone_number="123")
+        self.token = AccessToken.for_user(self.user)
+
+    def authenticate(self):
+        return CachedJWTAuthentication().get_user(self.token)
+
+    def test_repeat_requests_reuse_the_user_and_profile(self):
+        with self.assertNumQueries(1):
+            first = self.authenticate()
+            self.assertEqual(first.profile.phone_number, "123")
+        with self.assertNumQueries(0):
+            second = self.authenticate()
+            self.assertEqual(second.profile.phone_number, "123")
+        # Each request gets its own instance
+        second.first_name = "changed"
+        self.assertEqual(self.authenticate().first_name, "")
+
+    def test_saving_the_user_or_profile_evicts_it(self):
+        self.authenticate()
+        self.user.is_active = False
+        self.user.save()
+        with self.assertRaises(AuthenticationFailed):
+            self.authenticate()
+
+        self.user.is_active = True
+        self.user.save()
+        self.authenticate()
+        OwnerProfile.objects.filter(user=self.user).update(phone_number="456")
+        self.assertEqual(self.authenticate().profile.phone_number, "123")
+        profile = OwnerProfile.objects.get(user=self.user)
+        profile.save()
+        self.assertEqual(self.authenticate().profile.phone_number, "456")
+
+    @override_settings(TRACKING_AUTH_CACHE={"TTL_SECONDS": 0})
+    def test_entries_expire(self):
+        self.authenticate()
+        with self.assertNumQueries(1):
+            self.authenticate()
+
+    def test_unknown_user_is_rejected(self):
+        self.user.delete()
+        with self.assertRaises(AuthenticationFailed):
+            self.authenticate()
+
+
+class OwnerProfileUpdateTests(TrackingTestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user("owner", "owner@example.com", "pw")
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def patch(self, data):
+        return self.client.patch("/api/profile/", data, format="json")
+
+    def test_invalid_thresholds_are_rejected(self):
+        for data in (
+            {"speed_limit_kmh": "abc"},
+            {"alert_cooldown_seconds": -1},
+            {"boundary_warning_m": -5},
+            {"min_report_seconds": 0},
+            {"min_report_seconds": 60, "max_report_seconds": 30},
+            {"min_report_seconds": 400},
+        ):
+            response = self.patch(dict(data, first_name="changed"))
+            self.assertEqual(response.status_code, 400, data)
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.first_name, "")
+
+    def test_valid_thresholds_are_saved(self):
+        response = self.patch({"speed_limit_kmh": 25, "min_report_seconds": 10, "max_report_seconds": 60})
+        self.assertEqual(response.status_code, 200)
+        profile = OwnerProfile.objects.get(user=self.user)
+        self.assertEqual((profile.speed_limit_kmh, profile.min_report_seconds, profile.max_report_seconds), (25, 10, 60))
+
+
+class ResponseCacheTests(TrackingTestCase):
+    def setUp(self):
+        super().setUp()
+        self.owner = User.objects.create_user("owner", "owner@example.com", "pw")
+        self.client = APIClient()
+        self.client.force_authenticate(self.owner)
+
+    def overview(self):
+        return [(row["device_id"], row["latest"] and row["latest"]["latitude"]) for row in self.client.get(
+            "/api/status/overview/"
+        ).data]
+
+    def test_api_writes_invalidate_the_overview(self):
+        self.assertEqual(self.overview(), [])
+        response = self.client.post("/api/livestock/", {"name": "Cow", "device_id": "COW1"}, format="json")
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(self.overview(), [("COW1", None)])
+        APIClient().post("/api/gps-data/", {
+            "device_id": "COW1", "timestamp": "2025-01-01T10:00:00Z", "latitude": -15.41, "longitude": 28.31,
+            "speed": 0, "altitude": 1,
+        }, format="json")
+        self.assertEqual(self.overview(), [("COW1", -15.41)])
+
+    def test_workers_share_entries_and_versions(self):
+        self.assertIsInstance(cache.ResponseCache().backend, cache.SQLiteBackend)
+        with tempfile.TemporaryDirectory() as tmp:
+            path = Path(tmp) / "cache.sqlite3"
+            mine, other = cache.SQLiteBackend(path), cache.SQLiteBackend(path)
+            mine.set("key", {"points": 1})
+            self.assertEqual(other.get("key"), {"points": 1})
+            # A write handled by another worker moves the owner on for every worker
+            other.bump_version(self.owner.id)
+            self.assertEqual(mine.get_version(self.owner.id), 1)
+
+
+class ReevaluationQueueTests(TrackingTestCase):
+    def test_rolled_back_edit_does_not_block_later_ones(self):
+        submitted = []
+        executor = mock.Mock(submit=lambda fn, owner_id: submitted.append(owner_id))
+        with mock.patch.object(reevaluation, "_get_executor", return_value=executor):
+            with self.captureOnCommitCallbacks(execute=True):
+                with self.assertRaises(RuntimeError), transaction.atomic():
+                    reevaluation.enqueue_geofence_reevaluation(42)
+                    raise RuntimeError
+            self.assertNotIn(42, reevaluation._queued)
+            with self.captureOnCommitCallbacks(execute=True):
+                reevaluation.enqueue_geofence_reevaluation(42)
+                reevaluation.enqueue_geofence_reevaluation(42)
+        self.assertEqual(submitted, [42])
+
+
+class GPSIngestTests(TrackingTestCase):
+    FENCE = [[-15.40, 28.30], [-15.40, 28.32], [-15.42, 28.32], [-15.42, 28.30]]
+
+    def setUp(self):
+        super().setUp()
+        owner = User.objects.create_user("owner", "owner@example.com", "pw")
+        Livestock.objects.create(owner=owner, name="Cow", device_id="COW1", animal_type="cow")
+        Geofence2.objects.create(owner=owner, name="Paddock", coordinates=self.FENCE, is_active=True)
+
+    def post(self, lat, timestamp, device_id="COW1"):
+        return APIClient().post("/api/gps-data/", {
+            "device_id": device_id, "timestamp": timestamp, "latitude": lat, "longitude": 28.31,
+            "speed": 0, "altitude": 1,
+        }, format="json")
+
+    def test_retried_fix_reports_the_stored_geofence_state(self):
+        for lat, timestamp, inside in ((-15.41, "2025-01-01T10:00:00Z", True), (-15.45, "2025-01-01T12:00:00Z", False)):
+            self.assertEqual(self.post(lat, timestamp).data["inside_geofence"], inside)
+            retry = self.post(lat, timestamp).data
+            self.assertEqual(retry["status"], "duplicate")
+            self.assertEqual(retry["inside_geofence"], inside)
+        # Retries are matched by the stored device id, whatever the case sent
+        self.assertEqual(self.post(-15.41, "2025-01-01T10:00:00Z", "cow1").data["inside_geofence"], True)
+
+
+class PositionClusterViewTests(TrackingTestCase):
+    def setUp(self):
+        super().setUp()
+        self.owner = User.objects.create_user("owner", "owner@example.com", "pw")
+        Livestock.objects.create(owner=self.owner, name="Cow", device_id="COW1", animal_type="cow")
+        APIClient().post("/api/gps-data/", {
+            "device_id": "COW1", "timestamp": "2025-01-01T10:00:00Z", "latitude": -15.41,
+            "longitude": 28.31, "speed": 0, "altitude": 1,
+        }, format="json")
+        self.client = APIClient()
+        self.client.force_authenticate(self.owner)
+
+    def get(self, bbox, zoom):
+        return self.client.get("/api/status/clusters/", {"bbox": bbox, "zoom": zoom})
+
+    def test_non_finite_bbox_and_bad_zoom_are_rejected(self):
+        for bbox, zoom in (
+            ("nan,-90,180,90", 3), ("-180,-inf,180,90", 3), ("-180,-90,180,1e999", 3),
+            ("-180,-90,180,90", -1), ("-180,-90,180,90", 99), ("-180,-90,180", 3),
+        ):
+            self.assertEqual(self.get(bbox, zoom).status_code, 400, (bbox, zoom))
+
+    def test_out_of_range_bbox_is_clamped(self):
+        clusters = self.get("-1000,-1000,1000,1000", 3).data["clusters"]
+        self.assertEqual([c["count"] for c in clusters], [1])
+        points = self.get("-1000,-1000,1000,1000", 20).data["points"]
+        self.assertEqual([p["device_id"] for p in points], ["COW1"])
+
+
+class NoiseFilterTests(TrackingTestCase):
+    START = datetime(2025, 1, 1, 10, tzinfo=dt_timezone.utc)
+
+    def noisy_walk(self, rng, fixes=120, sigma_m=8.0):
+        """A cow walking north at 1 m/s, reported every second with GPS noise"""
+        dlat = 1 / 111320
+        return [
+            (self.START + timedelta(seconds=i), -15.41 + i * dlat + rng.gauss(0, sigma_m) * dlat, 28.31)
+            for i in range(fixes)
+        ]
+
+    def test_filter_reduces_jitter(self):
+        track = self.noisy_walk(random.Random(39))
+        tracker = smoothing.NoiseFilter()
+        results = [tracker.update("COW1", lat, lng, t) for t, lat, lng in track]
+        truth = [-15.41 + i / 111320 for i in range(len(track))]
+        raw_error = sum(abs(lat - true) for (_, lat, _), true in zip(track[30:], truth[30:]))
+        filtered_error = sum(abs(r.latitude - true) for r, true in zip(results[30:], truth[30:]))
+        self.assertLess(filtered_error, raw_error * 0.7)
+        self.assertFalse(any(r.outlier for r in results))
+        self.assertAlmostEqual(results[-1].speed_kmh, 3.6, delta=1.0)
+
+    def test_jumps_are_outliers_until_a_run_restarts_the_track(self):
+        tracker = smoothing.NoiseFilter()
+        for i in range(5):
+            tracker.update("COW1", -15.41, 28.31, self.START + timedelta(seconds=10 * i))
+        jump = tracker.update("COW1", -15.45, 28.31, self.START + timedelta(seconds=50))
+        self.assertTrue(jump.outlier)
+        # The filter coasts on its prediction instead of following the jump
+        self.assertAlmostEqual(jump.latitude, -15.41, places=4)
+        self.assertFalse(tracker.update("COW1", -15.41, 28.31, self.START + timedelta(seconds=60)).outlier)
+
+        for i in range(smoothing.smoothing_setting("MAX_REJECTS")):
+            self.assertTrue(tracker.update("COW1", -15.45, 28.31, self.START + timedelta(seconds=70 + 10 * i)).outlier)
+        restarted = tracker.update("COW1", -15.45, 28.31, self.START + timedelta(seconds=200))
+        self.assertEqual((restarted.latitude, restarted.outlier), (-15.45, False))
+
+        late = tracker.update("COW1", -15.30, 28.31, self.START)
+        self.assertEqual((late.latitude, late.outlier), (-15.30, False))
+
+    def test_vectorized_filter_matches_the_streaming_one(self):
+        if smoothing.np is None:
+            self.skipTest("numpy is not installed")
+        np = smoothing.np
+        rng = random.Random(40)
+        tracks = [self.noisy_walk(rng, fixes) for fixes in (120, 35, 2)]
+        tracks[1][20] = (tracks[1][20][0], -15.60, 28.31)
+        inputs = [
+            (np.array([t.timestamp() for t, _, _ in track]), np.array([lat for _, lat, _ in track]),
+             np.array([lng for _, _, lng in track]))
+            for track in tracks
+        ]
+        for track, (flat, flng, outlier) in zip(tracks, smoothing.filter_tracks(inputs)):
+            tracker = smoothing.NoiseFilter()
+            expected = [tracker.update("COW1", lat, lng, t) for t, lat, lng in track]
+            np.testing.assert_allclose(flat, [r.latitude for r in expected], rtol=0, atol=1e-9)
+            np.testing.assert_allclose(flng, [r.longitude for r in expected], rtol=0, atol=1e-9)
+            self.assertEqual(outlier.tolist(), [r.outlier for r in expected])
+
+    def test_ingest_stores_filtered_positions_and_ignores_outlier_crossings(self):
+        owner = User.objects.create_user("owner", "owner@example.com", "pw")
+        Livestock.objects.create(owner=owner, name="Cow", device_id="COW1", animal_type="cow")
+        Geofence2.objects.create(owner=owner, name="Paddock", coordinates=GPSIngestTests.FENCE, is_active=True)
+        for i, lat in enumerate((-15.41, -15.41, -15.41, -15.45)):
+            APIClient().post("/api/gps-data/", {
+                "device_id": "COW1", "timestamp": (self.START + timedelta(seconds=10 * i)).isoformat(),
+                "latitude": lat, "longitude": 28.31, "speed": 0, "altitude": 1,
+            }, format="json")
+        db = sharding.db_for_device("COW1")
+        stored = list(GPSData.objects.using(db).filter(device_id="COW1").order_by("timestamp"))
+        self.assertEqual([f.is_outlier for f in stored], [False, False, False, True])
+        self.assertTrue(all(f.filtered_latitude is not None for f in stored))
+        # Judged on the filtered position, the jump outside the fence raises nothing
+        self.assertTrue(stored[-1].inside_geofence)
+        self.assertFalse(Alert.objects.using(db).filter(alert_type="geofence").exists())
+
+
+class BoundaryWarningTests(TrackingTestCase):
+    def setUp(self):
+        super().setUp()
+        owner = User.objects.create_user("owner", "owner@example.com", "pw")
+        Livestock.objects.create(owner=owner, name="Cow", device_id="COW1", animal_type="cow")
+        self.fence = Geofence2.objects.create(
+            owner=owner, name="Paddock", coordinates=GPSIngestTests.FENCE, is_active=True
+        )
+
+    def post(self, lat, timestamp):
+        return APIClient().post("/api/gps-data/", {
+            "device_id": "COW1", "timestamp": timestamp, "latitude": lat, "longitude": 28.31,
+            "speed": 0, "altitude": 1,
+        }, format="json")
+
+    def boundary_alerts(self):
+        gps = GPSData.objects.using(sharding.db_for_device("COW1")).filter(device_id="COW1")
+        return Alert.objects.using(sharding.db_for_device("COW1")).filter(gps_data__in=gps, alert_type="boundary")
+
+    def test_distance_is_signed_metres_to_the_nearest_edge(self):
+        # The north edge runs along lat -15.40; 0.0005 degrees of latitude is about 55 m
+        self.assertAlmostEqual(self.fence.boundary_distance_m(-15.4005, 28.31), 55.6, delta=1)
+        self.assertAlmostEqual(self.fence.boundary_distance_m(-15.3995, 28.31), -55.6, delta=1)
+        self.assertIsNone(Geofence2(coordinates=[[0, 0], [0, 1]]).boundary_distance_m(0, 0))
+
+    def test_near_edge_fix_warns_until_well_inside(self):
+        self.post(-15.4001, "2025-01-01T10:00:00Z")
+        stored = GPSData.objects.using(sharding.db_for_device("COW1")).get(device_id="COW1")
+        self.assertTrue(stored.inside_geofence)
+        self.assertAlmostEqual(stored.boundary_distance_m, 11.1, delta=1)
+        alert = self.boundary_alerts().get()
+        self.assertFalse(alert.is_resolved)
+
+        self.post(-15.41, "2025-01-01T11:00:00Z")
+        alert.refresh_from_db()
+        self.assertTrue(alert.is_resolved)
+
+    def test_ingest_reuses_the_fence_edges(self):
+        with mock.patch("tracking.geometry.EdgeSet", wraps=geometry.EdgeSet) as built:
+            for minute in range(3):
+                self.post(-15.41, f"2025-01-01T10:0{minute}:00Z")
+        self.assertEqual(built.call_count, 1)
+
+
+class LivePositionSocketTests(TrackingTestCase):
+    def setUp(self):
+        super().setUp()
+        self.owner = User.objects.create_user("owner", "owner@example.com", "pw")
+        Livestock.objects.create(owner=self.owner, name="Cow", device_id="COW1", animal_type="cow")
+
+    async def connect(self, token, on_subscribe=None):
+        """Run the socket until it sends a positions frame or closes; return what it sent"""
+        incoming = asyncio.Queue()
+        sent = []
+        done = asyncio.Event()
+
+        async def subscribed():
+            while not live_hub._subscribers:
+                await asyncio.sleep(0)
+            await on_subscribe()
+
+        async def send(message):
+            sent.append(message)
+            if message["type"] == "websocket.accept" and on_subscribe:
+                asyncio.ensure_future(subscribed())
+            if message["type"] in ("websocket.send", "websocket.close"):
+                done.set()
+
+        await incoming.put({"type": "websocket.connect"})
+        scope = {"type": "websocket", "path": "/ws/positions/", "query_string": f"token={token}".encode()}
+        socket = asyncio.ensure_future(positions_socket(scope, incoming.get, send))
+        await asyncio.wait_for(done.wait(), 5)
+        await incoming.put({"type": "websocket.disconnect"})
+        await asyncio.wait_for(socket, 5)
+        return sent
+
+    def test_connected_owner_receives_published_fix(self):
+        def post():
+            APIClient().post("/api/gps-data/", {
+                "device_id": "COW1", "timestamp": "2025-01-01T10:00:00Z", "latitude": -15.41,
+                "longitude": 28.31, "speed": 3, "altitude": 1,
+            }, format="json")
+
+        sent = async_to_sync(self.connect)(AccessToken.for_user(self.owner), sync_to_async(post))
+        self.assertEqual(sent[0]["type"], "websocket.accept")
+        frame = json.loads(sent[1]["text"])
+        self.assertEqual(frame["type"], "positions")
+        self.assertEqual(frame["positions"], [{
+            "d": "COW1", "la": -15.41, "lo": 28.31, "s": 3.0,
+            "t": int(datetime(2025, 1, 1, 10, tzinfo=dt_timezone.utc).timestamp()), "in": False,
+        }])
+        # The subscription goes away with the connection
+        self.assertEqual(live_hub._subscribers, {})
+
+    def test_bad_token_is_closed(self):
+        sent = async_to_sync(self.connect)("garbage")
+        self.assertEqual(sent, [{"type": "websocket.close", "code": 4401}])
+
+
+class LivenessCheckTests(TrackingTestCase):
+    def test_silent_device_goes_offline_without_new_fixes(self):
+        owner = User.objects.create_user("owner", "owner@example.com", "pw")
+        Livestock.objects.create(owner=owner, name="Cow", device_id="COW1", animal_type="cow")
+        gps = store(
+            GPSData, device_id="COW1", timestamp=datetime(2025, 1, 1, 10, tzinfo=dt_timezone.utc),
+            latitude=-15.41, longitude=28.31, speed=0, altitude=0,
+        )
+        # The state a previous process left behind
+        DeviceLiveness.objects.create(
+            device_id="COW1", owner=owner, last_seen=timezone.now() - timedelta(hours=1), last_fix_id=gps.pk,
+            is_online=True, changed_at=timezone.now() - timedelta(hours=1),
+        )
+        monitor = LivenessMonitor()
+        self.assertEqual(monitor.check_offline(), 1)
+        self.assertFalse(DeviceLiveness.objects.get(device_id="COW1").is_online)
+        self.assertTrue(Alert.objects.using(gps._state.db).filter(alert_type="offline", gps_data=gps).exists())
+        self.assertEqual(monitor.check_offline(), 0)
+
+
+class LivenessTimerTests(TrackingTestCase):
+    def setUp(self):
+        super().setUp()
+        self.owner = User.objects.create_user("owner", "owner@example.com", "pw")
+        self.monitor = LivenessMonitor()
+        # No timer thread: the tests pop the heap themselves
+        self.monitor._thread = mock.Mock()
+
+    def touch(self, at):
+        gps = mock.Mock(device_id="COW1", pk=None)
+        with mock.patch("tracking.liveness.timezone.now", return_value=at):
+            self.monitor.touch(gps, self.owner.id)
+
+    def test_one_heap_entry_per_device(self):
+        start = timezone.now()
+        for second in range(100):
+            self.touch(start + timedelta(seconds=second))
+        self.assertEqual(len(self.monitor._heap), 1)
+        first_deadline = self.monitor._heap[0][0]
+        last_deadline = first_deadline + 99
+
+        with self.monitor._cond:
+            self.assertEqual(self.monitor._expired(first_deadline + 1), [])
+            self.assertEqual([entry[0] for entry in self.monitor._heap], [last_deadline])
+            self.assertEqual([device for device, _ in self.monitor._expired(last_deadline)], ["COW1"])
+        self.assertEqual(self.monitor._heap, [])
+
+    def test_start_does_not_query(self):
+        monitor = LivenessMonitor()
+        with mock.patch("tracking.liveness.threading.Thread") as thread, self.assertNumQueries(0):
+            monitor.start()
+        thread.return_value.start.assert_called_once_with()
+
+    def test_warming_waits_for_the_table(self):
+        DeviceLiveness.objects.create(
+            device_id="COW1", owner=self.owner, last_seen=timezone.now(), is_online=True, changed_at=timezone.now(),
+        )
+        rows = DeviceLiveness.objects.values_list
+        missing = OperationalError("no such table: tracking_deviceliveness")
+        with mock.patch.object(DeviceLiveness.objects, "values_list", side_effect=[missing, rows(
+            "device_id", "owner_id", "last_seen", "last_fix_id", "is_online"
+        )]), mock.patch("tracking.liveness.time.sleep") as sleep:
+            self.monitor._warm_when_ready()
+        sleep.assert_called_once()
+        self.assertEqual(len(self.monitor._heap), 1)
+
+
+class OwnerLookupCacheTests(TrackingTestCase):
+    def test_unknown_device_is_found_once_registered_elsewhere(self):
+        self.assertIsNone(devices.owner_id_for_device("cow1"))
+        owner = User.objects.create_user("owner", "owner@example.com", "pw")
+        # Registered by another process: this one's cache is not cleared
+        with mock.patch("tracking.signals.forget_devices"):
+            Livestock.objects.create(owner=owner, name="Cow", device_id="COW1", animal_type="cow")
+        self.assertIsNone(devices.owner_id_for_device("cow1"))
+        later = time.monotonic() + devices.UNKNOWN_DEVICE_TTL_SECONDS + 1
+        with mock.patch.object(devices.time, "monotonic", return_value=later):
+            self.assertEqual(devices.owner_id_for_device("cow1"), owner.id)
+
+    def move_elsewhere(self, commit):
+        """Give COW1 to another owner as another process would: this one's cache is not cleared"""
+        owner, other = (User.objects.create_user(name, f"{name}@example.com", "pw") for name in ("owner", "other"))
+        cow = Livestock.objects.create(owner=owner, name="Cow", device_id="COW1", animal_type="cow")
+        self.assertEqual(devices.owner_id_for_device("cow1"), owner.id)
+        with mock.patch("tracking.signals.forget_devices"), mock.patch("tracking.devices.forget_devices"):
+            with self.captureOnCommitCallbacks(execute=commit):
+                cow.owner = other
+                cow.save()
+        self.assertEqual(devices.owner_id_for_device("cow1"), owner.id)
+        return other
+
+    def test_moved_device_is_dropped_once_the_registry_version_moves(self):
+        other = self.move_elsewhere(commit=True)
+        later = time.monotonic() + devices.REGISTRY_CHECK_SECONDS + 1
+        with mock.patch.object(devices.time, "monotonic", return_value=later):
+            self.assertEqual(devices.owner_id_for_device("cow1"), other.id)
+
+    def test_registry_reads_refresh_the_cached_owner(self):
+        other = self.move_elsewhere(commit=False)
+        self.assertEqual(devices.lookup_device("cow1").owner_id, other.id)
+        self.assertEqual(devices.owner_id_for_device("cow1"), other.id)
+
+    def test_ingest_routes_a_moved_device_to_its_new_owner(self):
+        other = self.move_elsewhere(commit=False)
+        # Over the speed limit, so the fix raises an alert
+        APIClient().post("/api/gps-data/", {
+            "device_id": "COW1", "timestamp": "2025-01-01T10:00:00Z", "latitude": -15.41, "longitude": 28.31,
+            "speed": 200, "altitude": 1,
+        }, format="json")
+        alert = Alert.objects.using(sharding.db_for_owner(other.id)).get(alert_type="speed")
+        self.assertEqual(alert.owner_id, other.id)
+
+    def test_cached_owner_expires(self):
+        other = self.move_elsewhere(commit=False)
+        later = time.monotonic() + devices.OWNER_ID_TTL_SECONDS + 1
+        with mock.patch.object(devices.time, "monotonic", return_value=later):
+            self.assertEqual(devices.owner_id_for_device("cow1"), other.id)
+
+
+class HeatmapViewTests(TrackingTestCase):
+    def setUp(self):
+        super().setUp()
+        self.owner = User.objects.create_user("owner", "owner@example.com", "pw")
+        Livestock.objects.create(owner=self.owner, name="Cow", device_id="COW1", animal_type="cow")
+        self.client = APIClient()
+        self.client.force_authenticate(self.owner)
+
+    def get(self, **params):
+        params = dict({"devices": "COW1", "from": "2025-01-01T00:00:00", "to": "2025-01-02T00:00:00"}, **params)
+        return self.client.get("/api/analytics/heatmap/", params)
+
+    def test_non_finite_cell_size_is_rejected(self):
+        for cell_m in ("nan", "inf", "-inf", "0", "-5"):
+            self.assertEqual(self.get(cell_m=cell_m).status_code, 400, cell_m)
+
+    def test_old_range_shows_late_uploads(self):
+        if heatmap.np is None:
+            self.skipTest("numpy is not installed")
+        self.assertEqual(self.get().data["points"], 0)
+        APIClient().post("/api/gps-data/", {
+            "device_id": "COW1", "timestamp": "2025-01-01T10:00:00Z", "latitude": -15.41, "longitude": 28.31,
+            "speed": 0, "altitude": 1,
+        }, format="json")
+        self.assertEqual(self.get().data["points"], 1)
+
+
+class ListenerParseTests(SimpleTestCase):
+    def test_non_finite_and_out_of_range_values_are_malformed(self):
+        for line in (
+            "AA,5,1,2,inf", "AA,5,1,2,0,nan", "AA,5,nan,2", "AA,1e20,1,2", "AA,inf,1,2", "AA,nan,1,2",
+            '{"device_id": "AA", "timestamp": 5, "latitude": 1, "longitude": 2, "speed": NaN}',
+        ):
+            with self.assertRaises(ValueError, msg=line):
+                listener.parse_fix(line)
+
+    def test_valid_lines_parse(self):
+        fix = listener.parse_fix("AA,1735725600,-15.41,28.31,12.5")
+        self.assertEqual((fix["speed"], fix["altitude"]), (12.5, 0.0))
+        self.assertEqual(fix["timestamp"], datetime(2025, 1, 1, 10, tzinfo=dt_timezone.utc))
+
+    def test_malformed_lines_do_not_drop_the_rest_of_the_datagram(self):
+        telemetry = listener.TelemetryListener(batch_size=100)
+        telemetry._wakeup = mock.Mock()
+        telemetry.feed(b"AA,1e20,1,2\nAA,5,1,2,inf\nAA,5,1,2\n")
+        self.assertEqual(telemetry.stats["malformed"], 2)
+        self.assertEqual(len(telemetry._pending), 1)
+
+
+class ListenerWriteTests(TrackingTestCase):
+    def setUp(self):
+        super().setUp()
+        owner = User.objects.create_user("owner", "owner@example.com", "pw")
+        Livestock.objects.create(owner=owner, name="Cow", device_id="COW1", animal_type="cow")
+
+    def test_owner_lookups_run_outside_the_stats_lock(self):
+        def lookup(device_id):
+            self.assertFalse(ingest_stats.lock.locked())
+            return real(device_id)
+
+        real = listener.owner_id_for_device
+        telemetry = listener.TelemetryListener(batch_size=100)
+        batch = [listener.parse_fix(line) for line in ("COW1,1735725600,-15.41,28.31", "GHOST,1735725600,-15.41,28.31")]
+        with mock.patch("tracking.listener.owner_id_for_device", side_effect=lookup) as looked_up:
+            telemetry.write_batch(batch)
+        self.assertEqual(looked_up.call_count, 2)
+        self.assertEqual((telemetry.stats["stored"], telemetry.stats["unknown_device"]), (1, 1))
+
+
+class BulkAlertTests(TrackingTestCase):
+    def setUp(self):
+        super().setUp()
+        self.owner = User.objects.create_user("owner", "owner@example.com", "pw")
+        Livestock.objects.create(owner=self.owner, name="Cow", device_id="COW1", animal_type="cow")
+        gps = store(
+            GPSData, device_id="COW1", timestamp=datetime(2025, 1, 1, 10, tzinfo=dt_timezone.utc),
+            latitude=-15.41, longitude=28.31, speed=0, altitude=0,
+        )
+        self.alert = store(Alert, gps_data=gps, owner=self.owner, alert_type="geofence", message="outside")
+        self.alerts = Alert.objects.using(self.alert._state.db)
+        self.client = APIClient()
+        self.client.force_authenticate(self.owner)
+
+    def test_empty_selections_are_rejected(self):
+        for body in ({"filter": {}}, {"filter": {"type": ""}}, {"ids": [True]}, {"ids": [self.alert.pk, False]}):
+            response = self.client.post("/api/alerts/bulk-delete/", body, format="json")
+            self.assertEqual(response.status_code, 400, body)
+        self.assertTrue(self.alerts.filter(pk=self.alert.pk).exists())
+
+    def test_filter_with_a_criterion_applies(self):
+        response = self.client.post("/api/alerts/bulk-delete/", {"filter": {"type": "geofence"}}, format="json")
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(self.alerts.filter(pk=self.alert.pk).exists())
+
+
+def grazing_track(pattern, fixes=240, step_minutes=2):
+    """Epoch seconds and positions from 08:00 on 2025-03-01, one fix per `step_minutes`"""
+    start = datetime(2025, 3, 1, 8, tzinfo=dt_timezone.utc).timestamp()
+    t = [start + i * step_minutes * 60 for i in range(fixes)]
+    if pattern == "resting":
+        lats = [-15.41] * fixes
+    elif pattern == "grazing":
+        # Back and forth: ~11 m per fix, going nowhere
+        lats = [-15.41 + (0.0001 if i % 2 else 0.0) for i in range(fixes)]
+    else:
+        # Straight line, ~0.55 m/s
+        lats = [-15.41 + 0.0006 * i for i in range(fixes)]
+    return t, lats, [28.31] * fixes
+
+
+class LivestockBehaviourTests(TrackingTestCase):
+    def setUp(self):
+        super().setUp()
+        if behaviour.np is None:
+            self.skipTest("numpy is not installed")
+        self.np = behaviour.np
+        self.owner = User.objects.create_user("owner", "owner@example.com", "pw")
+        self.client = APIClient()
+        self.client.force_authenticate(self.owner)
+
+    def record(self, owner, device_id, pattern):
+        animal = Livestock.objects.create(owner=owner, name=device_id.title(), device_id=device_id, animal_type="cow")
+        t, lats, lngs = grazing_track(pattern)
+        GPSData.objects.using(sharding.db_for_device(device_id)).bulk_create([
+            GPSData(
+                device_id=device_id, timestamp=datetime.fromtimestamp(ts, dt_timezone.utc),
+                latitude=lat, longitude=lng, speed=0, altitude=0,
+            )
+            for ts, lat, lng in zip(t, lats, lngs)
+        ])
+        return animal
+
+    def test_states_follow_the_movement_pattern(self):
+        np = self.np
+        for pattern, state in (("resting", behaviour.RESTING), ("grazing", behaviour.GRAZING), ("walking", behaviour.WALKING)):
+            states, minutes, _ = behaviour.classify_track(*(np.array(c) for c in grazing_track(pattern, fixes=30)))
+            self.assertTrue((states[1:] == state).all(), (pattern, states))
+            self.assertEqual(minutes[-1], 0.0)
+
+    def test_reporting_gaps_count_as_neither_time_nor_distance(self):
+        np = self.np
+        t, lats, lngs = grazing_track("resting", fixes=4)
+        t[2:] = [ts + 6 * 3600 for ts in t[2:]]
+        lats[2:] = [lat + 0.01 for lat in lats[2:]]
+        summary = behaviour.summarize_track(np.array(t), np.array(lats), np.array(lngs))
+        self.assertEqual(summary["observed_minutes"], 2 + behaviour.behaviour_setting("MAX_GAP_MINUTES") + 2)
+        self.assertEqual(summary["distance_m"], 0.0)
+
+    def test_day_summaries_are_stored_per_owner_and_flag_idle_animals(self):
+        idle = self.record(self.owner, "COW1", "resting")
+        grazer = self.record(self.owner, "COW2", "grazing")
+        other = User.objects.create_user("other", "other@example.com", "pw")
+        self.record(other, "COW3", "walking")
+
+        day = datetime(2025, 3, 1).date()
+        rows = behaviour.compute_activity_day(day, owner_id=self.owner.id)
+        self.assertEqual([r.livestock_id for r in rows], [idle.id, grazer.id])
+        by_animal = {r.livestock_id: r for r in LivestockActivityDay.objects.filter(date=day)}
+        self.assertEqual(set(by_animal), {idle.id, grazer.id})
+        self.assertEqual((by_animal[idle.id].anomaly_reason, by_animal[idle.id].activity_index), ("barely_moved", 0.0))
+        self.assertFalse(by_animal[grazer.id].is_anomaly)
+        self.assertAlmostEqual(by_animal[grazer.id].grazing_minutes, 239 * 2 - 2, delta=2)
+
+        # Recomputing replaces the day's rows
+        behaviour.compute_activity_day(day, owner_id=self.owner.id)
+        self.assertEqual(LivestockActivityDay.objects.filter(date=day).count(), 2)
+
+        response = self.client.get("/api/livestock/activity/", {"anomalies": 1})
+        self.assertEqual(response.data["date"], day)
+        self.assertEqual([a["livestock_name"] for a in response.data["animals"]], ["Cow1"])
+        self.assertEqual(self.client.get("/api/livestock/activity/", {"date": "March"}).status_code, 400)
+
+        history = self.client.get(f"/api/livestock/{grazer.id}/activity/", {"days": 100000})
+        self.assertEqual([row["date"] for row in history.data], ["2025-03-01"])
+        other_animal = Livestock.objects.get(device_id="COW3")
+        self.assertEqual(self.client.get(f"/api/livestock/{other_animal.id}/activity/").status_code, 404)
+
+
+class CursorTests(SimpleTestCase):
+    def test_round_trip(self):
+        created_at = datetime(2025, 1, 1, 10, 0, 0, 123456, tzinfo=dt_timezone.utc)
+        self.assertEqual(pagination.decode_cursor(pagination.encode_cursor(created_at, 42)), (created_at, 42))
+
+    def test_garbage_is_rejected(self):
+        for raw in (
+            b"no separator", b"2025-01-01T10:00:00|x", b"yesterday|5", b"2025-01-01T10:00:00|5|6", b"\xff\xfe|5",
+        ):
+            with self.assertRaises(ValueError, msg=raw):
+                pagination.decode_cursor(base64.urlsafe_b64encode(raw).decode().rstrip("="))
+        for cursor in ("", "!!!", "a"):
+            with self.assertRaises(ValueError, msg=cursor):
+                pagination.decode_cursor(cursor)
+
+
+class AlertPageTests(TrackingTestCase):
+    def setUp(self):
+        super().setUp()
+        self.owner = User.objects.create_user("owner", "owner@example.com", "pw")
+        Livestock.objects.create(owner=self.owner, name="Cow", device_id="COW1", animal_type="cow")
+        self.client = APIClient()
+        self.client.force_authenticate(self.owner)
+
+    def alert(self, owner, minute, alert_type="geofence", device_id="COW1"):
+        gps = store(
+            GPSData, device_id=device_id, timestamp=datetime(2025, 1, 1, 10, minute, tzinfo=dt_timezone.utc),
+            latitude=-15.41, longitude=28.31, speed=0, altitude=0,
+        )
+        return store(Alert, gps_data=gps, owner=owner, alert_type=alert_type, message="outside")
+
+    def pages(self, limit, **params):
+        ids, cursor = [], None
+        while True:
+            response = self.client.get("/api/alerts/", dict(params, limit=limit, **({"cursor": cursor} if cursor else {})))
+            self.assertEqual(response.status_code, 200)
+            ids.append([row["id"] for row in response.data])
+            cursor = response.get("X-Next-Cursor")
+            if not cursor:
+                return ids
+
+    def test_pages_cover_every_alert_once_across_created_at_ties(self):
+        alerts = [self.alert(self.owner, minute) for minute in range(7)]
+        tie = timezone.now() + timedelta(hours=1)
+        Alert.objects.using(alerts[0]._state.db).filter(pk__in=[a.pk for a in alerts[1:5]]).update(created_at=tie)
+        other = User.objects.create_user("other", "other@example.com", "pw")
+        Livestock.objects.create(owner=other, name="Cow", device_id="COW9", animal_type="cow")
+        self.alert(other, 0, device_id="COW9")
+
+        pages = self.pages(2)
+        self.assertEqual([len(page) for page in pages], [2, 2, 2, 1])
+        newest_first = Alert.objects.using(alerts[0]._state.db).filter(owner=self.owner).order_by("-created_at", "-id")
+        self.assertEqual(sum(pages, []), list(newest_first.values_list("pk", flat=True)))
+        # The tied alerts come first, split across pages by id
+        self.assertEqual(sum(pages, [])[:4], sorted((a.pk for a in alerts[1:5]), reverse=True))
+
+    def test_filters_and_bad_parameters(self):
+        self.alert(self.owner, 0, "speed")
+        resolved = self.alert(self.owner, 1)
+        self.client.post(f"/api/alerts/{resolved.pk}/resolve/")
+        self.assertEqual(len(sum(self.pages(10), [])), 1)
+        self.assertEqual(sum(self.pages(10, resolved="all", type="geofence"), []), [resolved.pk])
+        for params in ({"cursor": "garbage"}, {"limit": "x"}, {"resolved": "maybe"}, {"before": "soon"}):
+            self.assertEqual(self.client.get("/api/alerts/", params).status_code, 400, params)
+
+    def test_counts_follow_every_kind_of_change(self):
+        def counts():
+            response = self.client.get("/api/alerts/counts/").data
+            open_alerts = Alert.objects.using(sharding.db_for_owner(self.owner.id)).filter(
+                owner=self.owner, is_resolved=False
+            )
+            self.assertEqual(response["total"], open_alerts.count())
+            return {t: n for t, n in response.items() if n and t != "total"}
+
+        self.assertEqual(counts(), {})
+        first = self.alert(self.owner, 0)
+        self.alert(self.owner, 1)
+        speed = self.alert(self.owner, 2, "speed")
+        self.assertEqual(counts(), {"geofence": 2, "speed": 1})
+        self.client.post(f"/api/alerts/{first.pk}/resolve/")
+        self.assertEqual(counts(), {"geofence": 1, "speed": 1})
+        self.client.post("/api/alerts/bulk-resolve/", {"filter": {"type": "geofence"}}, format="json")
+        self.assertEqual(counts(), {"speed": 1})
+        self.client.post("/api/alerts/bulk-delete/", {"ids": [speed.pk]}, format="json")
+        self.assertEqual(counts(), {})
+
+
+class TrackEncodingTests(SimpleTestCase):
+    def track(self, rng, n=200):
+        start = datetime(2025, 1, 1, 10, tzinfo=dt_timezone.utc)
+        lat, lng = -15.41, -28.31
+        rows = []
+        for i in range(n):
+            lat += rng.uniform(-0.001, 0.001)
+            lng += rng.uniform(-0.001, 0.001)
+            rows.append((start + timedelta(seconds=i * 7 + rng.random()), lat, lng, rng.choice([None, rng.uniform(0, 60)])))
+        return rows
+
+    def test_round_trip_within_the_precision(self):
+        rng = random.Random(48)
+        rows = self.track(rng)
+        for precision in (1, 5, 7):
+            track = track_encoding.encode_rows(iter(rows), precision)
+            self.assertEqual((track["points"], track["precision"]), (len(rows), precision))
+            decoded = track_encoding.decode_track(track)
+            self.assertEqual(len(decoded), len(rows))
+            for (t, lat, lng, speed), (timestamp, rlat, rlng, rspeed) in zip(decoded, rows):
+                self.assertEqual(t, int(timestamp.timestamp()))
+                self.assertLessEqual(abs(lat - rlat), 0.5 / 10 ** precision + 1e-12)
+                self.assertLessEqual(abs(lng - rlng), 0.5 / 10 ** precision + 1e-12)
+                self.assertLessEqual(abs(speed - (rspeed or 0.0)), 0.05 + 1e-9)
+
+    def test_empty_track_and_precision_bounds(self):
+        self.assertEqual(track_encoding.decode_track(track_encoding.encode_rows([])), [])
+        self.assertEqual(track_encoding.parse_precision(None), track_encoding.encoding_setting("PRECISION"))
+        self.assertEqual(track_encoding.parse_precision("7"), 7)
+        for value in ("0", "8", "-1", "x", "5.5"):
+            with self.assertRaises(ValueError, msg=value):
+                track_encoding.parse_precision(value)
+
+    def test_tracks_split_by_device(self):
+        rng = random.Random(4)
+        a, b = self.track(rng, 5), self.track(rng, 3)
+        tracks = track_encoding.encode_tracks([("A",) + row for row in a] + [("B",) + row for row in b])
+        self.assertEqual({d: t["points"] for d, t in tracks.items()}, {"A": 5, "B": 3})
+        self.assertEqual(tracks["B"], track_encoding.encode_rows(b))
+
+
+class EncodedTrackViewTests(TrackingTestCase):
+    def setUp(self):
+        super().setUp()
+        self.owner = User.objects.create_user("owner", "owner@example.com", "pw")
+        Livestock.objects.create(owner=self.owner, name="Cow", device_id="COW1", animal_type="cow")
+        other = User.objects.create_user("other", "other@example.com", "pw")
+        Livestock.objects.create(owner=other, name="Cow", device_id="COW9", animal_type="cow")
+        now = timezone.now().replace(microsecond=0)
+        for device_id in ("COW1", "COW9"):
+            for i in range(5):
+                store(
+                    GPSData, device_id=device_id, timestamp=now - timedelta(minutes=10 - i),
+                    latitude=-15.41 + 0.0001 * i, longitude=28.31, speed=1.5 * i, altitude=0, is_outlier=i == 4,
+                )
+        self.client = APIClient()
+        self.client.force_authenticate(self.owner)
+
+    def test_encoded_history_matches_the_plain_one(self):
+        plain = self.client.get("/api/devices/cow1/history/").data
+        encoded = self.client.get("/api/devices/cow1/history/", {"encoded": 1, "precision": 6}).data
+        self.assertEqual((encoded["device_id"], encoded["points"]), ("COW1", len(plain)))
+        for (t, lat, lng, speed), row in zip(track_encoding.decode_track(encoded), plain):
+            self.assertEqual(t, int(parse_datetime(row["timestamp"]).timestamp()))
+            self.assertAlmostEqual(lat, row["latitude"], places=6)
+            self.assertAlmostEqual(speed, row["speed"], places=6)
+        self.assertEqual(self.client.get("/api/devices/cow1/history/", {"encoded": 1, "precision": 9}).status_code, 400)
+        self.assertEqual(self.client.get("/api/devices/cow9/history/", {"encoded": 1}).status_code, 404)
+
+    def test_trails_cover_only_owned_devices_without_outliers(self):
+        trails = self.client.get("/api/status/trails/").data["trails"]
+        self.assertEqual([(trail["device_id"], trail["points"]) for trail in trails], [("COW1", 4)])
+        self.assertEqual(self.client.get("/api/status/trails/", {"devices": "COW9"}).status_code, 404)
+        self.assertEqual(self.client.get("/api/status/trails/", {"minutes": 0}).status_code, 400)
+        # The newest kept fix is six minutes old
+        self.assertEqual(self.client.get("/api/status/trails/", {"minutes": 5}).data["trails"], [])
+
+
+class DwellReportTests(TrackingTestCase):
+    def test_reports_queue_one_background_refresh(self):
+        if dwell.np is None:
+            self.skipTest("numpy is not installed")
+        owner = User.objects.create_user("owner", "owner@example.com", "pw")
+        client = APIClient()
+        client.force_authenticate(owner)
+        executor = mock.Mock()
+        with mock.patch.object(dwell, "_executor", executor), \
+                mock.patch.object(dwell, "refresh_intervals", side_effect=AssertionError("refreshed in the request")):
+            for url in ("/api/analytics/dwell/", "/api/analytics/attendance/"):
+                self.assertEqual(client.get(url).status_code, 200)
+        executor.submit.assert_called_once_with(dwell._run_refresh, owner.id)
+
+
+class DeviceConfigTests(TrackingTestCase):
+    def fix(self, minute, lat, speed):
+        return store(
+            GPSData, device_id="TRACTOR1", timestamp=datetime(2025, 4, 1, 8, minute, tzinfo=dt_timezone.utc),
+            latitude=lat, longitude=28.31, speed=speed, altitude=0,
+        )
+
+    def poll_seconds(self):
+        return APIClient().get("/api/devices/tractor1/config/").data["poll_seconds"]
+
+    def test_interval_follows_fixes_stored_by_other_workers(self):
+        owner = User.objects.create_user("owner", "owner@example.com", "pw")
+        Equipment.objects.create(owner=owner, name="Tractor", device_id="TRACTOR1")
+        for minute in (0, 10, 20):
+            self.fix(minute, -15.41, 0)
+        parked = self.poll_seconds()
+        # Ingested elsewhere: this process's tracker never observed them
+        for step in range(5):
+            self.fix(30 + step, -15.41 + 0.0009 * step, 6)
+        self.assertLess(self.poll_seconds(), parked)
+
+
+class InlineExecutor:
+    """Stands in for a thread pool: the test transaction is only visible on this thread"""
+
+    def __init__(self, *args, **kwargs):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def submit(self, fn, *args):
+        future = concurrent.futures.Future()
+        future.set_result(fn(*args))
+        return future
+
+
+class ReplayRoundTripTests(TrackingTestCase):
+    def setUp(self):
+        super().setUp()
+        self.enterContext(mock.patch("tracking.replay.ThreadPoolExecutor", InlineExecutor))
+        self.owner = User.objects.create_user("owner", "owner@example.com", "pw")
+        Livestock.objects.create(owner=self.owner, name="Cow", device_id="COW1", animal_type="cow")
+        Geofence2.objects.create(owner=self.owner, name="Paddock", coordinates=GPSIngestTests.FENCE, is_active=True)
+        for lat, hour in ((-15.41, 10), (-15.41, 11), (-15.45, 12)):
+            APIClient().post("/api/gps-data/", {
+                "device_id": "COW1", "timestamp": f"2025-01-01T{hour}:00:00Z", "latitude": lat,
+                "longitude": 28.31, "speed": 0, "altitude": 1,
+            }, format="json")
+        self.db = sharding.db_for_device("COW1")
+        self.recorded_pks = set(GPSData.objects.using(self.db).values_list("pk", flat=True))
+
+    # Every fix writes the liveness row, so the replay leaves it pointing at its own fixes
+    @override_settings(TRACKING_LIVENESS={"PERSIST_SECONDS": 0})
+    def test_replay_matches_the_recording_and_cleans_up(self):
+        recorded = replay.load_recorded(["COW1"])
+        self.assertEqual([r.alerts for r in recorded], [frozenset(), frozenset(), frozenset({"geofence"})])
+        liveness_before = DeviceLiveness.objects.values("last_seen", "last_fix_id", "is_online").get(device_id="COW1")
+
+        run = replay.Replay(recorded, speed=0, workers=1)
+        shifted = [run.shifted(r.row["timestamp"]) for r in recorded]
+        self.assertGreater(shifted[0], timezone.now() - timedelta(seconds=5))
+        self.assertEqual([b - a for a, b in zip(shifted, shifted[1:])], [timedelta(hours=1)] * 2)
+
+        self.assertEqual(run.run()["stored"], 3)
+        diff = run.diff()
+        self.assertEqual((diff["compared"], diff["inside_mismatches"]), (3, 0))
+        self.assertEqual((diff["missing_alerts"], diff["extra_alerts"]), (Counter(), Counter()))
+        self.assertEqual(clustering.position_index.query(self.owner.id, (-180, -90, 180, 90), 20)["points"][0]["timestamp"], shifted[-1])
+
+        self.assertEqual(run.cleanup(), 3)
+        self.assertEqual(set(GPSData.objects.using(self.db).values_list("pk", flat=True)), self.recorded_pks)
+        self.assertEqual(
+            DeviceLiveness.objects.values("last_seen", "last_fix_id", "is_online").get(device_id="COW1"),
+            liveness_before,
+        )
+        self.assertIn(liveness_before["last_fix_id"], self.recorded_pks)
+        self.assertIsNone(motion_tracker.recent("COW1"))
+        points = clustering.position_index.query(self.owner.id, (-180, -90, 180, 90), 20)["points"]
+        self.assertEqual([p["timestamp"] for p in points], [recorded[-1].row["timestamp"]])
+        # A second run lands on fresh timestamps again and compares the same
+        again = replay.Replay(replay.load_recorded(["COW1"]), speed=0, workers=1)
+        self.assertEqual(again.run()["stored"], 3)
+        self.assertEqual(again.diff()["inside_mismatches"], 0)
+        again.cleanup()
+
+
+class ColdArchiveTests(TrackingTestCase):
+    def setUp(self):
+        super().setUp()
+        if cold_archive.np is None:
+            self.skipTest("numpy is not installed")
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.tmp = Path(tmp.name)
+        self.enterContext(override_settings(TRACKING_COLD_ARCHIVE={"ROOT": str(self.tmp / "archive")}))
+        self.owner = User.objects.create_user("owner", "owner@example.com", "pw")
+        self.cow = Livestock.objects.create(owner=self.owner, name="Cow", device_id="COW1", animal_type="cow")
+        self.fixes = [
+            store(
+                GPSData, device_id="COW1", timestamp=datetime(2025, 3, 1, 8, minute, tzinfo=dt_timezone.utc),
+                latitude=-15.41, longitude=28.31, speed=0, altitude=0,
+            )
+            for minute in (0, 10, 20)
+        ]
+        self.db = self.fixes[0]._state.db
+
+    def pack(self):
+        return cold_archive.pack_device("COW1", datetime(2025, 3, 1).date(), using=self.db, delete=True)
+
+    def test_delete_keeps_the_latest_fix(self):
+        summary = self.pack()
+        self.assertEqual((summary["packed"], summary["deleted"]), (3, 2))
+        left = GPSData.objects.using(self.db).filter(device_id="COW1")
+        self.assertEqual(list(left.values_list("pk", flat=True)), [self.fixes[-1].pk])
+
+    def test_archive_goes_with_the_registration(self):
+        self.pack()
+        directory = cold_archive.device_dir("COW1")
+        self.assertTrue(directory.exists())
+        # The tracker moves to another owner: their history starts empty
+        other = User.objects.create_user("other", "other@example.com", "pw")
+        with self.captureOnCommitCallbacks(execute=True):
+            with transaction.atomic():
+                self.cow.delete()
+                Livestock.objects.create(owner=other, name="Cow", device_id="COW1", animal_type="cow")
+        self.assertFalse(directory.exists())
+        self.assertIsNone(cold_archive.ColdTrack.open("COW1"))
+
+    def test_interval_readers_see_deleted_packed_days(self):
+        Geofence2.objects.create(owner=self.owner, name="Paddock", coordinates=GPSIngestTests.FENCE, is_active=True)
+        self.pack()
+        dwell.refresh_intervals(self.owner.id)
+        interval = GeofenceInterval.objects.get(device_id="COW1")
+        self.assertEqual((interval.started_at, interval.fixes, interval.inside), (self.fixes[0].timestamp, 3, True))
+        recorded = replay.load_recorded(["COW1"])
+        self.assertEqual([r.row["timestamp"] for r in recorded], [fix.timestamp for fix in self.fixes])
+        # Only the fix still in GPSData is rewritten
+        self.assertEqual(smoothing.smooth_history(["COW1"]), (1, 0))
+
+    def test_hostile_device_ids_stay_inside_the_archive(self):
+        self.pack()
+        neighbour = self.tmp / "db.sqlite3"
+        neighbour.write_text("keep")
+        client = APIClient()
+        client.force_authenticate(self.owner)
+        for device_id in ("..", ".", "/", " ./ "):
+            response = client.post(
+                "/api/equipment/", {"name": "Tractor", "category": "tractor", "device_id": device_id}, format="json"
+            )
+            self.assertEqual(response.status_code, 400, device_id)
+            # As the admin or a shell could, past the serializer
+            with self.captureOnCommitCallbacks(execute=True):
+                Equipment.objects.create(owner=self.owner, name="Tractor", category="tractor", device_id=device_id).delete()
+            self.assertEqual(cold_archive.device_dir(device_id).parent, cold_archive.device_dir("COW1").parent)
+        self.assertEqual(neighbour.read_text(), "keep")
+        self.assertTrue(cold_archive.device_dir("COW1").exists())
+
+
+@skipUnless(sharding.sharding_setting("SHARDS") >= 2, "needs --settings=smartfarm.settings_sharded_test")
+class ShardedOwnerTests(TrackingTestCase):
+    def setUp(self):
+        super().setUp()
+        # Owners 1 and 2 land in different shards
+        self.owners = [User.objects.create_user(f"owner{i}", f"owner{i}@example.com", "pw") for i in range(2)]
+        for owner in self.owners:
+            Livestock.objects.create(owner=owner, name="Cow", device_id=f"COW{owner.pk}", animal_type="cow")
+
+    def ingest(self, owner):
+        # Over the speed limit, so the shard gets an Alert and a counters row too
+        return APIClient().post("/api/gps-data/", {
+            "device_id": f"COW{owner.pk}", "timestamp": "2025-02-01T10:00:00Z",
+            "latitude": -15.41, "longitude": 28.31, "speed": 200, "altitude": 1,
+        }, format="json")
+
+    def rows(self, owner_id, model):
+        rows = model.objects.using(sharding.db_for_owner(owner_id))
+        if model is GPSData:
+            return rows.filter(device_id=f"COW{owner_id}").count()
+        return rows.filter(owner_id=owner_id).count()
+
+    def test_fixes_and_alerts_go_to_the_owner_shard(self):
+        for owner in self.owners:
+            self.assertEqual(self.ingest(owner).status_code, 200)
+        shards = {sharding.db_for_owner(owner.pk) for owner in self.owners}
+        self.assertEqual(len(shards), 2)
+        for owner in self.owners:
+            self.assertEqual(self.rows(owner.pk, GPSData), 1)
+            self.assertGreater(self.rows(owner.pk, Alert), 0)
+        self.assertEqual(GPSData.objects.using("default").count(), 0)
+
+    def test_deleting_an_owner_in_a_transaction_purges_their_shard(self):
+        doomed, kept = self.owners
+        doomed_id = doomed.pk
+        for owner in self.owners:
+            self.ingest(owner)
+        # As the admin's delete_view does
+        with self.captureOnCommitCallbacks(execute=True):
+            with transaction.atomic():
+                doomed.delete()
+        for model in (GPSData, Alert, AlertCounters):
+            self.assertEqual(self.rows(doomed_id, model), 0, model.__name__)
+        self.assertEqual(self.rows(kept.pk, GPSData), 1)
+        self.assertEqual(self.rows(kept.pk, AlertCounters), 1)
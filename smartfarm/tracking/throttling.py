@@ -0,0 +1,129 @@
+"""
+Admission control for the unauthenticated device endpoints.
+
+Checks run cheapest first: a per-IP token bucket, then (for gps_data) the
+cached registered-device lookup, then a per-device token bucket. All of it
+happens in DRF's throttle phase, before the body is validated or anything is
+written. Buckets and counters are per process.
+"""
+import threading
+from collections import Counter, OrderedDict
+
+from django.conf import settings
+from rest_framework.exceptions import PermissionDenied
+from rest_framework.throttling import BaseThrottle
+
+from .devices import normalize_device_id, owner_id_for_device
+from .ratelimit import TokenBucket
+
+DEFAULTS = {
+    "IP_RATE": 20.0,
+    "IP_BURST": 200,
+    "DEVICE_RATE": 1.0,
+    "DEVICE_BURST": 30,
+    "REJECT_UNKNOWN_DEVICES": True,
+    "MAX_TRACKED_KEYS": 100000,
+}
+
+
+def throttle_setting(name):
+    return getattr(settings, "TRACKING_INGEST_THROTTLE", {}).get(name, DEFAULTS[name])
+
+
+class KeyedBuckets:
+    """Bounded LRU of token buckets, one per key"""
+
+    def __init__(self, rate_setting, burst_setting):
+        self.rate_setting = rate_setting
+        self.burst_setting = burst_setting
+        self._buckets = OrderedDict()
+
+    def allow(self, key):
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = TokenBucket(
+                throttle_setting(self.burst_setting), throttle_setting(self.rate_setting)
+            )
+            if len(self._buckets) > throttle_setting("MAX_TRACKED_KEYS"):
+                self._buckets.popitem(last=False)
+        else:
+            self._buckets.move_to_end(key)
+        return bucket.consume()
+
+    def __len__(self):
+        return len(self._buckets)
+
+    def clear(self):
+        self._buckets.clear()
+
+
+class IngestStats:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.ip_buckets = KeyedBuckets("IP_RATE", "IP_BURST")
+        self.device_buckets = KeyedBuckets("DEVICE_RATE", "DEVICE_BURST")
+        self.counters = Counter()
+        self.throttled_devices = Counter()
+
+    def clear(self):
+        with self.lock:
+            self.ip_buckets.clear()
+            self.device_buckets.clear()
+            self.counters.clear()
+            self.throttled_devices.clear()
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                "counters": dict(self.counters),
+                "tracked_ips": len(self.ip_buckets),
+                "tracked_devices": len(self.device_buckets),
+                "most_throttled_devices": self.throttled_devices.most_common(20),
+            }
+
+
+ingest_stats = IngestStats()
+
+
+def _device_ids(request, view):
+    if "device_id" in view.kwargs:
+        return [normalize_device_id(view.kwargs["device_id"])]
+    data = request.data
+    rows = data if isinstance(data, list) else [data]
+    ids = {row.get("device_id") for row in rows if hasattr(row, "get")}
+    return list({normalize_device_id(i) for i in ids if isinstance(i, str)})
+
+
+class DeviceIngestThrottle(BaseThrottle):
+    """Per-IP and per-device token buckets; rejects unregistered devices on write"""
+
+    def allow_request(self, request, view):
+        ip = self.get_ident(request)
+        with ingest_stats.lock:
+            if not ingest_stats.ip_buckets.allow(ip):
+                ingest_stats.counters["throttled_ip"] += 1
+                self.retry_after = 1.0 / throttle_setting("IP_RATE")
+                return False
+
+        device_ids = _device_ids(request, view)
+        if request.method == "POST" and throttle_setting("REJECT_UNKNOWN_DEVICES"):
+            unknown = [d for d in device_ids if owner_id_for_device(d) is None]
+            if unknown:
+                with ingest_stats.lock:
+                    ingest_stats.counters["unknown_device"] += 1
+                raise PermissionDenied(f"Unknown device: {unknown[0]}")
+
+        with ingest_stats.lock:
+            for device_id in device_ids:
+                if not ingest_stats.device_buckets.allow(device_id):
+                    ingest_stats.counters["throttled_device"] += 1
+                    if len(ingest_stats.throttled_devices) > 10000:
+                        ingest_stats.throttled_devices.clear()
+                    ingest_stats.throttled_devices[device_id] += 1
+                    self.retry_after = 1.0 / throttle_setting("DEVICE_RATE")
+                    return False
+            ingest_stats.counters["allowed"] += 1
+        return True
+
+    def wait(self):
+        return getattr(self, "retry_after", None)
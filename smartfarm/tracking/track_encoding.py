@@ -0,0 +1,119 @@
+"""
+Compact track payloads for maps.
+
+A track of fixes is sent as one encoded polyline (geometry.PolylineEncoder,
+with a configurable number of decimals) plus two parallel integer arrays:
+
+    {"points": n, "precision": 5, "polyline": "...",
+     "t": [first epoch second, then seconds since the previous fix, ...],
+     "speed": [first speed * SPEED_FACTOR, then differences, ...],
+     "speed_factor": 10}
+
+Both arrays are delta-encoded like the polyline, so a steady track is mostly
+small repeated numbers. Timestamps are whole seconds and speeds are rounded to
+1 / SPEED_FACTOR. Tracks are built in one pass over rows in time order;
+`decode_track` is the reference decoder.
+"""
+from django.conf import settings
+
+from .geometry import PolylineEncoder, decode_polyline
+
+DEFAULTS = {
+    "PRECISION": 5,
+    "MAX_PRECISION": 7,
+    "SPEED_FACTOR": 10,
+    "TRAIL_MINUTES": 30,
+    "MAX_TRAIL_MINUTES": 1440,
+}
+
+
+def encoding_setting(name):
+    return getattr(settings, "TRACKING_TRACK_ENCODING", {}).get(name, DEFAULTS[name])
+
+
+def parse_precision(value):
+    """Polyline precision from a query param; raises ValueError outside 1..MAX_PRECISION"""
+    if value in (None, ""):
+        return encoding_setting("PRECISION")
+    precision = int(value)
+    if not 1 <= precision <= encoding_setting("MAX_PRECISION"):
+        raise ValueError(value)
+    return precision
+
+
+class TrackEncoder:
+    """Incremental encoder of one device's fixes, oldest first"""
+
+    def __init__(self, precision=None):
+        self.precision = precision or encoding_setting("PRECISION")
+        self.speed_factor = encoding_setting("SPEED_FACTOR")
+        self._polyline = PolylineEncoder(self.precision)
+        self._times = []
+        self._speeds = []
+        self._prev_t = 0
+        self._prev_speed = 0
+
+    def add(self, epoch_seconds, lat, lng, speed):
+        t = int(epoch_seconds // 1)
+        s = int(round((speed or 0.0) * self.speed_factor))
+        self._polyline.add(lat, lng)
+        self._times.append(t - self._prev_t)
+        self._speeds.append(s - self._prev_speed)
+        self._prev_t, self._prev_speed = t, s
+
+    def result(self):
+        return {
+            "points": len(self._times),
+            "precision": self.precision,
+            "polyline": self._polyline.result(),
+            "t": self._times,
+            "speed": self._speeds,
+            "speed_factor": self.speed_factor,
+        }
+
+
+def encode_rows(rows, precision=None):
+    """Encode (timestamp, lat, lng, speed) rows, e.g. a values_list iterator"""
+    encoder = TrackEncoder(precision)
+    for timestamp, lat, lng, speed in rows:
+        encoder.add(timestamp.timestamp(), lat, lng, speed)
+    return encoder.result()
+
+
+def encode_columns(columns, precision=None):
+    """Encode cold_archive.load_track columns t (epoch microseconds), lat, lng and speed"""
+    encoder = TrackEncoder(precision)
+    seconds = (columns["t"] // 1000000).tolist()
+    for t, lat, lng, speed in zip(seconds, columns["lat"].tolist(), columns["lng"].tolist(), columns["speed"].tolist()):
+        encoder.add(t, lat, lng, speed)
+    return encoder.result()
+
+
+def encode_tracks(rows, precision=None):
+    """
+    {device_id: encoded track} from (device_id, timestamp, lat, lng, speed)
+    rows ordered by device and time, in one pass
+    """
+    tracks = {}
+    device_id = encoder = None
+    for row in rows:
+        if row[0] != device_id:
+            if encoder is not None:
+                tracks[device_id] = encoder.result()
+            device_id, encoder = row[0], TrackEncoder(precision)
+        encoder.add(row[1].timestamp(), row[2], row[3], row[4])
+    if encoder is not None:
+        tracks[device_id] = encoder.result()
+    return tracks
+
+
+def decode_track(track):
+    """[(epoch seconds, lat, lng, speed), ...] from an encoded track"""
+    coords = decode_polyline(track["polyline"], track["precision"])
+    out = []
+    t = s = 0
+    for (lat, lng), dt, ds in zip(coords, track["t"], track["speed"]):
+        t += dt
+        s += ds
+        out.append((t, lat, lng, s / track["speed_factor"]))
+    return out
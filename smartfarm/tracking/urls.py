@@ -9,9 +9,12 @@ router.register(r'geofences-api', views.GeofenceViewSet, basename='geofences-api
 urlpatterns = [
     # telemetry & resources
     path("gps-data/", views.gps_data),
+    path("ingest/throttle-stats/", views.ingest_throttle_stats),
     path("equipment/", views.equipment_list),
     path("equipment/<int:pk>/", views.equipment_detail),
     path("livestock/", views.livestock_list),
+    path("livestock/activity/", views.livestock_activity),
+    path("livestock/<int:pk>/activity/", views.livestock_activity_history),
     path("employees/", views.employee_list),
     path("owners/", views.owner_list),
 
@@ -19,10 +22,17 @@ urlpatterns = [
     path("devices/<str:device_id>/config/", views.device_config),
 
     # dashboard summary + history
+    path("devices/stale/", views.stale_devices),
     path("devices/<str:device_id>/history/", views.device_history, name="device_history"),
+    path("analytics/heatmap/", views.activity_heatmap),
+    path("analytics/dwell/", views.dwell_report),
+    path("analytics/attendance/", views.attendance_log),
 
     # alerts
     path("alerts/", views.alerts_list),
+    path("alerts/counts/", views.alert_counts),
+    path("alerts/bulk-resolve/", views.bulk_resolve_alerts),
+    path("alerts/bulk-delete/", views.bulk_delete_alerts),
     path("alerts/<int:pk>/resolve/", views.resolve_alert),
     path("alerts/<int:pk>/ack/", views.alert_ack),
     path("alerts/<int:pk>/", views.delete_alert, name="delete-alert"),  # ✅ MOVED here
@@ -35,6 +45,8 @@ urlpatterns = [
     path("token/refresh/", TokenRefreshView.as_view()),
     path('register/', views.register_user, name='register'),
     path("status/overview/", views.overview_status),
+    path("status/clusters/", views.position_clusters),
+    path("status/trails/", views.live_trails),
     path("alerts/clear-all/", views.clear_all_alerts, name="clear_all_alerts"),
     
     # ✅ CORRECTED DELETE ENDPOINTS (added trailing slashes)
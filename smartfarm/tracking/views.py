@@ -1,35 +1,45 @@
 # views.py
 from rest_framework.decorators import api_view, permission_classes
-from rest_framework.permissions import IsAuthenticated, AllowAny
+from rest_framework.permissions import IsAuthenticated, AllowAny, IsAdminUser
 from rest_framework.response import Response
 from rest_framework import status, viewsets
 from django.utils import timezone
 from django.db.models import Max, Q
-from datetime import datetime
+from django.db.models.functions import Coalesce
+from datetime import datetime, timedelta
 from rest_framework.decorators import action
-from math import radians, cos, sin, sqrt, atan2
-from django.http import StreamingHttpResponse
+from django.http import HttpResponse, StreamingHttpResponse
+from django.utils.dateparse import parse_date, parse_datetime
+from django.utils.decorators import method_decorator
 import json
+import math
 import time
-from .models import GPSData, Equipment, Employee, Alert, OwnerProfile, Geofence2,Livestock
-from rest_framework.decorators import api_view, authentication_classes, permission_classes
+from .models import GPSData, Equipment, Employee, Alert, OwnerProfile, Geofence2,Livestock, DeviceLiveness, LivestockActivityDay, Device
+from rest_framework.decorators import api_view, authentication_classes, permission_classes, throttle_classes
 from rest_framework_simplejwt.tokens import RefreshToken
 from django.contrib.auth.models import User
 from .serializers import (
     GPSDataSerializer, EquipmentSerializer, EmployeeSerializer,
-    AlertSerializer, OwnerProfileSerializer, 
-    UserRegistrationSerializer, UserSerializer, OverviewSerializer, GeofenceSerializer2,LivestockSerializer
+    AlertSerializer, OwnerProfileSerializer, OwnerSettingsSerializer,
+    UserRegistrationSerializer, UserSerializer, OverviewSerializer, GeofenceSerializer2,LivestockSerializer,
+    LivestockActivityDaySerializer,
+    simplify_geofence,
 )
+from .alerting import alert_policy, alert_setting
+from .boundary import RecentFix, boundary_setting, motion_tracker, report_seconds
+from .ingest import ingest_fixes
+from .throttling import DeviceIngestThrottle, ingest_stats
+from .cache import cached_response, response_cache
+from . import counters
+from .counters import open_counts, resolve_alerts
+from .clustering import MAX_ZOOM, position_index
+from .devices import lookup_device, owner_device_ids
+from . import cold_archive, dwell, heatmap, track_encoding
+from .geometry import haversine_m
+from .sharding import db_for_owner
+from .pagination import keyset_page
 
 # ---------- helpers ----------
-def haversine_m(lat1, lon1, lat2, lon2):
-    R = 6371000.0
-    p1, p2 = radians(lat1), radians(lat2)
-    dphi = radians(lat2 - lat1)
-    dl = radians(lon2 - lon1)
-    a = sin(dphi/2)**2 + cos(p1)*cos(p2)*sin(dl/2)**2
-    return R * 2 * atan2(sqrt(a), sqrt(1-a))
-
 def latest_fix_for_device(device_id):
     return GPSData.objects.filter(device_id=device_id).order_by("-timestamp").first()
 
@@ -38,61 +48,80 @@ def calculate_distance(lat1, lon1, lat2, lon2):
 
 @api_view(["GET"])
 @permission_classes([AllowAny])
+@throttle_classes([DeviceIngestThrottle])
 def device_config(request, device_id):
     """
     Return device configuration for a given device_id (MAC address)
     This includes:
         - Assigned device_id
         - Latest active geofence for the owner
-        - Polling interval
+        - Polling interval: shorter near a fence edge or while moving fast,
+          longer deep inside or while standing still (tracking.boundary)
+    With ?compact=1 the geofence is sent as an encoded polyline plus bbox
+    instead of the raw coordinate list.
     """
 
-    # Clean incoming device_id
-    device_id = device_id.strip()  # remove spaces
-    assigned_device_id = None
-    owner = None
+    # 1️⃣ One indexed lookup on the normalized id covers equipment, employees and livestock
+    device = lookup_device(device_id)
 
-    # 1️⃣ Check if the device_id belongs to an Equipment
-    equipment = Equipment.objects.filter(device_id__iexact=device_id).first()
-    if equipment:
-        owner = equipment.owner
-        assigned_device_id = equipment.device_id
-    else:
-        # 2️⃣ Check if the device_id belongs to an Employee tracker
-        employee = Employee.objects.filter(tracker_device_id__iexact=device_id).first()
-        if employee:
-            owner = employee.owner
-            assigned_device_id = employee.tracker_device_id
-
-    # 3️⃣ If no owner/device found, return default config
-    if not owner:
+    # 2️⃣ If no owner/device found, return default config
+    if not device:
         return Response({
             "device_id": None,
             "geofence": None,
             "poll_seconds": 5
         })
 
-    # 4️⃣ Get the latest active geofence for this owner
-    geofence = Geofence2.objects.filter(owner=owner, is_active=True).order_by("-id").first()
+    # 3️⃣ Get the latest active geofence for this owner
+    geofence = Geofence2.objects.filter(owner_id=device.owner_id, is_active=True).order_by("-id").first()
 
-    # 5️⃣ Build geofence data if available
+    # 4️⃣ Build geofence data if available
     geofence_data = None
-    if geofence:
+    if geofence and request.GET.get("compact"):
+        geofence_data = {
+            "id": geofence.id,
+            "name": geofence.name,
+            "encoded": geofence.encoded_polyline,
+            "bbox": [geofence.min_lat, geofence.min_lng, geofence.max_lat, geofence.max_lng],
+            "vertex_count": geofence.vertex_count,
+        }
+    elif geofence:
         geofence_data = {
             "id": geofence.id,
             "name": geofence.name,
             "coordinates": geofence.coordinates
         }
 
+    # 5️⃣ Report interval from recent motion and the distance to a fence edge.
+    # Fixes may reach another worker or the listener, so read the newest stored
+    # ones (one query on the device/timestamp index) and keep whichever is newer.
+    rows = (
+        GPSData.objects.using(db_for_owner(device.owner_id))
+        .filter(device_id=device.device_id, is_outlier=False)
+        .order_by("-timestamp")
+        .values_list(
+            "timestamp", Coalesce("filtered_latitude", "latitude"), Coalesce("filtered_longitude", "longitude"),
+            "speed", "boundary_distance_m",
+        )[:boundary_setting("MOTION_FIXES")]
+    )
+    recent = motion_tracker.seed(device.device_id, [RecentFix(*row) for row in reversed(rows)])
+    thresholds = alert_policy.thresholds(device.owner_id)
+    distance = recent[-1].boundary_distance_m if recent else None
+
     # 6️⃣ Return full config JSON
     return Response({
-        "device_id": assigned_device_id,
+        "device_id": device.device_id,
         "geofence": geofence_data,
-        "poll_seconds": 5
+        "poll_seconds": report_seconds(
+            recent, thresholds.boundary_warning_m,
+            (thresholds.min_report_seconds, thresholds.max_report_seconds),
+        ),
+        "boundary_distance_m": distance,
     })
 
 @api_view(["GET"])
 @permission_classes([IsAuthenticated])
+@cached_response("overview_status")
 def overview_status(request):
     try:
         user = request.user
@@ -106,7 +135,7 @@ def overview_status(request):
         results = []
 
         def compute(obj, kind):
-            device_id = obj.device_id if kind == "equipment" else getattr(obj, "tracker_device_id", None)
+            device_id = obj.tracker_device_id if kind == "employee" else obj.device_id
             last = latest_fix_for_device(device_id) if device_id else None
 
             inside_any_geofence = False
@@ -145,59 +174,300 @@ def overview_status(request):
     except Exception as e:
         print(f"Error in overview_status: {str(e)}")  # Debug logging
         return Response({"detail": f"Server error: {str(e)}"}, status=500)
-    
+
 @api_view(["GET"])
 @permission_classes([IsAuthenticated])
-def device_history(request, device_id):
-    equipment = Equipment.objects.filter(device_id=device_id, owner=request.user).first()
-    employee = Employee.objects.filter(tracker_device_id=device_id, owner=request.user).first()
+def position_clusters(request):
+    """
+    Clustered latest positions for a map view.
+    Query params:
+        - bbox: west,south,east,north; clamped to valid longitudes and latitudes
+        - zoom: map zoom level (0 to MAX_ZOOM); individual points are returned only at high zoom
+    """
+    try:
+        west, south, east, north = (float(v) for v in request.GET.get("bbox", "").split(","))
+        zoom = int(request.GET.get("zoom", ""))
+        if not all(math.isfinite(v) for v in (west, south, east, north)) or not 0 <= zoom <= MAX_ZOOM:
+            raise ValueError(zoom)
+    except ValueError:
+        return Response(
+            {"error": "bbox (west,south,east,north) of finite numbers and zoom between 0 and %d are required"
+             % MAX_ZOOM},
+            status=status.HTTP_400_BAD_REQUEST
+        )
 
-    if not equipment and not employee:
+    west, east = (min(180.0, max(-180.0, v)) for v in (west, east))
+    south, north = (min(90.0, max(-90.0, v)) for v in (south, north))
+    return Response(position_index.query(request.user.id, (west, south, east, north), zoom))
+
+@api_view(["GET"])
+@permission_classes([IsAuthenticated])
+def live_trails(request):
+    """
+    Recent trails of the owner's devices as encoded tracks (tracking.track_encoding).
+    Query params:
+        - minutes: how far back (default 30)
+        - devices: comma-separated device ids (default: all of the owner's devices)
+        - precision: polyline decimals (default 5)
+    Outlier fixes are left out.
+    """
+    owned = owner_device_ids(request.user.id)
+    requested = sorted({d.strip() for d in request.GET.get("devices", "").split(",") if d.strip()})
+    unknown = [d for d in requested if d not in owned]
+    if unknown:
+        return Response({"detail": f"Device '{unknown[0]}' not found or not owned by user"}, status=404)
+
+    try:
+        minutes = int(request.GET.get("minutes") or track_encoding.encoding_setting("TRAIL_MINUTES"))
+        if not 0 < minutes <= track_encoding.encoding_setting("MAX_TRAIL_MINUTES"):
+            raise ValueError(minutes)
+        precision = track_encoding.parse_precision(request.GET.get("precision"))
+    except ValueError:
+        return Response(
+            {"error": "minutes must be between 1 and %d and precision a small positive integer"
+             % track_encoding.encoding_setting("MAX_TRAIL_MINUTES")},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+
+    rows = (
+        GPSData.objects.filter(
+            device_id__in=requested or owned,
+            timestamp__gte=timezone.now() - timedelta(minutes=minutes),
+            is_outlier=False,
+        )
+        .order_by("device_id", "timestamp")
+        .values_list("device_id", "timestamp", "latitude", "longitude", "speed")
+        .iterator(chunk_size=5000)
+    )
+    trails = track_encoding.encode_tracks(rows, precision)
+    return Response({
+        "minutes": minutes,
+        "trails": [{"device_id": device_id, **track} for device_id, track in trails.items()],
+    })
+
+@api_view(["GET"])
+@permission_classes([IsAuthenticated])
+def stale_devices(request):
+    """Devices of the current owner that have stopped reporting"""
+    rows = DeviceLiveness.objects.filter(owner=request.user, is_online=False).order_by("last_seen")
+    return Response([
+        {"device_id": row.device_id, "last_seen": row.last_seen, "offline_since": row.changed_at}
+        for row in rows
+    ])
+
+@api_view(["GET"])
+@permission_classes([IsAuthenticated])
+def activity_heatmap(request):
+    """
+    Density grid of where devices spent time.
+    Query params:
+        - devices: comma-separated device ids (default: all of the owner's devices)
+        - from / to: ISO timestamps bounding the range
+        - cell_m: cell size in metres (grown if the grid would be too large)
+        - output: "json" (default, sparse [row, col, count] cells) or "png"
+    """
+    if heatmap.np is None:
+        return Response({"detail": "numpy is required for heatmaps"}, status=status.HTTP_501_NOT_IMPLEMENTED)
+
+    owned = owner_device_ids(request.user.id)
+    requested = sorted({d.strip() for d in request.GET.get("devices", "").split(",") if d.strip()})
+    unknown = [d for d in requested if d not in owned]
+    if unknown:
+        return Response({"detail": f"Device '{unknown[0]}' not found or not owned by user"}, status=404)
+    device_ids = requested or owned
+
+    try:
+        bounds = []
+        for name in ("from", "to"):
+            value = request.GET.get(name)
+            parsed = parse_datetime(value) if value else None
+            if value and parsed is None:
+                raise ValueError(name)
+            if parsed and timezone.is_naive(parsed):
+                parsed = timezone.make_aware(parsed)
+            bounds.append(parsed)
+        cell_m = float(request.GET.get("cell_m") or heatmap.heatmap_setting("CELL_M"))
+        if not math.isfinite(cell_m) or cell_m <= 0:
+            raise ValueError(cell_m)
+    except ValueError:
+        return Response(
+            {"error": "from/to must be ISO timestamps and cell_m a positive number"},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    start, end = bounds
+
+    # Late uploads, deletes and re-evaluation still change old ranges, so keys follow the owner version
+    params = {
+        "devices": device_ids,
+        "from": start.isoformat() if start else None,
+        "to": end.isoformat() if end else None,
+        "cell_m": cell_m,
+    }
+    key = response_cache.make_key(request.user.id, "activity_heatmap", params)
+    data = response_cache.get(key)
+    if data is None:
+        data = heatmap.build_heatmap(device_ids, start, end, cell_m)
+        response_cache.set(key, data)
+
+    if request.GET.get("output") == "png":
+        response = HttpResponse(heatmap.render_png(data), content_type="image/png")
+        if data["bounds"]:
+            response["X-Heatmap-Bounds"] = ",".join(str(v) for v in data["bounds"])
+        return response
+    return Response(data)
+
+def _report_params(request):
+    """Window, fence and devices of a dwell/attendance request; raises ValueError"""
+    bounds = []
+    for name in ("from", "to"):
+        value = request.GET.get(name)
+        parsed = parse_datetime(value) if value else None
+        if value and parsed is None:
+            raise ValueError(f"{name} must be an ISO timestamp")
+        if parsed and timezone.is_naive(parsed):
+            parsed = timezone.make_aware(parsed)
+        bounds.append(parsed)
+    start, end = dwell.report_window(*bounds)
+
+    geofence_id = request.GET.get("geofence")
+    if geofence_id is not None:
+        if not geofence_id.isdigit():
+            raise ValueError("geofence must be a geofence id")
+        geofence_id = int(geofence_id)
+
+    devices = Device.objects.filter(owner=request.user)
+    if request.GET.get("kind"):
+        devices = devices.filter(kind=request.GET["kind"])
+    if request.GET.get("device"):
+        device = lookup_device(request.GET["device"])
+        devices = devices.filter(pk=device.pk if device else None)
+    device_ids = None
+    if request.GET.get("kind") or request.GET.get("device"):
+        device_ids = list(devices.values_list("device_id", flat=True))
+    return start, end, geofence_id, device_ids
+
+
+def _dwell_view(request, build):
+    if dwell.np is None:
+        return Response({"detail": "numpy is required for dwell reports"}, status=status.HTTP_501_NOT_IMPLEMENTED)
+    try:
+        start, end, geofence_id, device_ids = _report_params(request)
+    except ValueError as exc:
+        return Response({"detail": str(exc)}, status=status.HTTP_400_BAD_REQUEST)
+    if dwell.dwell_setting("REFRESH_IN_BACKGROUND"):
+        # Answer from the stored intervals; newer fixes show up once the refresh lands
+        dwell.schedule_refresh(request.user.id)
+    return Response({
+        "from": start,
+        "to": end,
+        "rows": build(request.user.id, start, end, geofence_id, device_ids),
+    })
+
+
+@api_view(["GET"])
+@permission_classes([IsAuthenticated])
+@cached_response("dwell_report")
+def dwell_report(request):
+    """
+    Time each device spent inside and outside each active fence.
+    Query params: from / to (ISO; default the last 7 days), geofence (id),
+    device, kind (equipment / employee / livestock).
+    """
+    return _dwell_view(request, dwell.dwell_report)
+
+
+@api_view(["GET"])
+@permission_classes([IsAuthenticated])
+@cached_response("attendance_log")
+def attendance_log(request):
+    """Entry/exit log: one row per visit inside a fence. Same query params as dwell_report."""
+    return _dwell_view(request, dwell.attendance_log)
+
+def _parse_moment(value):
+    """Aware datetime from an ISO timestamp or date (midnight), None when empty; raises ValueError"""
+    if not value:
+        return None
+    parsed = parse_datetime(value)
+    if parsed is None:
+        day = parse_date(value)
+        if day is None:
+            raise ValueError(value)
+        parsed = datetime.combine(day, datetime.min.time())
+    return timezone.make_aware(parsed) if timezone.is_naive(parsed) else parsed
+
+@api_view(["GET"])
+@permission_classes([IsAuthenticated])
+def device_history(request, device_id):
+    """
+    Fixes of a device, oldest first.
+    Query params:
+        - from / to: ISO timestamps or dates bounding the range
+        - encoded=1: one encoded polyline plus delta-encoded times and speeds
+          (tracking.track_encoding) instead of a list of fix objects
+        - precision: polyline decimals for encoded=1 (default 5)
+    """
+    device = lookup_device(device_id)
+    if not device or device.owner_id != request.user.id:
         return Response({"detail": f"Device '{device_id}' not found or not owned by user"}, status=404)
 
-    qs = GPSData.objects.filter(device_id=device_id).order_by("timestamp")
+    qs = GPSData.objects.filter(device_id=device.device_id).order_by("timestamp")
 
-    t_from = request.GET.get("from")
-    t_to = request.GET.get("to")
+    try:
+        t_from, t_to = (_parse_moment(request.GET.get(name)) for name in ("from", "to"))
+        precision = track_encoding.parse_precision(request.GET.get("precision"))
+    except ValueError:
+        return Response(
+            {"error": "from/to must be ISO dates or timestamps and precision a small positive integer"},
+            status=status.HTTP_400_BAD_REQUEST
+        )
 
     if t_from:
         qs = qs.filter(timestamp__gte=t_from)
     if t_to:
         qs = qs.filter(timestamp__lte=t_to)
 
+    # Closed days may have been packed into the cold archive
+    track = cold_archive.ColdTrack.open(device.device_id)
+    if request.GET.get("encoded"):
+        if track is not None:
+            columns = cold_archive.load_track(
+                device.device_id, t_from, t_to, track=track, columns=("t", "lat", "lng", "speed")
+            )
+            data = track_encoding.encode_columns(columns, precision)
+        else:
+            rows = qs.values_list("timestamp", "latitude", "longitude", "speed").iterator(chunk_size=5000)
+            data = track_encoding.encode_rows(rows, precision)
+        return Response({"device_id": device.device_id, **data})
+    if track is not None:
+        return Response(cold_archive.history_rows(track, cold_archive.hot_rows(track, qs), t_from, t_to))
     return Response(GPSDataSerializer(qs, many=True).data)
 
 # ---------- Alert ack ----------
+def _resolve_one(alert):
+    resolve_alerts(Alert.objects.using(alert._state.db).filter(pk=alert.pk))
+    # An UPDATE sends no post_save, so stop the policy coalescing into it here
+    alert_policy.alert_closed(alert.id, using=alert._state.db)
+
 @api_view(["POST"])
 @permission_classes([IsAuthenticated])
 def alert_ack(request, pk):
-    try:
-        alert = Alert.objects.get(pk=pk)
-        alert.is_resolved = True
-        alert.save()
-        return Response({"status": "acknowledged", "alert_id": alert.id})
-    except Alert.DoesNotExist:
+    alert = Alert.objects.filter(pk=pk, owner=request.user).first()
+    if alert is None:
         return Response({"detail": "Not found"}, status=404)
+    _resolve_one(alert)
+    return Response({"status": "acknowledged", "alert_id": alert.id})
 
 # ---------- SSE for live alerts ----------
 @api_view(["GET"])
 @permission_classes([IsAuthenticated])
 def stream_alerts(request):
+    # The stream outlives the request, so it names the owner's database itself
+    alerts = Alert.objects.using(db_for_owner(request.user.pk))
+
     def event_stream():
         last_id = None
         while True:
-            user_equipment = Equipment.objects.filter(owner=request.user).values_list('device_id', flat=True)
-            user_employees = Employee.objects.filter(owner=request.user).values_list('tracker_device_id', flat=True)
-            
-            user_equipment = [device_id for device_id in user_equipment if device_id]
-            user_employees = [device_id for device_id in user_employees if device_id]
-            
-            all_device_ids = user_equipment + user_employees
-            
-            qs = Alert.objects.filter(
-                gps_data__device_id__in=all_device_ids,
-                is_resolved=False
-            ).order_by("-created_at")
+            qs = alerts.filter(owner=request.user, is_resolved=False).order_by("-created_at", "-id")
             
             if qs.exists():
                 latest = qs.first()
@@ -216,82 +486,57 @@ def stream_alerts(request):
 # ------------------------------
 @api_view(["POST"])
 @permission_classes([AllowAny])
+@throttle_classes([DeviceIngestThrottle])
 def gps_data(request):
     """
-    Receive GPS data from ESP32
+    Receive GPS data from ESP32.
+    Accepts a single fix or a list of fixes; retries of an already stored
+    (device_id, timestamp) are acknowledged without being stored again.
     """
-    serializer = GPSDataSerializer(data=request.data)
-    
-    if serializer.is_valid():
-        gps_instance = serializer.save()
+    many = isinstance(request.data, list)
+    serializer = GPSDataSerializer(data=request.data, many=many)
+    if not serializer.is_valid():
+        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
-        # Identify the owner
-        equipment = Equipment.objects.filter(device_id=gps_instance.device_id).first()
-        employee = None
-        owner = None
-        
-        if equipment:
-            owner = equipment.owner
-        else:
-            employee = Employee.objects.filter(tracker_device_id=gps_instance.device_id).first()
-            if employee:
-                owner = employee.owner
-
-        # Check against all active geofences for this owner
-        inside_geofence = False
-        if owner:
-            geofences = Geofence2.objects.filter(owner=owner, is_active=True)
-            for geofence in geofences:
-                if geofence.contains_point(gps_instance.latitude, gps_instance.longitude):
-                    inside_geofence = True
-                    break
-
-        # Create alert if device is outside all geofences
-        if owner and not inside_geofence:
-            # Check if there's already an unresolved geofence alert for this device
-            existing_alert = Alert.objects.filter(
-                gps_data__device_id=gps_instance.device_id,
-                alert_type="geofence",
-                is_resolved=False
-            ).first()
-            
-            if not existing_alert:
-                alert_message = f"{equipment.name if equipment else employee.full_name} has left the geofence!"
-                Alert.objects.create(
-                    gps_data=gps_instance,
-                    alert_type="geofence",
-                    message=alert_message
-                )
+    results = ingest_fixes(serializer.validated_data if many else [serializer.validated_data])
 
-        # Speed alert - only create if no recent unresolved speed alert exists
-        if gps_instance.speed and gps_instance.speed > 40:
-            from django.utils import timezone
-            from datetime import timedelta
-            
-            # Check for recent speed alerts (within last 5 minutes)
-            recent_speed_alert = Alert.objects.filter(
-                gps_data__device_id=gps_instance.device_id,
-                alert_type="speed",
-                is_resolved=False,
-                created_at__gte=timezone.now() - timedelta(minutes=5)
-            ).first()
-            
-            if not recent_speed_alert:
-                Alert.objects.create(
-                    gps_data=gps_instance,
-                    alert_type="speed",
-                    message=f"Overspeed detected: {gps_instance.speed} km/h",
-                )
+    # The device adapts its report interval from here without asking device_config
+    poll = results[-1].poll_seconds if results else None
+    if poll is None:
+        poll = boundary_setting("POLL_SECONDS")
 
-        return Response({"status": "success", "data": serializer.data, "inside_geofence": inside_geofence})
+    if many:
+        duplicates = sum(1 for r in results if r.duplicate)
+        return Response({
+            "status": "success", "stored": len(results) - duplicates, "duplicates": duplicates, "poll_seconds": poll,
+        })
 
-    return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+    result = results[0]
+    if result.duplicate:
+        return Response({
+            "status": "duplicate",
+            "inside_geofence": bool(result.inside_geofence),
+            "poll_seconds": poll,
+        })
+    return Response({
+        "status": "success",
+        "data": GPSDataSerializer(result.gps).data,
+        "inside_geofence": bool(result.inside_geofence),
+        "poll_seconds": poll,
+    })
+
+@api_view(["GET"])
+@permission_classes([IsAdminUser])
+def ingest_throttle_stats(request):
+    """Counters from the device ingest throttle, for monitoring"""
+    return Response(ingest_stats.snapshot())
 
 # ------------------------------
 # Equipment Management
 # ------------------------------
 @api_view(["GET", "POST"])
 @permission_classes([IsAuthenticated])
+@cached_response("equipment_list")
 def equipment_list(request):
     if request.method == "GET":
         equipment = Equipment.objects.filter(owner=request.user)
@@ -305,11 +550,54 @@ def equipment_list(request):
             return Response(serializer.data, status=status.HTTP_201_CREATED)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
+@api_view(["GET"])
+@permission_classes([IsAuthenticated])
+@cached_response("livestock_activity")
+def livestock_activity(request):
+    """
+    Precomputed behaviour summaries of the whole herd for one day.
+    Query params:
+        - date: YYYY-MM-DD (default: the latest computed day)
+        - anomalies: 1 to return only flagged animals
+    """
+    rows = LivestockActivityDay.objects.filter(owner=request.user).select_related("livestock")
+    day = request.GET.get("date")
+    if day:
+        try:
+            day = datetime.strptime(day, "%Y-%m-%d").date()
+        except ValueError:
+            return Response({"error": "date must be YYYY-MM-DD"}, status=status.HTTP_400_BAD_REQUEST)
+    else:
+        day = rows.aggregate(latest=Max("date"))["latest"]
+    rows = rows.filter(date=day).order_by("livestock__name")
+    if request.GET.get("anomalies") == "1":
+        rows = rows.filter(is_anomaly=True)
+    return Response({"date": day, "animals": LivestockActivityDaySerializer(rows, many=True).data})
+
+@api_view(["GET"])
+@permission_classes([IsAuthenticated])
+@cached_response("livestock_activity_history")
+def livestock_activity_history(request, pk):
+    """Daily behaviour summaries of one animal for the last `days` days (default 30)"""
+    try:
+        livestock = Livestock.objects.get(pk=pk, owner=request.user)
+    except Livestock.DoesNotExist:
+        return Response({"detail": "Not found."}, status=status.HTTP_404_NOT_FOUND)
+    try:
+        days = int(request.GET.get("days", 30))
+    except ValueError:
+        return Response({"error": "days must be an integer"}, status=status.HTTP_400_BAD_REQUEST)
+
+    since = timezone.localdate() - timedelta(days=days)
+    rows = livestock.activity_days.filter(date__gt=since).order_by("date")
+    return Response(LivestockActivityDaySerializer(rows, many=True).data)
+
 # ------------------------------
 # Employee Management
 # ------------------------------
 @api_view(["GET", "POST"])
 @permission_classes([IsAuthenticated])
+@cached_response("employee_list")
 def employee_list(request):
     if request.method == "GET":
         employees = Employee.objects.filter(owner=request.user)
@@ -325,6 +613,7 @@ def employee_list(request):
     
 @api_view(["GET", "POST"])
 @permission_classes([IsAuthenticated])
+@cached_response("livestock_list")
 def livestock_list(request):
     if request.method == "GET":
         # Filter directly by User
@@ -345,47 +634,127 @@ def livestock_list(request):
 # ------------------------------
 # Alerts Management
 # ------------------------------
+def filter_alerts(alerts, params, default_resolved="false"):
+    """
+    Narrow an alert queryset by ?resolved=false|true|all, ?type=, ?device=
+    and ?before= (ISO time). Raises ValueError on a bad value.
+    """
+    resolved = str(params.get("resolved", default_resolved)).lower()
+    if resolved in ("true", "1"):
+        alerts = alerts.filter(is_resolved=True)
+    elif resolved in ("false", "0"):
+        alerts = alerts.filter(is_resolved=False)
+    elif resolved != "all":
+        raise ValueError("resolved must be true, false or all")
+
+    if params.get("type"):
+        alerts = alerts.filter(alert_type=params["type"])
+    if params.get("device"):
+        device = lookup_device(params["device"])
+        alerts = alerts.filter(gps_data__device_id=device.device_id if device else params["device"])
+    if params.get("before"):
+        before = parse_datetime(str(params["before"]))
+        if before is None:
+            raise ValueError("before must be an ISO 8601 time")
+        alerts = alerts.filter(created_at__lt=before)
+    return alerts
+
+
+def _bulk_selection(request):
+    """Owner-scoped alerts named by a bulk request body: {"ids": [...]} or {"filter": {...}}"""
+    alerts = Alert.objects.filter(owner=request.user)
+    data = request.data if isinstance(request.data, dict) else {}
+    if "ids" in data:
+        ids = data["ids"]
+        # bool is an int subclass, and True would select alert 1
+        if not isinstance(ids, list) or not all(isinstance(i, int) and not isinstance(i, bool) for i in ids):
+            raise ValueError("ids must be a list of alert ids")
+        if len(ids) > alert_setting("MAX_BULK_IDS"):
+            raise ValueError(f"at most {alert_setting('MAX_BULK_IDS')} ids per request; use a filter instead")
+        return alerts.filter(pk__in=ids)
+    if isinstance(data.get("filter"), dict):
+        # An empty filter would select every alert the owner has, open ones included
+        if not any(data["filter"].get(key) not in (None, "") for key in ("resolved", "type", "device", "before")):
+            raise ValueError("filter needs at least one of resolved, type, device or before")
+        return filter_alerts(alerts, data["filter"], default_resolved="all")
+    raise ValueError('send "ids" or "filter"')
+
+
 @api_view(["GET"])
 @permission_classes([IsAuthenticated])
+@cached_response("alerts_list", headers=("X-Next-Cursor",))
 def alerts_list(request):
-    user_equipment = Equipment.objects.filter(owner=request.user).values_list('device_id', flat=True)
-    user_employees = Employee.objects.filter(owner=request.user).values_list('tracker_device_id', flat=True)
-    
-    user_equipment = [device_id for device_id in user_equipment if device_id]
-    user_employees = [device_id for device_id in user_employees if device_id]
-    
-    all_device_ids = user_equipment + user_employees
-    
-    alerts = Alert.objects.filter(
-        is_resolved=False,
-        gps_data__device_id__in=all_device_ids
-    ).order_by("-created_at")
-    
-    serializer = AlertSerializer(alerts, many=True)
-    return Response(serializer.data)
+    """
+    The owner's alerts, newest first, one page at a time. The body is the
+    list as before; when more rows follow, the X-Next-Cursor header carries
+    the value to pass as ?cursor= for the next page.
+    Filters: ?resolved=false (default) | true | all, ?type=, ?device=.
+    """
+    try:
+        alerts = filter_alerts(Alert.objects.filter(owner=request.user), request.GET)
+    except ValueError as exc:
+        return Response({"detail": str(exc)}, status=400)
+
+    try:
+        limit = int(request.GET.get("limit", alert_setting("PAGE_SIZE")))
+    except ValueError:
+        return Response({"detail": "limit must be an integer"}, status=400)
+    limit = max(1, min(limit, alert_setting("MAX_PAGE_SIZE")))
+
+    try:
+        page, next_cursor = keyset_page(alerts, request.GET.get("cursor"), limit)
+    except ValueError:
+        return Response({"detail": "Invalid cursor"}, status=400)
+
+    response = Response(AlertSerializer(page, many=True).data)
+    if next_cursor:
+        response["X-Next-Cursor"] = next_cursor
+    return response
+
+
+@api_view(["GET"])
+@permission_classes([IsAuthenticated])
+def alert_counts(request):
+    """Open alerts per type and in total, for badges"""
+    return Response(open_counts(request.user.id))
+
 
 @api_view(["POST"])
 @permission_classes([IsAuthenticated])
-def resolve_alert(request, pk):
+def bulk_resolve_alerts(request):
+    """Resolve the caller's alerts named by ids or a filter, in one UPDATE"""
     try:
-        alert = Alert.objects.get(pk=pk)
-        
-        user_equipment = Equipment.objects.filter(owner=request.user).values_list('device_id', flat=True)
-        user_employees = Employee.objects.filter(owner=request.user).values_list('tracker_device_id', flat=True)
-        
-        user_equipment = [device_id for device_id in user_equipment if device_id]
-        user_employees = [device_id for device_id in user_employees if device_id]
-        
-        all_device_ids = user_equipment + user_employees
-        
-        if alert.gps_data.device_id not in all_device_ids:
-            return Response({"error": "Alert not found or access denied"}, status=404)
-            
-        alert.is_resolved = True
-        alert.save()
-        return Response({"status": "resolved"})
-    except Alert.DoesNotExist:
-        return Response({"error": "Alert not found"}, status=404)
+        alerts = _bulk_selection(request)
+    except ValueError as exc:
+        return Response({"detail": str(exc)}, status=400)
+    closing = list(alerts.filter(is_resolved=False).values_list("id", flat=True))
+    resolved = resolve_alerts(alerts)
+    alert_policy.alerts_closed(closing)
+    return Response({"status": "success", "resolved": resolved})
+
+
+@api_view(["POST"])
+@permission_classes([IsAuthenticated])
+def bulk_delete_alerts(request):
+    """Delete the caller's alerts named by ids or a filter"""
+    try:
+        alerts = _bulk_selection(request)
+    except ValueError as exc:
+        return Response({"detail": str(exc)}, status=400)
+    # Counter changes from the per-row delete signals are written once
+    with counters.batched():
+        deleted = alerts.delete()[1].get("tracking.Alert", 0)
+    return Response({"status": "success", "deleted": deleted})
+
+
+@api_view(["POST"])
+@permission_classes([IsAuthenticated])
+def resolve_alert(request, pk):
+    alert = Alert.objects.filter(pk=pk, owner=request.user).first()
+    if alert is None:
+        return Response({"error": "Alert not found or access denied"}, status=404)
+    _resolve_one(alert)
+    return Response({"status": "resolved"})
 
 # ------------------------------
 # Owner Management
@@ -442,6 +811,10 @@ class GeofenceViewSet(viewsets.ModelViewSet):
     def get_queryset(self):
         return Geofence2.objects.filter(owner=self.request.user, is_active=True)
 
+    @method_decorator(cached_response("geofences"))
+    def list(self, request, *args, **kwargs):
+        return super().list(request, *args, **kwargs)
+
     def perform_create(self, serializer):
         serializer.save(owner=self.request.user)
 
@@ -487,8 +860,11 @@ class GeofenceViewSet(viewsets.ModelViewSet):
             # Ensure polygon is closed
             if coordinates[0] != coordinates[-1]:
                 coordinates.append(coordinates[0])
-                
-            geofence.coordinates = coordinates
+
+            tolerance = request.data.get('simplify_tolerance_m')
+            geofence.coordinates = simplify_geofence(
+                coordinates, float(tolerance) if tolerance is not None else None
+            )
             geofence.save()
             
             return Response(GeofenceSerializer2(geofence).data)
@@ -564,6 +940,11 @@ def user_profile_detail(request):
         return Response(serializer.data)
 
     elif request.method in ["PUT", "PATCH"]:
+        # Validate OwnerProfile updates first so a bad threshold changes nothing
+        settings_serializer = OwnerSettingsSerializer(profile, data=request.data, partial=True)
+        if not settings_serializer.is_valid():
+            return Response(settings_serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
         # Handle User model updates
         user = request.user
         user_fields = ['username', 'email', 'first_name', 'last_name']
@@ -574,11 +955,7 @@ def user_profile_detail(request):
         user.save()
         
         # Handle OwnerProfile updates
-        profile_fields = ['phone_number', 'address']
-        for field in profile_fields:
-            if field in request.data:
-                setattr(profile, field, request.data[field])
-        profile.save()
+        settings_serializer.save()
         
         # Return updated data
         serializer = OwnerProfileSerializer(profile)
@@ -683,18 +1060,14 @@ def clear_all_alerts(request):
     user = request.user
 
     # Get all device IDs for this user
-    user_equipment_ids = Equipment.objects.filter(owner=user).values_list('device_id', flat=True)
-    user_employee_ids = Employee.objects.filter(owner=user).values_list('tracker_device_id', flat=True)
-    all_device_ids = list(user_equipment_ids) + list(user_employee_ids)
+    all_device_ids = owner_device_ids(user.id)
 
     if not all_device_ids:
         return Response({"status": "no devices found, no alerts cleared"})
 
-    # Update all unresolved alerts for these devices
-    updated_count = Alert.objects.filter(
-        gps_data__device_id__in=all_device_ids,
-        is_resolved=False
-    ).update(is_resolved=True)
+    # One UPDATE over the owner's open alerts; counters move with it
+    updated_count = resolve_alerts(Alert.objects.filter(owner=user))
+    alert_policy.forget_devices(all_device_ids)
 
     return Response({
         "status": "success",
@@ -705,18 +1078,12 @@ def clear_all_alerts(request):
 @permission_classes([IsAuthenticated])
 def delete_alert(request, pk):
     try:
-        alert = Alert.objects.get(pk=pk)
-        user_equipment = Equipment.objects.filter(owner=request.user).values_list('device_id', flat=True)
-        user_employees = Employee.objects.filter(owner=request.user).values_list('tracker_device_id', flat=True)
-        all_device_ids = list(user_equipment) + list(user_employees)
-
-        if alert.gps_data.device_id not in all_device_ids:
-            return Response({"error": "Alert not found or access denied"}, status=404)
-
-        alert.delete()
-        return Response({"status": "deleted"}, status=200)
+        alert = Alert.objects.get(pk=pk, owner=request.user)
     except Alert.DoesNotExist:
-        return Response({"error": "Alert not found"}, status=404)
+        return Response({"error": "Alert not found or access denied"}, status=404)
+
+    alert.delete()
+    return Response({"status": "deleted"}, status=200)
 
 
 # ------------------------------